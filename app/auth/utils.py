@@ -173,11 +173,15 @@ def get_user_pdfs(user_id: str, db: Session = Depends(get_db)) -> Dict[str, PDFI
                         sources=[]  # Sources handling would need additional implementation
                     ))
 
-        # Count chunks
-        num_chunks = db.query(PDFChunk).filter(PDFChunk.pdf_id == pdf.id).count()
+        # Count chunks; identical uploads share one set of chunk rows, kept under one of their PDFs
+        if pdf.storage_id:
+            chunk_filter = PDFChunk.pdf_id.in_(db.query(PDF.id).filter(PDF.storage_id == pdf.storage_id))
+        else:
+            chunk_filter = PDFChunk.pdf_id == pdf.id
+        num_chunks = db.query(PDFChunk).filter(chunk_filter).count()
 
         # Calculate num_pages by counting unique page numbers in chunks
-        distinct_pages = db.query(PDFChunk.page_number).filter(PDFChunk.pdf_id == pdf.id).distinct().count()
+        distinct_pages = db.query(PDFChunk.page_number).filter(chunk_filter).distinct().count()
         # Use at least 1 page if no chunks have page numbers
         num_pages = max(1, distinct_pages)
 
@@ -1,10 +1,13 @@
 import os
-from sqlalchemy import create_engine, Column, String, Integer, Text, DateTime, ForeignKey, JSON, Boolean
+import logging
+from sqlalchemy import create_engine, inspect, Column, String, Integer, Text, DateTime, ForeignKey, JSON, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import json
 
+logger = logging.getLogger("database")
+
 # Check if we're using PostgreSQL or SQLite (fallback for local development)
 USE_POSTGRES = os.getenv("USE_POSTGRES", "false").lower() == "true"
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -41,6 +44,7 @@ class PDF(Base):
     chunks = relationship("PDFChunk", back_populates="pdf")
     user = relationship("User", back_populates="pdfs")
     file_path = Column(String)  # Store the path where the file is saved (could be S3 URL in the future)
+    storage_id = Column(String, ForeignKey("document_storage.id"), nullable=True, index=True)  # Shared chunk and vector storage; unset for PDFs stored under their own ID
 
 class PDFChunk(Base):
     __tablename__ = "pdf_chunks"
@@ -81,9 +85,60 @@ class Quiz(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     questions = Column(JSON)  # Store questions as JSON
 
+class PooledQuestion(Base):
+    __tablename__ = "question_pool"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    pdf_id = Column(String, ForeignKey("pdfs.id"), index=True)
+    difficulty = Column(String)
+    question = Column(JSON)  # One validated question with its answers and explanation
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DocumentStorage(Base):
+    __tablename__ = "document_storage"
+
+    id = Column(String, primary_key=True)  # Directory under db/pdfs holding the chunks, vectors and indexes
+    fingerprint = Column(String, unique=True, index=True)  # SHA-256 of the upload plus the chunking and embedding settings
+    file_path = Column(String)  # The original PDF, shared by every owner
+    ref_count = Column(Integer, default=0)  # PDFs using this storage
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    pdf_id = Column(String)  # ID the document is stored under once ingested
+    filename = Column(String)
+    upload_path = Column(String)  # Staged copy of the upload, moved into the user's storage when the job finishes
+    content_hash = Column(String, nullable=True)  # SHA-256 of the upload
+    status = Column(String, default="queued")  # queued, running, completed or failed
+    stage = Column(String, nullable=True)  # extracting, embedding or saving while running
+    pages_total = Column(Integer, default=0)
+    pages_extracted = Column(Integer, default=0)
+    chunks_total = Column(Integer, default=0)
+    chunks_embedded = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
 # Create tables
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    warn_missing_columns()
+
+def warn_missing_columns():
+    """Warn about columns added after a table was created, since create_all only creates missing tables."""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column.name for column in table.columns if column.name not in existing]
+        if missing:
+            logger.warning(f"Table {table.name} is missing columns {', '.join(missing)}; "
+                           f"run `alembic upgrade head` to update the database schema")
 
 # Get database session
 def get_db():
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form, Query, Path
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Form, Query, Path, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable, Iterable, Iterator, Union
+import asyncio
 import time
 import fitz  # PyMuPDF
 import io
@@ -10,12 +11,20 @@ import uuid
 from datetime import datetime
 from pathlib import Path as PathLib
 from sqlalchemy.orm import Session
-from ..services.embedding import EmbeddingService
+from ..services.embedding import EmbeddingService, embedding_cache, query_embedding_cache
 from ..services.retriever import Retriever
 from ..services.llm import LLMService
+from ..services.response_cache import response_cache
+from ..services.streaming import sse_event
+from ..services.semantic_cache import semantic_cache, CachedAnswer, SEMANTIC_CACHE_SEED_LIMIT
+from ..services.question_pool import QuestionPool
+from ..services.ingestion import IngestionQueue, UploadTooLargeError
+from ..services.multipart_upload import MalformedUploadError, MultipartFileStream
+from ..services.pdf_extractor import pdf_extractor
+from ..services.document_storage import document_storage
 from ..auth.utils import get_current_user, get_user_pdf_path, get_user_pdfs, add_conversation_to_pdf
-from ..database import get_db, PDF, PDFChunk, Quiz
-from models.pydantic_schemas import QuestionRequest, AnswerResponse, PDFUploadResponse, ChunkInfo, PDFInfo, QuizRequest, QuizResponse, QuizSubmission, QuizResult
+from ..database import get_db, SessionLocal, PDF, PDFChunk, Quiz, Conversation, Message, PooledQuestion, IngestionJob
+from models.pydantic_schemas import QuestionRequest, AnswerResponse, IngestionJobResponse, ChunkInfo, PDFInfo, QuizRequest, QuizResponse, QuizSubmission, QuizResult, LibrarySearchRequest, LibraryChunkInfo, LibrarySearchResponse
 
 router = APIRouter()
 
@@ -24,33 +33,37 @@ embedding_service = EmbeddingService()
 retriever = Retriever(embedding_service)
 llm_service = LLMService()
 
+# Retrieval mode for /ask when the request doesn't specify one
+DEFAULT_SEARCH_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
 
-def extract_text_from_pdf(pdf_file: bytes) -> List[str]:
+
+def extract_text_from_pdf(pdf_file: Union[bytes, str], progress_callback: Optional[Callable[[int, int], None]] = None) -> List[str]:
     """
     Extract text from a PDF file by page.
 
+    Long documents are split into page ranges extracted by a pool of worker
+    processes (see PDF_EXTRACT_WORKERS).
+
     Args:
-        pdf_file: PDF file bytes
+        pdf_file: PDF file bytes, or the path of a PDF file
+        progress_callback: Optional callable receiving (pages extracted, total pages)
 
     Returns:
         List of text strings, one per page
     """
     try:
-        doc = fitz.open(stream=pdf_file, filetype="pdf")
-        pages = []
-
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text = page.get_text()
-            pages.append(text)
-
-        return pages
+        return pdf_extractor.extract(pdf_file, progress_callback)
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
 
-def chunk_text(pages: List[str], chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
+# Chunking used for uploads; part of the fingerprint that lets identical uploads share storage
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def chunk_text(pages: List[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Dict[str, Any]]:
     """
     Chunk text from PDF pages with specified size and overlap.
 
@@ -62,22 +75,39 @@ def chunk_text(pages: List[str], chunk_size: int = 1000, overlap: int = 200) ->
     Returns:
         List of dictionaries with chunk text and metadata
     """
-    chunks = []
+    return list(iter_chunks(pages, chunk_size, overlap))
+
+
+def iter_chunks(pages: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[Dict[str, Any]]:
+    """
+    Chunk text from PDF pages as they arrive, yielding each page's chunks once the page is done.
+
+    Args:
+        pages: Page texts, in page order
+        chunk_size: Maximum characters per chunk
+        overlap: Overlap between consecutive chunks in characters
+
+    Yields:
+        Dictionaries with chunk text and metadata, the same ones chunk_text returns
+    """
+    # Whether any chunk has been yielded; a tiny tail is only dropped after the first chunk
+    any_chunks = False
 
     for page_num, page_text in enumerate(pages):
         if not page_text.strip():  # Skip empty pages
             continue
 
-        # Process each page
+        # Process each page; only the page's last chunk can still grow, so it is held until the page is done
+        chunks = []
         start = 0
         while start < len(page_text):
             # Extract chunk with specified size
             end = min(start + chunk_size, len(page_text))
 
             # Don't create tiny chunks at the end
-            if end - start < chunk_size // 3 and len(chunks) > 0:
+            if end - start < chunk_size // 3 and (any_chunks or chunks):
                 # Add this small chunk to the previous chunk if on same page
-                if chunks[-1]["page_number"] == page_num + 1:
+                if chunks:
                     chunks[-1]["text"] += " " + page_text[start:end].strip()
                 break
 
@@ -95,88 +125,272 @@ def chunk_text(pages: List[str], chunk_size: int = 1000, overlap: int = 200) ->
             if start < 0:
                 start = 0
 
-    return chunks
+        any_chunks = any_chunks or bool(chunks)
+        yield from chunks
+
+
+def iter_pdf_chunks(pdf_file: Union[bytes, str], progress_callback: Optional[Callable[[int, int], None]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Extract and chunk a PDF, yielding chunks while later pages are still being extracted.
+
+    Args:
+        pdf_file: PDF file bytes, or the path of a PDF file
+        progress_callback: Optional callable receiving (pages extracted, total pages)
+
+    Yields:
+        Dictionaries with chunk text and metadata, in document order
+    """
+    return iter_chunks(pdf_extractor.iter_pages(pdf_file, progress_callback))
+
+
+def pdf_file_path(user_id: str, pdf_id: str) -> PathLib:
+    """Path an uploaded PDF is kept at in its owner's storage."""
+    return get_user_pdf_path(user_id) / f"{pdf_id}.pdf"
+
+
+def index_ingested_pdf(user_id: str, pdf_id: str) -> None:
+    """Make a newly ingested PDF searchable from the user's library and start its question pool."""
+    # Add the new chunks to the user's library-wide search index
+    try:
+        retriever.add_to_library(user_id, pdf_id)
+    except Exception as e:
+        print(f"Error adding PDF to library index: {e}")
+
+    # Pre-generate quiz questions in the background when the pool is enabled
+    question_pool.schedule_fill(pdf_id)
 
 
-@router.post("/upload", response_model=PDFUploadResponse)
+# Background extraction, chunking and embedding of uploads (see INGESTION_WORKERS)
+ingestion_queue = IngestionQueue(
+    retriever, iter_pdf_chunks, pdf_file_path, index_ingested_pdf,
+    storage_settings=f"chunk_size={CHUNK_SIZE};overlap={CHUNK_OVERLAP};embedding_model={embedding_service.model}"
+)
+
+
+@router.on_event("startup")
+async def convert_legacy_storage():
+    """Convert legacy chunks.json directories before any request reads them."""
+    converted = await asyncio.to_thread(retriever.store.convert_all)
+    if converted:
+        print(f"Converted {converted} legacy document directories to the binary storage format")
+
+
+@router.on_event("startup")
+async def start_ingestion_workers():
+    """Start the ingestion workers, resuming jobs a previous run left unfinished."""
+    ingestion_queue.start()
+
+
+@router.on_event("shutdown")
+async def stop_ingestion_workers():
+    await ingestion_queue.stop()
+    pdf_extractor.shutdown()
+
+
+# The upload body is parsed by MultipartFileStream rather than a File parameter, so describe it here
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+}
+
+
+@router.post("/upload", response_model=IngestionJobResponse, status_code=202, openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_pdf(
-    file: UploadFile = File(...),
+    request: Request,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Upload a PDF file, extract and chunk text, create embeddings.
-    """
-    start_time = time.time()
+    Upload a PDF file (form field "file") and queue it for text extraction, chunking and embedding.
 
-    if not file.filename.lower().endswith(".pdf"):
+    Returns straight away with a job; poll /upload/{job_id} for progress and
+    for the PDF ID once the job has completed. The file is parsed out of the
+    request body as it arrives and written straight to the staging directory.
+    Bodies whose Content-Length is over MAX_UPLOAD_MB are rejected before
+    reading them, and others as soon as the file grows past the limit.
+    """
+    try:
+        ingestion_queue.check_content_length(request.headers.get("content-length"))
+        file = MultipartFileStream(request.headers, request.stream())
+        filename = await file.open()
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MalformedUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="File must be a PDF")
 
-    # Read the PDF file
-    content = await file.read()
+    try:
+        staged = await ingestion_queue.stage(file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MalformedUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error receiving PDF: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
     try:
-        # Extract text from the PDF by page
-        pages = extract_text_from_pdf(content)
+        job = await ingestion_queue.submit(db, current_user["user_id"], filename, staged)
+        return ingestion_queue.status(job)
+    except Exception as e:
+        print(f"Error queueing PDF: {e}")
+        ingestion_queue.discard(staged)
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
-        # Chunk the text
-        chunks_with_metadata = chunk_text(pages)
 
-        if not chunks_with_metadata:
-            raise HTTPException(status_code=400, detail="No text could be extracted from the PDF")
+@router.get("/upload/{job_id}", response_model=IngestionJobResponse)
+async def get_upload_status(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Get the status and progress of an upload's ingestion job.
+    """
+    job = db.query(IngestionJob).filter(
+        IngestionJob.id == job_id,
+        IngestionJob.user_id == current_user["user_id"]
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload job not found")
 
-        # Get just the text for embedding
-        chunk_texts = [chunk["text"] for chunk in chunks_with_metadata]
+    return ingestion_queue.status(job)
 
-        # Add document to retriever
-        pdf_id = await retriever.add_document(chunk_texts, chunks_with_metadata)
 
-        # Save the PDF to user's storage
-        user_id = current_user["user_id"]
-        user_pdf_dir = get_user_pdf_path(user_id)
-        pdf_path = user_pdf_dir / f"{pdf_id}.pdf"
-
-        # Write PDF file to disk
-        with open(pdf_path, "wb") as f:
-            # Reset file position to beginning
-            await file.seek(0)
-            # Write the content
-            f.write(content)
-
-        # Create PDF record in database
-        new_pdf = PDF(
-            id=pdf_id,
-            user_id=user_id,
-            title=file.filename,
-            filename=file.filename,
-            file_path=str(pdf_path)
-        )
-        db.add(new_pdf)
-
-        # Add chunks to database
-        for i, chunk in enumerate(chunks_with_metadata):
-            pdf_chunk = PDFChunk(
-                pdf_id=pdf_id,
-                content=chunk["text"],
-                page_number=chunk["page_number"]
-            )
-            db.add(pdf_chunk)
+# Background tasks loading each document's conversation history into the semantic answer cache
+semantic_cache_seed_tasks: Dict[str, asyncio.Task] = {}
 
-        db.commit()
 
-        processing_time = time.time() - start_time
+async def seed_semantic_cache(pdf_id: str, db: Session) -> None:
+    """
+    Load a document's most recent questions and answers into the semantic answer cache.
 
-        return PDFUploadResponse(
-            pdf_id=pdf_id,
-            filename=file.filename,
-            num_pages=len(pages),
-            num_chunks=len(chunks_with_metadata),
-            processing_time=processing_time
-        )
+    At most SEMANTIC_CACHE_SEED_LIMIT questions are embedded.
 
+    Args:
+        pdf_id: The document whose conversation history to load
+        db: Database session
+    """
+    messages = (
+        db.query(Message)
+        .join(Conversation, Message.conversation_id == Conversation.id)
+        .filter(Conversation.pdf_id == pdf_id)
+        .order_by(Message.id.desc())
+        .limit(SEMANTIC_CACHE_SEED_LIMIT * 2)
+        .all()
+    )
+
+    # Each conversation holds one question and its answer
+    conversations: Dict[str, Dict[bool, str]] = {}
+    for message in reversed(messages):
+        conversations.setdefault(message.conversation_id, {})[message.is_user] = message.content
+    pairs = [(turns[True], turns[False]) for turns in conversations.values() if turns.get(True) and turns.get(False)]
+
+    embeddings = await embedding_service.create_embeddings([question for question, _ in pairs]) if pairs else []
+    semantic_cache.seed(pdf_id, [(question, embedding, answer) for (question, answer), embedding in zip(pairs, embeddings)])
+
+
+async def _seed_semantic_cache_in_background(pdf_id: str) -> None:
+    db = SessionLocal()
+    try:
+        await seed_semantic_cache(pdf_id, db)
     except Exception as e:
-        print(f"Error processing PDF: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+        print(f"Error seeding semantic answer cache: {e}")
+    finally:
+        db.close()
+
+
+def schedule_semantic_cache_seed(pdf_id: str) -> None:
+    """
+    Start loading a document's history into the semantic answer cache unless that is already under way.
+
+    Must be called from the event loop. Requests don't wait for it; until it
+    finishes they only see answers given in this worker.
+
+    Args:
+        pdf_id: The document whose conversation history to load
+    """
+    task = semantic_cache_seed_tasks.get(pdf_id)
+    if task is not None and not task.done():
+        return
+
+    task = asyncio.create_task(_seed_semantic_cache_in_background(pdf_id))
+    semantic_cache_seed_tasks[pdf_id] = task
+
+    def forget(finished: asyncio.Task) -> None:
+        if semantic_cache_seed_tasks.get(pdf_id) is finished:
+            del semantic_cache_seed_tasks[pdf_id]
+
+    task.add_done_callback(forget)
+
+
+def cancel_semantic_cache_seed(pdf_id: str) -> None:
+    """Stop loading a document's history into the semantic answer cache, for example because it was deleted."""
+    task = semantic_cache_seed_tasks.pop(pdf_id, None)
+    if task is not None:
+        task.cancel()
+
+
+async def find_cached_answer(request: QuestionRequest, search_mode: str) -> Tuple[Optional[CachedAnswer], Optional[List[float]]]:
+    """
+    Look a question up in the semantic answer cache.
+
+    Args:
+        request: The question request
+        search_mode: Retrieval mode for the request
+
+    Returns:
+        Tuple of (cached answer or None, question embedding). The embedding is None
+        when the cache was skipped, which happens for opted-out requests and for
+        lexical search, which otherwise makes no embedding call
+    """
+    if not request.use_cache or search_mode == "lexical":
+        return None, None
+
+    query_embedding = await embedding_service.create_single_embedding(request.question)
+
+    if not semantic_cache.is_seeded(request.pdf_id):
+        schedule_semantic_cache_seed(request.pdf_id)
+
+    hit = semantic_cache.lookup(request.pdf_id, query_embedding)
+    if hit is None:
+        return None, query_embedding
+    return hit[0], query_embedding
+
+
+async def retrieve_context(request: QuestionRequest, search_mode: str, cached: Optional[CachedAnswer],
+                           query_embedding: Optional[List[float]]) -> List[Dict]:
+    """
+    Get the chunks to answer from, or that a cached answer was based on.
+
+    Args:
+        request: The question request
+        search_mode: Retrieval mode for the request
+        cached: Semantic cache hit, if any
+        query_embedding: Embedding of the question, if already computed
+
+    Returns:
+        List of relevant document chunks
+    """
+    if cached is None:
+        return await retriever.search(request.question, request.pdf_id, top_k=5, mode=search_mode, query_embedding=query_embedding)
+    if cached.sources is not None:
+        return cached.sources
+    # Answers seeded from history have no stored sources; find them again for the original question
+    return await retriever.search(cached.question, request.pdf_id, top_k=5, mode=search_mode,
+                                  query_embedding=cached.embedding.tolist())
 
 
 @router.post("/ask", response_model=AnswerResponse)
@@ -199,14 +413,28 @@ async def ask_question(
         if not pdf:
             raise HTTPException(status_code=404, detail="PDF not found in your library")
 
+        # Reuse the answer to an earlier question that means the same thing
+        search_mode = request.search_mode or DEFAULT_SEARCH_MODE
+        cached, query_embedding = await find_cached_answer(request, search_mode)
+
         # Find relevant chunks
-        context_chunks = await retriever.search(request.question, request.pdf_id, top_k=5)
+        context_chunks = await retrieve_context(request, search_mode, cached, query_embedding)
 
         if not context_chunks:
             raise HTTPException(status_code=404, detail="No relevant content found")
 
-        # Generate answer using LLM
-        answer = await llm_service.generate_answer(request.question, context_chunks)
+        if cached:
+            answer = cached.answer
+            context_tokens = 0
+        else:
+            # Fit the best chunks into the model's context budget
+            packed = llm_service.pack_context(context_chunks)
+            context_tokens = packed.tokens
+
+            # Generate answer using LLM
+            answer = await llm_service.generate_answer(request.question, packed.chunks, use_cache=request.use_cache)
+            if query_embedding is not None:
+                semantic_cache.add(request.pdf_id, request.question, query_embedding, answer, context_chunks)
 
         # Format response with source chunks
         source_chunks = [
@@ -233,7 +461,8 @@ async def ask_question(
         return AnswerResponse(
             answer=answer,
             source_chunks=source_chunks,
-            processing_time=processing_time
+            processing_time=processing_time,
+            context_tokens=context_tokens
         )
 
     except Exception as e:
@@ -241,6 +470,104 @@ async def ask_question(
         raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
 
 
+@router.post("/ask/stream")
+async def ask_question_stream(
+    request: QuestionRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Answer a question about a previously uploaded PDF as a stream of server-sent events.
+
+    Events, in order: `sources` with the retrieved chunks, `token` for each piece of the
+    answer as it is generated, then `done` with the full answer and timings. An `error`
+    event replaces `done` if generation fails part way.
+    """
+    start_time = time.time()
+
+    # Ownership and retrieval errors are reported as normal HTTP errors before streaming starts
+    user_id = current_user["user_id"]
+    pdf = db.query(PDF).filter(PDF.id == request.pdf_id, PDF.user_id == user_id).first()
+    if not pdf:
+        raise HTTPException(status_code=404, detail="PDF not found in your library")
+
+    try:
+        search_mode = request.search_mode or DEFAULT_SEARCH_MODE
+        cached, query_embedding = await find_cached_answer(request, search_mode)
+        context_chunks = await retrieve_context(request, search_mode, cached, query_embedding)
+    except Exception as e:
+        print(f"Error answering question: {e}")
+        raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
+
+    if not context_chunks:
+        raise HTTPException(status_code=404, detail="No relevant content found")
+
+    source_chunks = [
+        ChunkInfo(
+            text=chunk["text"],
+            page_number=chunk["page_number"],
+            score=chunk["score"]
+        )
+        for chunk in context_chunks
+    ]
+    retrieval_time = time.time() - start_time
+
+    async def event_stream():
+        yield sse_event("sources", {"source_chunks": [chunk.dict() for chunk in source_chunks]})
+
+        if cached:
+            answer = cached.answer
+            context_tokens = 0
+            first_token_time = time.time() - start_time
+            yield sse_event("token", {"text": answer})
+        else:
+            packed = llm_service.pack_context(context_chunks)
+            context_tokens = packed.tokens
+            answer_parts = []
+            first_token_time = None
+            try:
+                async for token in llm_service.stream_answer(request.question, packed.chunks, use_cache=request.use_cache):
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                    answer_parts.append(token)
+                    yield sse_event("token", {"text": token})
+            except Exception as e:
+                print(f"Error streaming answer: {e}")
+                yield sse_event("error", {"detail": f"Error answering question: {str(e)}"})
+                return
+
+            answer = "".join(answer_parts)
+            if query_embedding is not None:
+                semantic_cache.add(request.pdf_id, request.question, query_embedding, answer, context_chunks)
+
+        processing_time = time.time() - start_time
+
+        # Save this Q&A to conversation history using database
+        add_conversation_to_pdf(
+            user_id,
+            request.pdf_id,
+            request.question,
+            answer,
+            [chunk.dict() for chunk in source_chunks],
+            db
+        )
+
+        yield sse_event("done", {
+            "answer": answer,
+            "retrieval_time": retrieval_time,
+            "first_token_time": first_token_time,
+            "processing_time": processing_time,
+            "context_tokens": context_tokens
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/library")
 async def get_user_library(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     """
@@ -250,6 +577,65 @@ async def get_user_library(current_user: dict = Depends(get_current_user), db: S
     return get_user_pdfs(user_id, db)
 
 
+@router.post("/library/search", response_model=LibrarySearchResponse)
+async def search_library(
+    request: LibrarySearchRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Search for relevant content across all PDFs in the user's library.
+    """
+    start_time = time.time()
+
+    try:
+        user_id = current_user["user_id"]
+        pdfs = db.query(PDF).filter(PDF.user_id == user_id).all()
+        filenames = {pdf.id: pdf.filename for pdf in pdfs}
+
+        chunks = await retriever.search_library(request.question, user_id, list(filenames), top_k=request.top_k)
+
+        results = [
+            LibraryChunkInfo(
+                pdf_id=chunk["pdf_id"],
+                filename=filenames.get(chunk["pdf_id"], ""),
+                text=chunk["text"],
+                page_number=chunk["page_number"],
+                score=chunk["score"]
+            )
+            for chunk in chunks
+        ]
+
+        return LibrarySearchResponse(
+            results=results,
+            processing_time=time.time() - start_time
+        )
+
+    except Exception as e:
+        print(f"Error searching library: {e}")
+        raise HTTPException(status_code=500, detail=f"Error searching library: {str(e)}")
+
+
+@router.get("/metrics")
+async def get_metrics(current_user: dict = Depends(get_current_user)):
+    """
+    Get cache and performance counters for this worker.
+    """
+    return {
+        "retriever_cache": retriever.cache_stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "embeddings": embedding_service.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "query_embedding_batches": embedding_service.coalescer.stats(),
+        "llm_response_cache": response_cache.stats(),
+        "semantic_answer_cache": semantic_cache.stats(),
+        "question_pool": question_pool.stats(),
+        "document_storage": document_storage.stats(),
+        "model_capabilities": llm_service.capabilities.stats(),
+        "ingestion": ingestion_queue.stats()
+    }
+
+
 @router.get("/pdf/{pdf_id}")
 async def get_pdf_file(
     pdf_id: str,
@@ -318,18 +704,28 @@ async def delete_pdf(
     if not pdf:
         raise HTTPException(status_code=404, detail="PDF not found in your library")
 
-    # Delete the PDF file if it exists
-    pdf_path = PathLib(pdf.file_path)
-    if pdf_path.exists():
-        os.remove(pdf_path)
+    # Drop this owner's cached answers, library entry and question pool
+    retriever.remove_from_library(user_id, pdf_id)
+    cancel_semantic_cache_seed(pdf_id)
+    semantic_cache.invalidate(pdf_id)
+    question_pool.cancel(pdf_id)
 
-    # Delete PDF chunks from database
-    db.query(PDFChunk).filter(PDFChunk.pdf_id == pdf_id).delete()
+    # Delete pooled quiz questions, and the PDF chunks unless other owners of the same document still use them
+    db.query(PooledQuestion).filter(PooledQuestion.pdf_id == pdf_id).delete()
+    file_path = pdf.file_path
+    reclaimed_storage_id = document_storage.release(db, pdf)
 
     # Delete the PDF from database
     db.delete(pdf)
     db.commit()
 
+    # The file, chunks and vectors are shared by identical uploads and only removed with the last owner
+    if reclaimed_storage_id is not None:
+        pdf_path = PathLib(file_path)
+        if pdf_path.exists():
+            os.remove(pdf_path)
+        await asyncio.to_thread(retriever.delete_document, reclaimed_storage_id)
+
     return {"status": "success", "message": "PDF deleted successfully"}
 
 
@@ -391,6 +787,59 @@ async def get_page_preview(
         raise HTTPException(status_code=500, detail=f"Error generating preview: {str(e)}")
 
 
+def build_quiz_prompts(num_questions: int, difficulty: str, context: str) -> Tuple[str, str]:
+    """
+    Build the system and user prompts for quiz generation.
+
+    Args:
+        num_questions: Number of questions to ask for
+        difficulty: Difficulty level
+        context: Document text the questions should be based on
+
+    Returns:
+        Tuple of (system prompt, user prompt)
+    """
+    system_prompt = f"""
+    You are an educational quiz generator. Based on the provided content, create {num_questions} multiple-choice
+    questions at {difficulty} difficulty level.
+
+    For each question:
+    1. Create a clear, concise question based on important concepts in the material
+    2. Generate four possible answers where only one is correct
+    3. Include a brief explanation for why the correct answer is right
+
+    Ensure questions test understanding, not just memorization. Vary question types to test different cognitive skills.
+    """
+
+    user_prompt = f"""
+    Please generate {num_questions} multiple-choice questions based on this content:
+
+    {context}
+
+    Format your response as a JSON object with the following structure:
+    {{
+        "questions": [
+            {{
+                "question": "Question text here?",
+                "answers": [
+                    {{"text": "First option", "is_correct": false}},
+                    {{"text": "Second option", "is_correct": false}},
+                    {{"text": "Correct option", "is_correct": true}},
+                    {{"text": "Fourth option", "is_correct": false}}
+                ],
+                "explanation": "Explanation of why the correct answer is right"
+            }}
+        ]
+    }}
+    """
+
+    return system_prompt, user_prompt
+
+
+# Pre-generated questions, filled after upload (see QUESTION_POOL_ENABLED)
+question_pool = QuestionPool(llm_service, retriever, build_quiz_prompts)
+
+
 @router.post("/quiz/generate", response_model=QuizResponse)
 async def generate_quiz(
     request: QuizRequest,
@@ -411,59 +860,30 @@ async def generate_quiz(
         if not pdf:
             raise HTTPException(status_code=404, detail="PDF not found in your library")
 
-        # Get comprehensive context from the PDF for quiz generation
-        all_chunks = await retriever.search(
-            "Generate comprehensive quiz questions",
-            request.pdf_id,
-            top_k=10  # Increase for broader context
-        )
+        # Serve pre-generated questions when the pool has enough
+        pooled = question_pool.draw(db, request.pdf_id, request.difficulty, request.num_questions) if request.use_cache else None
 
-        if not all_chunks:
-            raise HTTPException(status_code=404, detail="Could not extract enough content for quiz generation")
-
-        # Concatenate context for the LLM
-        context = "\n\n".join([chunk["text"] for chunk in all_chunks])
-
-        # Prepare the prompt for quiz generation
-        system_prompt = f"""
-        You are an educational quiz generator. Based on the provided content, create {request.num_questions} multiple-choice
-        questions at {request.difficulty} difficulty level.
-
-        For each question:
-        1. Create a clear, concise question based on important concepts in the material
-        2. Generate four possible answers where only one is correct
-        3. Include a brief explanation for why the correct answer is right
-
-        Ensure questions test understanding, not just memorization. Vary question types to test different cognitive skills.
-        """
-
-        user_prompt = f"""
-        Please generate {request.num_questions} multiple-choice questions based on this content:
-
-        {context}
-
-        Format your response as a JSON object with the following structure:
-        {{
-            "questions": [
-                {{
-                    "question": "Question text here?",
-                    "answers": [
-                        {{"text": "First option", "is_correct": false}},
-                        {{"text": "Second option", "is_correct": false}},
-                        {{"text": "Correct option", "is_correct": true}},
-                        {{"text": "Fourth option", "is_correct": false}}
-                    ],
-                    "explanation": "Explanation of why the correct answer is right"
-                }}
-            ]
-        }}
-        """
-
-        # Generate quiz using the LLM
-        quiz_json = await llm_service.generate_structured_response(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt
-        )
+        if pooled is not None:
+            quiz_json = {"questions": pooled}
+        else:
+            # One representative chunk per topic, so the quiz covers the whole PDF
+            all_chunks = await asyncio.to_thread(retriever.get_topic_chunks, request.pdf_id)
+
+            if not all_chunks:
+                raise HTTPException(status_code=404, detail="Could not extract enough content for quiz generation")
+
+            # Concatenate context for the LLM
+            context = "\n\n".join([chunk["text"] for chunk in llm_service.pack_context(all_chunks).chunks])
+
+            # Prepare the prompt for quiz generation
+            system_prompt, user_prompt = build_quiz_prompts(request.num_questions, request.difficulty, context)
+
+            # Generate quiz using the LLM
+            quiz_json = await llm_service.generate_structured_response(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                use_cache=request.use_cache
+            )
 
         processing_time = time.time() - start_time
 
@@ -492,6 +912,93 @@ async def generate_quiz(
         raise HTTPException(status_code=500, detail=f"Error generating quiz: {str(e)}")
 
 
+@router.post("/quiz/generate/stream")
+async def generate_quiz_stream(
+    request: QuizRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Generate a multiple-choice quiz as a stream of server-sent events.
+
+    A `question` event is sent for each question as soon as the model has finished
+    writing it, then `done` with the stored quiz ID and timings. An `error` event
+    replaces `done` if generation fails part way.
+    """
+    start_time = time.time()
+
+    user_id = current_user["user_id"]
+    pdf = db.query(PDF).filter(PDF.id == request.pdf_id, PDF.user_id == user_id).first()
+    if not pdf:
+        raise HTTPException(status_code=404, detail="PDF not found in your library")
+
+    try:
+        pooled = question_pool.draw(db, request.pdf_id, request.difficulty, request.num_questions) if request.use_cache else None
+        all_chunks = await asyncio.to_thread(retriever.get_topic_chunks, request.pdf_id) if pooled is None else []
+    except Exception as e:
+        print(f"Error generating quiz: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating quiz: {str(e)}")
+
+    if pooled is None and not all_chunks:
+        raise HTTPException(status_code=404, detail="Could not extract enough content for quiz generation")
+
+    async def generate_questions():
+        if pooled is not None:
+            for question in pooled:
+                yield question
+            return
+        context = "\n\n".join([chunk["text"] for chunk in llm_service.pack_context(all_chunks).chunks])
+        system_prompt, user_prompt = build_quiz_prompts(request.num_questions, request.difficulty, context)
+        async for question in llm_service.stream_quiz_questions(system_prompt, user_prompt, use_cache=request.use_cache):
+            yield question
+
+    async def event_stream():
+        questions = []
+        first_question_time = None
+        try:
+            async for question in generate_questions():
+                if first_question_time is None:
+                    first_question_time = time.time() - start_time
+                yield sse_event("question", {"index": len(questions), "question": question})
+                questions.append(question)
+        except Exception as e:
+            print(f"Error streaming quiz: {e}")
+            yield sse_event("error", {"detail": f"Error generating quiz: {str(e)}"})
+            return
+
+        if not questions:
+            yield sse_event("error", {"detail": "Error generating quiz: no questions were generated"})
+            return
+
+        # Store quiz in database
+        quiz_id = str(uuid.uuid4())
+        quiz = Quiz(
+            id=quiz_id,
+            pdf_id=request.pdf_id,
+            user_id=user_id,
+            title=f"Quiz for {pdf.filename}",
+            questions={"questions": questions}
+        )
+        db.add(quiz)
+        db.commit()
+
+        yield sse_event("done", {
+            "quiz_id": quiz_id,
+            "pdf_id": request.pdf_id,
+            "filename": pdf.filename,
+            "num_questions": len(questions),
+            "first_question_time": first_question_time,
+            "processing_time": time.time() - start_time
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.post("/quiz/submit", response_model=QuizResult)
 async def submit_quiz(
     submission: QuizSubmission,
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import json
@@ -12,9 +12,11 @@ from pathlib import Path
 import logging
 import time
 import inspect
+from sqlalchemy.orm import Session
 
 # Import auth utilities
 from ..auth.utils import get_current_user
+from ..database import get_db, PDF, Quiz
 
 # Set up logging with more detailed formatting
 logging.basicConfig(
@@ -57,6 +59,8 @@ logger.debug(f"ROOT_DIR set to: {ROOT_DIR}")
 try:
     from app.services.llm import LLMService, get_llm_client
     from app.services.retriever import Retriever
+    from app.services.streaming import sse_event
+    from app.services.quiz_generator import QuizGenerator
     logger.debug("Services imported successfully")
 except Exception as e:
     logger.critical(f"Failed to import services: {str(e)}")
@@ -68,6 +72,7 @@ router = APIRouter()
 try:
     llm_service = LLMService()
     logger.debug(f"LLM service initialized with model: {llm_service.model}")
+    quiz_generator = QuizGenerator(llm_service)
     # Check if we can access the OpenAI API key (using the get_llm_client function)
     client = get_llm_client()
     logger.debug(f"LLM client API key exists: {bool(client.api_key)}")
@@ -75,6 +80,7 @@ except Exception as e:
     logger.critical(f"Failed to initialize LLM service: {str(e)}")
     logger.critical(traceback.format_exc())
     llm_service = None
+    quiz_generator = None
 
 try:
     retriever = Retriever()
@@ -87,6 +93,7 @@ except Exception as e:
 class QuizRequest(BaseModel):
     pdf_id: str
     num_questions: int = 5
+    use_cache: bool = True
 
 class QuizResponse(BaseModel):
     quiz_id: str
@@ -102,10 +109,61 @@ class SubmissionResult(BaseModel):
     percentage: float
     feedback: List[Dict]
 
+def build_quiz_prompts(pdf_title: str, num_questions: int, combined_content: str):
+    """
+    Build the system and user prompts for quiz generation.
+
+    Args:
+        pdf_title: Title used to refer to the document
+        num_questions: Number of questions to ask for
+        combined_content: Document text the questions should be based on
+
+    Returns:
+        Tuple of (system prompt, user prompt)
+    """
+    system_prompt = """
+    You are an expert quiz creator. Your task is to create multiple-choice questions based on the provided document content.
+    Each question should test understanding of key concepts from the document.
+    """
+
+    user_prompt = f"""
+    Create a quiz with {num_questions} multiple-choice questions based on this document titled "{pdf_title}".
+
+    DOCUMENT CONTENT:
+    {combined_content}
+
+    INSTRUCTIONS:
+    1. Each question should have 4 answer choices (A, B, C, D)
+    2. Exactly one answer should be marked as correct
+    3. Include an explanation for why the correct answer is right
+    4. Questions should cover key concepts from throughout the document
+    5. Questions should test understanding, not just memorization
+
+    FORMAT YOUR RESPONSE AS A JSON OBJECT with this structure:
+    {{
+        "questions": [
+            {{
+                "question": "Question text goes here?",
+                "answers": [
+                    {{ "text": "Option A", "is_correct": false }},
+                    {{ "text": "Option B", "is_correct": true }},
+                    {{ "text": "Option C", "is_correct": false }},
+                    {{ "text": "Option D", "is_correct": false }}
+                ],
+                "explanation": "Explanation of why the correct answer is right"
+            }},
+            ... more questions ...
+        ]
+    }}
+    """
+
+    return system_prompt, user_prompt
+
 @router.post("/generate")
 async def generate_quiz(
     request: QuizRequest = Body(...),
-    current_user: dict = Depends(get_current_user)  # Add authentication dependency
+    current_user: dict = Depends(get_current_user),  # Add authentication dependency
+    db: Session = Depends(get_db)
 ):
     """
     Generate a quiz based on PDF content.
@@ -113,6 +171,7 @@ async def generate_quiz(
     Args:
         request: The quiz generation request containing pdf_id and num_questions
         current_user: Current authenticated user
+        db: Database session
 
     Returns:
         Quiz data with questions and answers
@@ -139,51 +198,14 @@ async def generate_quiz(
             "num_questions": num_questions
         })
 
-        # Validate PDF ID exists
-        pdf_path = ROOT_DIR / "db" / "pdfs" / pdf_id
-        log_debug_info(f"Checking if PDF directory exists at {pdf_path}")
-
-        if not pdf_path.exists():
-            error_msg = f"PDF directory not found: {pdf_path}"
-            logger.error(error_msg)
+        # Validate the PDF is in the user's library; its chunks may be stored under another
+        # upload's ID when the same file was uploaded before, which the retriever resolves
+        pdf = db.query(PDF).filter(PDF.id == pdf_id, PDF.user_id == current_user["user_id"]).first()
+        if pdf is None:
+            logger.error(f"PDF {pdf_id} not found in the library of user {current_user['user_id']}")
             return JSONResponse(
                 status_code=404,
-                content={"message": "PDF not found", "path_checked": str(pdf_path)}
-            )
-
-        log_debug_info(f"PDF directory exists")
-
-        # Get a list of all files in the PDF directory
-        try:
-            dir_contents = list(pdf_path.glob('*'))
-            log_debug_info(f"Contents of PDF directory:", [str(f.name) for f in dir_contents])
-        except Exception as e:
-            log_debug_info(f"Error listing directory contents: {str(e)}")
-
-        # Load PDF metadata
-        pdf_info_path = pdf_path / "pdf_info.json"
-        log_debug_info(f"Checking if PDF info file exists at {pdf_info_path}")
-
-        if not pdf_info_path.exists():
-            error_msg = f"PDF info file not found: {pdf_info_path}"
-            logger.error(error_msg)
-            return JSONResponse(
-                status_code=404,
-                content={"message": "PDF metadata not found", "path_checked": str(pdf_info_path)}
-            )
-
-        log_debug_info(f"PDF info file exists, loading it")
-        try:
-            with open(pdf_info_path, "r", encoding='utf-8') as f:
-                pdf_info = json.load(f)
-                log_debug_info(f"Loaded PDF info", pdf_info)
-        except Exception as e:
-            error_msg = f"Error reading PDF info: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
-            return JSONResponse(
-                status_code=500,
-                content={"message": error_msg}
+                content={"message": "PDF not found"}
             )
 
         # Retrieve PDF content chunks
@@ -229,13 +251,10 @@ async def generate_quiz(
         except Exception as e:
             log_debug_info(f"Error examining first chunk: {str(e)}")
 
-        # Create combined content for quiz generation
-        log_debug_info(f"Creating combined content from chunks")
+        # Make sure every chunk exposes its content as "text"
+        log_debug_info(f"Checking chunk content fields")
         try:
-            # Correctly access the text field in each chunk
-            if "text" in content_chunks[0]:
-                combined_content = "\n\n".join([chunk["text"] for chunk in content_chunks])
-            else:
+            if "text" not in content_chunks[0]:
                 # Fallback if the structure is different
                 log_debug_info(f"Chunk structure doesn't contain 'text' field, attempting to identify content field")
                 # Try to guess which field might contain the text content
@@ -249,20 +268,13 @@ async def generate_quiz(
 
                 if found_field:
                     log_debug_info(f"Using '{found_field}' as content field")
-                    combined_content = "\n\n".join([chunk[found_field] for chunk in content_chunks])
+                    content_chunks = [{**chunk, "text": chunk[found_field]} for chunk in content_chunks]
                 else:
                     # Last resort: convert each chunk to string
                     log_debug_info(f"No recognized content field found, using string representation of chunks")
-                    combined_content = "\n\n".join([str(chunk) for chunk in content_chunks])
-
-            content_length = len(combined_content)
-            log_debug_info(f"Created combined content with {content_length} characters")
-            # Log a preview of the combined content
-            if content_length > 0:
-                content_preview = combined_content[:200] + "..." if content_length > 200 else combined_content
-                log_debug_info(f"Content preview", content_preview)
+                    content_chunks = [{**chunk, "text": str(chunk)} for chunk in content_chunks]
         except Exception as e:
-            error_msg = f"Error creating combined content: {str(e)}"
+            error_msg = f"Error preparing chunk content: {str(e)}"
             logger.error(error_msg)
             logger.error(traceback.format_exc())
             return JSONResponse(
@@ -270,94 +282,31 @@ async def generate_quiz(
                 content={"message": error_msg}
             )
 
-        # Prepare quiz generation prompt
         pdf_title = f"Document {pdf_id[:8]}"
-        log_debug_info(f"Creating quiz generation prompts")
-
-        system_prompt = """
-        You are an expert quiz creator. Your task is to create multiple-choice questions based on the provided document content.
-        Each question should test understanding of key concepts from the document.
-        """
-
-        user_prompt = f"""
-        Create a quiz with {num_questions} multiple-choice questions based on this document titled "{pdf_title}".
-
-        DOCUMENT CONTENT:
-        {combined_content}
-
-        INSTRUCTIONS:
-        1. Each question should have 4 answer choices (A, B, C, D)
-        2. Exactly one answer should be marked as correct
-        3. Include an explanation for why the correct answer is right
-        4. Questions should cover key concepts from throughout the document
-        5. Questions should test understanding, not just memorization
-
-        FORMAT YOUR RESPONSE AS A JSON OBJECT with this structure:
-        {{
-            "questions": [
-                {{
-                    "question": "Question text goes here?",
-                    "answers": [
-                        {{ "text": "Option A", "is_correct": false }},
-                        {{ "text": "Option B", "is_correct": true }},
-                        {{ "text": "Option C", "is_correct": false }},
-                        {{ "text": "Option D", "is_correct": false }}
-                    ],
-                    "explanation": "Explanation of why the correct answer is right"
-                }},
-                ... more questions ...
-            ]
-        }}
-        """
-
-        # Log prompt sizes
-        log_debug_info(f"Prompt statistics", {
-            "system_prompt_length": len(system_prompt),
-            "user_prompt_length": len(user_prompt),
-            "combined_content_length": len(combined_content)
-        })
 
-        # Call LLM to generate quiz
-        log_debug_info(f"Calling LLM service to generate quiz")
+        # Generate questions section by section so the whole document is covered
+        log_debug_info(f"Generating quiz from {len(content_chunks)} chunks")
         generation_start = time.time()
 
         try:
-            log_debug_info(f"About to call LLM service with prompts")
-            response = await llm_service.generate_structured_response(system_prompt, user_prompt)
+            questions = await quiz_generator.generate(
+                content_chunks,
+                num_questions,
+                lambda count, content: build_quiz_prompts(pdf_title, count, content),
+                use_cache=request.use_cache
+            )
             generation_time = time.time() - generation_start
-            log_debug_info(f"LLM response received in {generation_time:.2f}s", {
-                "response_type": type(response).__name__,
-                "has_error": "error" in response if isinstance(response, dict) else "N/A",
-                "keys": list(response.keys()) if isinstance(response, dict) else "N/A"
-            })
-
-            # Log a preview of the raw response if it's large
-            if isinstance(response, dict) and "raw_response" in response:
-                raw_preview = response["raw_response"][:300] + "..." if len(response["raw_response"]) > 300 else response["raw_response"]
-                log_debug_info("Raw response preview", raw_preview)
+            log_debug_info(f"Quiz generation finished in {generation_time:.2f}s")
 
-            # Validate the structure of the response
-            if isinstance(response, dict) and "error" in response:
-                error_msg = f"LLM error: {response.get('error', 'Unknown error')}"
+            if not questions:
+                error_msg = "LLM error: no questions were generated for any section of the document"
                 logger.error(error_msg)
-                if "raw_response" in response:
-                    logger.error(f"Raw response preview: {response['raw_response'][:300]}...")
                 return JSONResponse(
                     status_code=500,
                     content={"message": "Failed to generate quiz", "error": error_msg}
                 )
 
-            if not isinstance(response, dict) or "questions" not in response or not isinstance(response["questions"], list):
-                error_keys = list(response.keys()) if isinstance(response, dict) else "not a dict"
-                error_msg = f"Invalid response format from LLM: missing or invalid 'questions' field. Response keys: {error_keys}"
-                logger.error(error_msg)
-                return JSONResponse(
-                    status_code=500,
-                    content={"message": "Invalid quiz format", "error": error_msg}
-                )
-
             # Log the number of questions generated
-            questions = response["questions"]
             log_debug_info(f"Successfully generated {len(questions)} questions")
 
             # Log the first question as a sample
@@ -412,6 +361,122 @@ async def generate_quiz(
             content={"message": "Error generating quiz. Please try again.", "error": str(e)[:100]}
         )
 
+@router.post("/generate/stream")
+async def generate_quiz_stream(
+    request: QuizRequest = Body(...),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Generate a quiz as a stream of server-sent events.
+
+    Args:
+        request: The quiz generation request containing pdf_id and num_questions
+        current_user: Current authenticated user
+        db: Database session
+
+    Returns:
+        Event stream with a `question` event per question as soon as it is parsed,
+        then `done` with the ID of the stored quiz, or `error` if generation fails
+    """
+    start_time = time.time()
+    logger.info(f"Starting streamed quiz generation for PDF ID: {request.pdf_id} by user: {current_user['user_id']}")
+
+    if llm_service is None or retriever is None:
+        error_msg = "Quiz service initialization failed. See logs for details."
+        logger.error(error_msg)
+        return JSONResponse(
+            status_code=500,
+            content={"message": error_msg}
+        )
+
+    pdf_id = request.pdf_id
+    user_id = current_user["user_id"]
+    pdf = db.query(PDF).filter(PDF.id == pdf_id, PDF.user_id == user_id).first()
+    if pdf is None:
+        logger.error(f"PDF {pdf_id} not found in the library of user {user_id}")
+        return JSONResponse(
+            status_code=404,
+            content={"message": "PDF not found"}
+        )
+
+    try:
+        content_chunks = retriever.get_chunks_by_id(pdf_id)
+    except Exception as e:
+        error_msg = f"Error retrieving chunks: {str(e)}"
+        logger.error(error_msg)
+        logger.error(traceback.format_exc())
+        return JSONResponse(
+            status_code=500,
+            content={"message": error_msg}
+        )
+
+    if not content_chunks:
+        logger.error(f"No content chunks found for PDF {pdf_id}")
+        return JSONResponse(
+            status_code=404,
+            content={"message": "No content found for this PDF"}
+        )
+
+    pdf_title = f"Document {pdf_id[:8]}"
+
+    async def event_stream():
+        questions = []
+        first_question_time = None
+        try:
+            async for question in quiz_generator.stream(
+                content_chunks,
+                request.num_questions,
+                lambda count, content: build_quiz_prompts(pdf_title, count, content),
+                use_cache=request.use_cache
+            ):
+                if first_question_time is None:
+                    first_question_time = time.time() - start_time
+                    log_debug_info(f"First question streamed after {first_question_time:.2f}s")
+                yield sse_event("question", {"index": len(questions), "question": question})
+                questions.append(question)
+        except Exception as e:
+            logger.error(f"Error during streamed quiz generation: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield sse_event("error", {"message": "Error generating quiz. Please try again.", "error": str(e)[:100]})
+            return
+
+        if not questions:
+            yield sse_event("error", {"message": "Failed to generate quiz", "error": "No questions were generated"})
+            return
+
+        # Store the quiz so the ID sent to the client refers to it
+        quiz_id = str(uuid.uuid4())
+        try:
+            db.add(Quiz(
+                id=quiz_id,
+                pdf_id=pdf_id,
+                user_id=user_id,
+                title=f"Quiz for {pdf.filename}",
+                questions={"questions": questions}
+            ))
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error saving streamed quiz: {str(e)}")
+            logger.error(traceback.format_exc())
+            db.rollback()
+            yield sse_event("error", {"message": "Error saving quiz. Please try again.", "error": str(e)[:100]})
+            return
+
+        log_debug_info(f"Streamed {len(questions)} questions for quiz {quiz_id}")
+        yield sse_event("done", {
+            "quiz_id": quiz_id,
+            "num_questions": len(questions),
+            "first_question_time": first_question_time,
+            "processing_time": time.time() - start_time
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/submit")
 async def submit_quiz(
     request: dict = Body(...),
@@ -0,0 +1,318 @@
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by the total size of its values in bytes.
+
+    Entries can optionally expire a fixed time after they were stored.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = None, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Memory budget for all cached values together
+            sizeof: Function returning the size in bytes of a value (defaults to 1, so
+                max_bytes becomes a maximum number of entries)
+            ttl: Seconds after which an entry expires, or None to keep entries until evicted
+        """
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 1)
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a value and mark it as most recently used.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int = None) -> bool:
+        """
+        Add a value, evicting least recently used entries to stay within budget.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            size: Size of the value in bytes (computed with sizeof if omitted)
+
+        Returns:
+            False if the value alone exceeds the budget and was not cached
+        """
+        size = self.sizeof(value) if size is None else size
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return False
+
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove a key from the cache if present."""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache usage counters.
+
+        Returns:
+            Dictionary with hit/miss/eviction counters and current usage
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+class DiskCache:
+    """
+    Persistent key-value cache in a SQLite file, bounded by the total size of its values.
+
+    Values are stored as bytes. When the file grows past its budget, the least
+    recently read entries are evicted. Entries can optionally expire a fixed time
+    after they were stored. The database is opened on first use.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            path: Path of the SQLite database file
+            max_bytes: Size budget for all cached values together
+            ttl: Seconds after which an entry expires, or None to keep entries until evicted
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # WAL lets several workers read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, "
+                "stored_at REAL NOT NULL DEFAULT 0)"
+            )
+            # Files created before expiry support lack stored_at
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+            if "stored_at" not in columns:
+                conn.execute("ALTER TABLE entries ADD COLUMN stored_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            conn.commit()
+            self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _select(conn: sqlite3.Connection, columns: str, keys: List[str]) -> List[tuple]:
+        rows: List[tuple] = []
+        # Query in slices to stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(conn.execute(f"SELECT {columns} FROM entries WHERE key IN ({placeholders})", batch))
+        return rows
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Look up several keys at once and mark the found ones as recently used.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dictionary of the keys that were found and their values
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            expired = []
+            for key, value, stored_at in self._select(conn, "key, value, stored_at", keys):
+                if self.ttl is not None and stored_at + self.ttl <= now:
+                    expired.append(key)
+                else:
+                    found[key] = value
+            if expired:
+                self._delete(conn, expired)
+                self.expirations += len(expired)
+                conn.commit()
+            if found:
+                conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?", [(now, key) for key in found])
+                conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]) -> None:
+        """
+        Store several values, evicting least recently used entries to stay within budget.
+
+        Args:
+            items: (key, value) pairs
+        """
+        unique = dict(items)
+        rows = [(key, value, len(value)) for key, value in unique.items() if len(value) <= self.max_bytes]
+        if not rows:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            replaced = sum(size for (size,) in self._select(conn, "size", [key for key, _, _ in rows]))
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access, stored_at) VALUES (?, ?, ?, ?, ?)",
+                [(key, value, size, now, now) for key, value, size in rows]
+            )
+            self._bytes += sum(size for _, _, size in rows) - replaced
+            if self._bytes > self.max_bytes:
+                self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Other workers may share the file, so recount before evicting
+        self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if self._bytes <= self.max_bytes:
+            return
+
+        # Evict down to 90% of the budget so eviction doesn't run on every write
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        doomed: List[str] = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if self._bytes - freed <= target:
+                break
+            doomed.append(key)
+            freed += size
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in doomed])
+        self._bytes -= freed
+        self.evictions += len(doomed)
+
+    def _delete(self, conn: sqlite3.Connection, keys: List[str]) -> None:
+        freed = sum(size for (size,) in self._select(conn, "size", keys))
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+        self._bytes -= freed
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get one value and mark it as recently used.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        return self.get_many([key]).get(key)
+
+    def put(self, key: str, value: bytes) -> None:
+        """
+        Store one value.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+        """
+        self.put_many([(key, value)])
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM entries")
+            conn.commit()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache usage counters.
+
+        Returns:
+            Dictionary with hit/miss/eviction counters for this process and current usage
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,165 @@
+from typing import Any, Dict, List, Tuple
+import logging
+import os
+
+from app.services.tokens import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger("context_packer")
+
+# Tokens of document context per request by model family; the longest matching prefix wins
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-4o": 8000,
+    "gpt-4.1": 8000,
+    "gpt-4-turbo": 8000,
+    "gpt-4": 3000,
+    "gpt-3.5-turbo": 6000,
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+# Overrides the table for every model when set
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+
+# Tokens taken by the header each chunk gets in a prompt ("[DOCUMENT CHUNK n] Page p")
+CHUNK_OVERHEAD_TOKENS = 12
+# Longest overlap looked for between neighbouring chunks, and how much of a chunk's start is used to find it
+MAX_OVERLAP_CHARS = 400
+OVERLAP_PROBE_CHARS = 40
+
+
+def context_budget(model: str) -> int:
+    """
+    Get the number of context tokens to send with each request to a model.
+
+    Args:
+        model: Chat model name
+
+    Returns:
+        Token budget for document context
+    """
+    if CONTEXT_TOKEN_BUDGET > 0:
+        return CONTEXT_TOKEN_BUDGET
+    matches = [prefix for prefix in MODEL_CONTEXT_BUDGETS if model.startswith(prefix)]
+    return MODEL_CONTEXT_BUDGETS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_BUDGET
+
+
+class PackedContext:
+    """The chunks chosen for a prompt and the tokens they use."""
+
+    def __init__(self, chunks: List[Dict[str, Any]], tokens: int, budget: int, dropped: int):
+        # In document order, with overlapping text removed
+        self.chunks = chunks
+        self.tokens = tokens
+        self.budget = budget
+        # Chunks left out because they did not fit or repeated another chunk
+        self.dropped = dropped
+
+
+def _overlap(before: str, after: str) -> int:
+    """Length of the longest end of `before` that `after` starts with."""
+    probe = after[:OVERLAP_PROBE_CHARS]
+    if len(probe) < OVERLAP_PROBE_CHARS:
+        return 0
+    position = before.find(probe, max(0, len(before) - MAX_OVERLAP_CHARS))
+    while position != -1:
+        if after.startswith(before[position:]):
+            return len(before) - position
+        position = before.find(probe, position + 1)
+    return 0
+
+
+def _spread(count: int) -> List[int]:
+    """Positions 0..count-1 ordered so that every prefix is spread evenly over them: 0, n/2, n/4, 3n/4, ..."""
+    order: List[int] = []
+    seen = set()
+    parts = 1
+    while len(order) < count:
+        for j in range(parts):
+            position = j * count // parts
+            if position not in seen:
+                seen.add(position)
+                order.append(position)
+        parts *= 2
+    return order
+
+
+def _priority(chunks: List[Dict[str, Any]]) -> List[int]:
+    """
+    Order chunks best first.
+
+    Scored chunks come first, highest score first. Unscored chunks follow,
+    spread evenly over their input order, so a budget too small for all of
+    them samples the whole input instead of only its beginning. Ties keep
+    their input order.
+    """
+    unscored = [i for i, chunk in enumerate(chunks) if chunk.get("score") is None]
+    spread_rank = {unscored[position]: rank for rank, position in enumerate(_spread(len(unscored)))}
+
+    def key(i: int) -> Tuple[int, float, int]:
+        if i in spread_rank:
+            return (1, spread_rank[i], i)
+        return (0, -float(chunks[i]["score"]), i)
+
+    return sorted(range(len(chunks)), key=key)
+
+
+def pack_context(chunks: List[Dict[str, Any]], budget: int, model: str,
+                 overhead_tokens: int = CHUNK_OVERHEAD_TOKENS) -> PackedContext:
+    """
+    Fill a token budget with the best chunks.
+
+    Chunks are taken highest score first, then unscored chunks spread evenly
+    over the input, and returned in document order. Text a chunk shares with a neighbour that was
+    already taken, such as the overlap chunk_text leaves between consecutive
+    chunks, is removed so it is only sent once. A chunk that does not fit is
+    skipped in favour of smaller ones further down; if not even the best chunk
+    fits, it is cut to the budget.
+
+    Args:
+        chunks: Candidate chunks with "text" and optionally "score", "chunk_index" and "pdf_id"
+        budget: Maximum tokens for all chunks including their headers
+        model: Model whose tokenizer should be used
+        overhead_tokens: Tokens added per chunk for its header
+
+    Returns:
+        The packed context
+    """
+    # A chunk's place in its document: its index when known, otherwise its position in the input
+    positions = [(chunk.get("pdf_id", ""), chunk.get("chunk_index", i)) for i, chunk in enumerate(chunks)]
+    ranked = _priority(chunks)
+
+    selected: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    seen_texts = set()
+    used = 0
+
+    for i in ranked:
+        if budget - used <= overhead_tokens:
+            break
+
+        text = chunks[i].get("text", "")
+        key = " ".join(text.split())
+        if not key or key in seen_texts:
+            continue
+        seen_texts.add(key)
+
+        document, index = positions[i]
+        previous = selected.get((document, index - 1))
+        if previous is not None:
+            text = text[_overlap(previous["text"], text):]
+        following = selected.get((document, index + 1))
+        if following is not None:
+            text = text[:len(text) - _overlap(text, following["text"])]
+        if not text.strip():
+            continue
+
+        cost = count_tokens(text, model) + overhead_tokens
+        if used + cost > budget:
+            if selected:
+                continue
+            text = truncate_to_tokens(text, budget - overhead_tokens, model)
+            cost = count_tokens(text, model) + overhead_tokens
+
+        selected[positions[i]] = {**chunks[i], "text": text}
+        used += cost
+
+    packed = [selected[position] for position in sorted(selected)]
+    logger.info(f"Packed {len(packed)} of {len(chunks)} chunks into {used}/{budget} tokens")
+    return PackedContext(packed, used, budget, len(chunks) - len(packed))
@@ -0,0 +1,190 @@
+from typing import Any, Dict, Optional
+import hashlib
+import logging
+import threading
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, DocumentStorage, PDF, PDFChunk
+
+logger = logging.getLogger("document_storage")
+
+
+class DocumentStorageRegistry:
+    """
+    Chunk and vector storage shared by identical uploads.
+
+    Uploads are fingerprinted by the SHA-256 of their bytes and the settings
+    that shape their chunks and vectors. The first upload of a document is
+    ingested under its own PDF ID, which names the storage; later uploads with
+    the same fingerprint only get a PDF row pointing at it. Storage is
+    reference counted by its PDF rows and reclaimed with the last of them.
+    The PDFChunk rows are kept once per storage, under one of its PDFs.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        """
+        Initialize the registry.
+
+        Args:
+            session_factory: Creates database sessions for storage lookups
+        """
+        self.session_factory = session_factory
+        # Storage ID per PDF ID; fixed once the PDF row exists
+        self._storage_ids: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+        self.shared = 0
+        self.reclaimed = 0
+
+    @staticmethod
+    def fingerprint(content_hash: str, settings: str) -> str:
+        """
+        Fingerprint an upload.
+
+        Args:
+            content_hash: SHA-256 of the PDF bytes
+            settings: Chunking and embedding settings the stored chunks and vectors depend on
+
+        Returns:
+            Hex digest identifying the stored form of the document
+        """
+        return hashlib.sha256(f"{content_hash}\n{settings}".encode("utf-8")).hexdigest()
+
+    def find(self, db: Session, fingerprint: str) -> Optional[DocumentStorage]:
+        """Get the storage holding an already ingested copy of a document, if any."""
+        return db.query(DocumentStorage).filter(DocumentStorage.fingerprint == fingerprint).first()
+
+    def register(self, db: Session, pdf: PDF, fingerprint: str) -> DocumentStorage:
+        """
+        Record a newly ingested PDF's storage so later identical uploads can share it.
+
+        The storage is named after the PDF, whose chunks are already stored
+        under its ID. The caller commits; the commit fails with an
+        IntegrityError if another process registered the same fingerprint
+        first, in which case the PDF should share that storage instead.
+
+        Args:
+            db: Database session
+            pdf: The PDF row, not yet committed
+            fingerprint: The upload's fingerprint
+
+        Returns:
+            The new storage row
+        """
+        storage = DocumentStorage(id=pdf.id, fingerprint=fingerprint, file_path=pdf.file_path, ref_count=1)
+        db.add(storage)
+        pdf.storage_id = storage.id
+        return storage
+
+    def attach(self, db: Session, storage: DocumentStorage, pdf: PDF) -> None:
+        """
+        Point a PDF at an existing storage and count the reference. The caller commits.
+
+        The count is incremented in SQL, so owners added by other processes are not lost.
+
+        Args:
+            db: Database session
+            storage: The shared storage
+            pdf: The PDF row
+        """
+        pdf.storage_id = storage.id
+        self._add_reference(db, storage.id, 1)
+        self.shared += 1
+
+    def release(self, db: Session, pdf: PDF) -> Optional[str]:
+        """
+        Drop a PDF's reference to its storage before the PDF row is deleted. The caller commits.
+
+        The PDF's chunk rows move to another owner while the storage is
+        still in use, and are deleted with the last reference.
+
+        Args:
+            db: Database session
+            pdf: The PDF row about to be deleted
+
+        Returns:
+            ID of the storage to remove from disk, or None while other PDFs still use it
+        """
+        self.forget(pdf.id)
+        if not pdf.storage_id:
+            # Stored under its own ID before storage was shared
+            db.query(PDFChunk).filter(PDFChunk.pdf_id == pdf.id).delete()
+            self.reclaimed += 1
+            return pdf.id
+
+        storage = db.get(DocumentStorage, pdf.storage_id)
+        heir = db.query(PDF).filter(PDF.storage_id == pdf.storage_id, PDF.id != pdf.id).first()
+        if heir is not None:
+            db.query(PDFChunk).filter(PDFChunk.pdf_id == pdf.id).update({PDFChunk.pdf_id: heir.id},
+                                                                        synchronize_session=False)
+            if storage is not None:
+                self._add_reference(db, storage.id, -1)
+            return None
+
+        storage_id = pdf.storage_id
+        db.query(PDFChunk).filter(PDFChunk.pdf_id == pdf.id).delete()
+        pdf.storage_id = None
+        if storage is not None:
+            db.delete(storage)
+        self.reclaimed += 1
+        logger.info(f"Reclaiming storage {storage_id} with its last owner PDF ID {pdf.id}")
+        return storage_id
+
+    @staticmethod
+    def _add_reference(db: Session, storage_id: str, delta: int) -> None:
+        db.query(DocumentStorage).filter(DocumentStorage.id == storage_id).update(
+            {DocumentStorage.ref_count: func.coalesce(DocumentStorage.ref_count, 0) + delta},
+            synchronize_session=False
+        )
+
+    def storage_id(self, pdf_id: str) -> str:
+        """
+        Get the ID a PDF's chunks, vectors and indexes are stored under.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            The storage ID, which is the PDF ID itself unless the PDF shares another upload's storage
+        """
+        with self._lock:
+            storage_id = self._storage_ids.get(pdf_id)
+        if storage_id is not None:
+            return storage_id
+
+        db = self.session_factory()
+        try:
+            row = db.query(PDF.storage_id).filter(PDF.id == pdf_id).first()
+        except Exception as e:
+            logger.warning(f"Could not look up the storage of PDF ID {pdf_id}: {e}")
+            return pdf_id
+        finally:
+            db.close()
+        if row is None:
+            # No PDF row yet (an ingestion in progress) or any more; nothing to remember
+            return pdf_id
+
+        storage_id = row.storage_id or pdf_id
+        with self._lock:
+            self._storage_ids[pdf_id] = storage_id
+        return storage_id
+
+    def forget(self, pdf_id: str) -> None:
+        """Drop the remembered storage of a deleted PDF."""
+        with self._lock:
+            self._storage_ids.pop(pdf_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get deduplication counters.
+
+        Returns:
+            Dictionary with uploads that reused existing storage and storages reclaimed
+        """
+        return {"shared": self.shared, "reclaimed": self.reclaimed}
+
+
+# Shared by every Retriever and the ingestion queue in this process
+document_storage = DocumentStorageRegistry()
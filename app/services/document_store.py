@@ -0,0 +1,583 @@
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
+import faiss
+import json
+import os
+import time
+import logging
+import argparse
+import hashlib
+import shutil
+import threading
+import uuid
+from .lexical_index import LexicalIndex, LEXICAL_INDEX_FORMAT_VERSION
+from .topic_clusters import TopicClusters
+
+# Configure logging
+logger = logging.getLogger("document_store")
+logger.setLevel(logging.DEBUG)
+
+# Add file handler if not already added
+if not logger.handlers:
+    file_handler = logging.FileHandler("retriever.log")
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(file_handler)
+
+# On-disk storage format. Version 1 is the legacy chunks.json file with the
+# embeddings inlined as JSON lists; version 2 keeps the vectors in a raw
+# float32 file and the chunk texts/metadata in a JSON-lines file.
+STORAGE_FORMAT_VERSION = 2
+LEGACY_CHUNKS_FILENAME = "chunks.json"
+CHUNKS_FILENAME = "chunks.jsonl"
+EMBEDDINGS_FILENAME = "embeddings.f32"
+INFO_FILENAME = "pdf_info.json"
+
+# On-disk FAISS index format. Bump the version whenever the index type or the
+# way vectors are added changes, so stale index files get rebuilt on load.
+INDEX_FORMAT_VERSION = 1
+INDEX_FILENAME = "index.faiss"
+
+LEXICAL_INDEX_FILENAME = "lexical.json"
+
+# Cached k-means topics used to pick quiz context. Version 2 records a
+# fingerprint of the vectors they were computed from.
+TOPICS_FORMAT_VERSION = 2
+TOPICS_FILENAME = "topics.npz"
+
+
+def embeddings_fingerprint(embeddings: np.ndarray) -> str:
+    """SHA-256 of an embedding matrix, which changes whenever any vector does."""
+    digest = hashlib.sha256(str(embeddings.shape).encode())
+    digest.update(memoryview(np.ascontiguousarray(embeddings, dtype=np.float32)).cast("B"))
+    return digest.hexdigest()
+
+
+def _tmp_path(path: str) -> str:
+    """Get a temporary name to write a file under before renaming it into place, unique to this writer."""
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+
+
+class DocumentStore:
+    """On-disk storage for document chunks, embedding vectors and FAISS indexes."""
+
+    def __init__(self, pdfs_dir: str):
+        """
+        Initialize the document store.
+
+        Args:
+            pdfs_dir: Directory holding one subdirectory per PDF
+        """
+        self.pdfs_dir = pdfs_dir
+        os.makedirs(self.pdfs_dir, exist_ok=True)
+        # Serialize legacy conversions of the same PDF within this process
+        self._conversion_locks: Dict[str, threading.Lock] = {}
+        self._conversion_locks_guard = threading.Lock()
+
+    def pdf_dir(self, pdf_id: str) -> str:
+        """Get the storage directory for a PDF."""
+        return os.path.join(self.pdfs_dir, pdf_id)
+
+    def _path(self, pdf_id: str, filename: str) -> str:
+        return os.path.join(self.pdfs_dir, pdf_id, filename)
+
+    def read_info(self, pdf_id: str) -> Dict[str, Any]:
+        """
+        Read the pdf_info.json file for a PDF.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            The PDF info dictionary, or an empty dictionary if it is missing
+        """
+        info_file = self._path(pdf_id, INFO_FILENAME)
+        if not os.path.exists(info_file):
+            return {}
+        with open(info_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_info(self, pdf_id: str, info: Dict[str, Any]) -> None:
+        """
+        Atomically write the pdf_info.json file for a PDF.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            info: The PDF info dictionary to save
+        """
+        info_file = self._path(pdf_id, INFO_FILENAME)
+        tmp_file = _tmp_path(info_file)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp_file, info_file)
+
+    def has_chunks(self, pdf_id: str) -> bool:
+        """Check whether a PDF has chunks stored in either format."""
+        return self.is_legacy(pdf_id) or os.path.exists(self._path(pdf_id, CHUNKS_FILENAME))
+
+    def is_legacy(self, pdf_id: str) -> bool:
+        """Check whether a PDF is still stored in the legacy chunks.json format."""
+        if not os.path.exists(self._path(pdf_id, LEGACY_CHUNKS_FILENAME)):
+            return False
+        return self.read_info(pdf_id).get("storage", {}).get("format_version") != STORAGE_FORMAT_VERSION
+
+    def list_documents(self) -> List[str]:
+        """
+        List the IDs of all PDFs with stored chunks.
+
+        Returns:
+            Sorted list of PDF IDs
+        """
+        if not os.path.exists(self.pdfs_dir):
+            return []
+        return [pdf_id for pdf_id in sorted(os.listdir(self.pdfs_dir)) if self.has_chunks(pdf_id)]
+
+    def delete_document(self, pdf_id: str) -> None:
+        """
+        Remove everything stored for a PDF, including partially written files.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+        """
+        shutil.rmtree(self.pdf_dir(pdf_id), ignore_errors=True)
+
+    def write_document(self, pdf_id: str, chunks: List[Dict[str, Any]], embeddings: np.ndarray) -> None:
+        """
+        Write the chunks and embedding vectors for a PDF.
+
+        The chunk texts and metadata go to a JSON-lines file and the vectors
+        to a contiguous float32 file, so searches never parse the vectors.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            chunks: Chunk dictionaries with text and metadata (no embeddings)
+            embeddings: Float32 matrix with one row per chunk
+        """
+        writer = self.open_writer(pdf_id)
+        try:
+            writer.append(chunks, embeddings)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def open_writer(self, pdf_id: str) -> "DocumentWriter":
+        """
+        Start writing a PDF's chunks and embedding vectors in batches.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            A writer; call commit() to publish what was appended, or abort() to discard it
+        """
+        return DocumentWriter(self, pdf_id)
+
+    def read_chunks(self, pdf_id: str) -> List[Dict[str, Any]]:
+        """
+        Read the chunk texts and metadata for a PDF.
+
+        Legacy chunks.json directories are not read; they are converted at
+        startup or with the one-shot upgrade (python -m app.services.document_store).
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            List of chunk dictionaries, without embeddings
+        """
+        return list(self.iter_chunks(pdf_id))
+
+    def iter_chunks(self, pdf_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        Read the chunk texts and metadata for a PDF one chunk at a time.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Yields:
+            Chunk dictionaries without embeddings, in chunk order
+        """
+        if self.is_legacy(pdf_id):
+            logger.warning(f"PDF ID {pdf_id} is still in the legacy storage format; "
+                           f"run python -m app.services.document_store to convert it")
+            return
+
+        chunks_file = self._path(pdf_id, CHUNKS_FILENAME)
+        if not os.path.exists(chunks_file):
+            return
+
+        with open(chunks_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def read_embeddings(self, pdf_id: str) -> Optional[np.ndarray]:
+        """
+        Open the embedding vectors for a PDF as a read-only memory map.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            Float32 matrix with one row per chunk, or None if not stored
+        """
+        storage = self.read_info(pdf_id).get("storage", {})
+        if storage.get("format_version") != STORAGE_FORMAT_VERSION:
+            return None
+
+        embeddings_file = self._path(pdf_id, storage.get("embeddings_file", EMBEDDINGS_FILENAME))
+        if not os.path.exists(embeddings_file):
+            return None
+
+        dimension = storage["dimension"]
+        rows = os.path.getsize(embeddings_file) // (4 * dimension)
+        if rows == 0:
+            return np.zeros((0, dimension), dtype=np.float32)
+        return np.memmap(embeddings_file, dtype=np.float32, mode='r', shape=(rows, dimension))
+
+    def convert_legacy(self, pdf_id: str, keep_legacy: bool = False) -> bool:
+        """
+        Convert a legacy chunks.json directory to the binary storage format.
+
+        Safe to run concurrently for the same PDF: conversions in this process
+        take turns, and every file is written under a name unique to its
+        writer and renamed into place, so concurrent conversions in other
+        processes write identical files and never each other's partial ones.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            keep_legacy: Keep chunks.json after a successful conversion
+
+        Returns:
+            True if the directory was converted by this call
+        """
+        with self._conversion_locks_guard:
+            lock = self._conversion_locks.setdefault(pdf_id, threading.Lock())
+
+        with lock:
+            # Another conversion may have finished while this one waited
+            if not self.is_legacy(pdf_id):
+                return False
+            return self._convert_legacy(pdf_id, keep_legacy)
+
+    def _convert_legacy(self, pdf_id: str, keep_legacy: bool) -> bool:
+        legacy_file = self._path(pdf_id, LEGACY_CHUNKS_FILENAME)
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                legacy_chunks = json.load(f)
+        except FileNotFoundError:
+            # Converted and removed by another process
+            return False
+
+        if not legacy_chunks or not isinstance(legacy_chunks, list) or "embedding" not in legacy_chunks[0]:
+            logger.warning(f"Cannot convert {legacy_file}: empty or missing embeddings")
+            return False
+
+        embeddings = np.array([chunk["embedding"] for chunk in legacy_chunks], dtype=np.float32)
+        chunks = [{key: value for key, value in chunk.items() if key != "embedding"} for chunk in legacy_chunks]
+        self.write_document(pdf_id, chunks, embeddings)
+
+        if not keep_legacy:
+            try:
+                os.remove(legacy_file)
+            except FileNotFoundError:
+                pass
+
+        logger.info(f"Converted legacy storage for PDF ID {pdf_id}: {len(chunks)} chunks")
+        return True
+
+    def convert_all(self, keep_legacy: bool = False) -> int:
+        """
+        Convert every legacy chunks.json directory to the binary storage format.
+
+        Args:
+            keep_legacy: Keep chunks.json files after conversion
+
+        Returns:
+            Number of directories converted
+        """
+        converted = 0
+        for pdf_id in self.list_documents():
+            if self.is_legacy(pdf_id):
+                try:
+                    if self.convert_legacy(pdf_id, keep_legacy=keep_legacy):
+                        converted += 1
+                except Exception as e:
+                    logger.error(f"Error converting PDF ID {pdf_id}: {str(e)}")
+        return converted
+
+    def build_index(self, embeddings: np.ndarray) -> faiss.Index:
+        """
+        Build a FAISS index for a matrix of chunk embeddings.
+
+        Args:
+            embeddings: Float32 matrix with one row per chunk
+
+        Returns:
+            A populated FAISS index
+        """
+        index = faiss.IndexFlatL2(embeddings.shape[1])
+        index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+        return index
+
+    def save_index(self, pdf_id: str, index: faiss.Index) -> None:
+        """
+        Serialize a FAISS index next to pdf_info.json and record its format.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            index: The index to save
+        """
+        index_file = self._path(pdf_id, INDEX_FILENAME)
+
+        # Write to a temporary file first so readers never see a partial index
+        tmp_file = _tmp_path(index_file)
+        faiss.write_index(index, tmp_file)
+        os.replace(tmp_file, index_file)
+
+        info = self.read_info(pdf_id)
+        info.setdefault("pdf_id", pdf_id)
+        info["index"] = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "file": INDEX_FILENAME,
+            "type": type(index).__name__,
+            "dimension": index.d,
+            "ntotal": index.ntotal
+        }
+        self.write_info(pdf_id, info)
+        logger.info(f"Saved FAISS index with {index.ntotal} vectors to {index_file}")
+
+    def index_file_if_current(self, pdf_id: str) -> Optional[str]:
+        """
+        Get the path of a PDF's index file if it exists in the current format.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            Path to the index file, or None if it is missing or outdated
+        """
+        index_info = self.read_info(pdf_id).get("index", {})
+        if index_info.get("format_version") != INDEX_FORMAT_VERSION:
+            return None
+        index_file = self._path(pdf_id, index_info.get("file", INDEX_FILENAME))
+        return index_file if os.path.exists(index_file) else None
+
+    def read_index(self, pdf_id: str) -> Optional[faiss.Index]:
+        """
+        Read a PDF's persisted FAISS index if it is current and complete.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            The FAISS index, or None if it has to be rebuilt
+        """
+        index_file = self.index_file_if_current(pdf_id)
+        if not index_file:
+            logger.info(f"No current FAISS index for PDF ID {pdf_id}")
+            return None
+
+        try:
+            index = faiss.read_index(index_file)
+        except Exception as e:
+            logger.error(f"Error reading FAISS index {index_file}: {str(e)}")
+            return None
+
+        expected = self.read_info(pdf_id)["index"].get("ntotal")
+        if index.ntotal != expected:
+            logger.warning(f"Index for PDF ID {pdf_id} has {index.ntotal} vectors, expected {expected}")
+            return None
+        return index
+
+    def rebuild_index(self, pdf_id: str) -> Optional[faiss.Index]:
+        """
+        Rebuild and persist the FAISS index for a PDF from its stored vectors.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            The rebuilt index, or None if the PDF has no embeddings
+        """
+        embeddings = self.read_embeddings(pdf_id)
+        if embeddings is None or len(embeddings) == 0:
+            logger.warning(f"Cannot rebuild index for PDF ID {pdf_id}: no embeddings found")
+            return None
+
+        logger.info(f"Rebuilding FAISS index for PDF ID: {pdf_id}")
+        index = self.build_index(embeddings)
+        self.save_index(pdf_id, index)
+        return index
+
+    def save_lexical_index(self, pdf_id: str, lexical_index: LexicalIndex) -> None:
+        """
+        Persist the BM25 inverted index for a PDF.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            lexical_index: The index to save
+        """
+        lexical_file = self._path(pdf_id, LEXICAL_INDEX_FILENAME)
+        tmp_file = _tmp_path(lexical_file)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(lexical_index.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_file, lexical_file)
+
+    def read_lexical_index(self, pdf_id: str) -> Optional[LexicalIndex]:
+        """
+        Read the BM25 inverted index for a PDF if it is current.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            The index, or None if it is missing or outdated
+        """
+        lexical_file = self._path(pdf_id, LEXICAL_INDEX_FILENAME)
+        if not os.path.exists(lexical_file):
+            return None
+        with open(lexical_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("format_version") != LEXICAL_INDEX_FORMAT_VERSION:
+            return None
+        return LexicalIndex.from_dict(data)
+
+    def save_topics(self, pdf_id: str, topics: TopicClusters, fingerprint: str) -> None:
+        """
+        Persist the k-means topics for a PDF.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            topics: The topics to save
+            fingerprint: embeddings_fingerprint() of the vectors they were computed from
+        """
+        topics_file = self._path(pdf_id, TOPICS_FILENAME)
+        tmp_file = _tmp_path(topics_file)
+        with open(tmp_file, 'wb') as f:
+            np.savez(
+                f,
+                format_version=TOPICS_FORMAT_VERSION,
+                fingerprint=fingerprint,
+                num_topics=topics.num_topics,
+                centroids=topics.centroids,
+                representatives=np.array(topics.representatives, dtype=np.int64),
+                sizes=np.array(topics.sizes, dtype=np.int64)
+            )
+        os.replace(tmp_file, topics_file)
+
+    def read_topics(self, pdf_id: str, num_topics: int, fingerprint: str) -> Optional[TopicClusters]:
+        """
+        Read the k-means topics for a PDF if they match the current vectors.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            num_topics: Number of topics wanted
+            fingerprint: embeddings_fingerprint() of the vectors the PDF has now
+
+        Returns:
+            The topics, or None if they are missing or outdated
+        """
+        topics_file = self._path(pdf_id, TOPICS_FILENAME)
+        if not os.path.exists(topics_file):
+            return None
+        with np.load(topics_file) as data:
+            if (int(data["format_version"]) != TOPICS_FORMAT_VERSION or str(data["fingerprint"]) != fingerprint
+                    or int(data["num_topics"]) != num_topics):
+                return None
+            return TopicClusters(
+                num_topics,
+                data["centroids"],
+                data["representatives"].tolist(),
+                data["sizes"].tolist()
+            )
+
+
+class DocumentWriter:
+    """
+    Appends a new PDF's chunks and vectors to storage batch by batch.
+
+    Both files are written under temporary names and only replace the
+    stored document on commit, so readers never see a partial document and
+    memory use does not grow with the document.
+    """
+
+    def __init__(self, store: DocumentStore, pdf_id: str):
+        self.store = store
+        self.pdf_id = pdf_id
+        self.count = 0
+        self.dimension: Optional[int] = None
+
+        os.makedirs(store.pdf_dir(pdf_id), exist_ok=True)
+        self._chunks_file = store._path(pdf_id, CHUNKS_FILENAME)
+        self._embeddings_file = store._path(pdf_id, EMBEDDINGS_FILENAME)
+        self._chunks_tmp_file = _tmp_path(self._chunks_file)
+        self._embeddings_tmp_file = _tmp_path(self._embeddings_file)
+        self._chunks = open(self._chunks_tmp_file, 'w', encoding='utf-8')
+        self._embeddings = open(self._embeddings_tmp_file, 'wb')
+
+    def append(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray) -> None:
+        """
+        Append a batch of chunks and their embedding vectors.
+
+        Args:
+            chunks: Chunk dictionaries with text and metadata (no embeddings)
+            embeddings: Float32 matrix with one row per chunk
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(chunks):
+            raise ValueError(f"Expected {len(chunks)} embedding rows, got shape {embeddings.shape}")
+        if self.dimension is not None and embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional embeddings, got {embeddings.shape[1]}")
+
+        for chunk in chunks:
+            self._chunks.write(json.dumps(chunk, ensure_ascii=False, default=str) + "\n")
+        embeddings.tofile(self._embeddings)
+        self.dimension = int(embeddings.shape[1])
+        self.count += len(chunks)
+
+    def commit(self) -> None:
+        """Publish the appended chunks and vectors as the PDF's stored document."""
+        self._chunks.close()
+        self._embeddings.close()
+        os.replace(self._chunks_tmp_file, self._chunks_file)
+        os.replace(self._embeddings_tmp_file, self._embeddings_file)
+
+        info = self.store.read_info(self.pdf_id)
+        info.setdefault("pdf_id", self.pdf_id)
+        info.setdefault("created_at", time.strftime("%Y-%m-%d %H:%M:%S"))
+        info["chunk_count"] = self.count
+        info["storage"] = {
+            "format_version": STORAGE_FORMAT_VERSION,
+            "chunks_file": CHUNKS_FILENAME,
+            "embeddings_file": EMBEDDINGS_FILENAME,
+            "dtype": "float32",
+            "dimension": self.dimension or 0
+        }
+        self.store.write_info(self.pdf_id, info)
+        logger.info(f"Saved {self.count} chunks and {self.count * 4 * (self.dimension or 0)} bytes of embeddings "
+                    f"for PDF ID: {self.pdf_id}")
+
+    def abort(self) -> None:
+        """Discard everything appended so far."""
+        self._chunks.close()
+        self._embeddings.close()
+        for tmp_file in (self._chunks_tmp_file, self._embeddings_tmp_file):
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+
+if __name__ == "__main__":
+    # One-shot upgrade of an existing db/pdfs tree: python -m app.services.document_store
+    parser = argparse.ArgumentParser(description="Convert legacy chunks.json storage and build FAISS indexes")
+    parser.add_argument("--pdfs-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "pdfs"))
+    parser.add_argument("--keep-legacy", action="store_true", help="Keep chunks.json files after conversion")
+    args = parser.parse_args()
+
+    store = DocumentStore(os.path.abspath(args.pdfs_dir))
+    converted = store.convert_all(keep_legacy=args.keep_legacy)
+    rebuilt = 0
+    for pdf_id in store.list_documents():
+        if not store.index_file_if_current(pdf_id) and store.rebuild_index(pdf_id) is not None:
+            rebuilt += 1
+    print(f"Converted {converted} legacy directories, rebuilt {rebuilt} FAISS indexes")
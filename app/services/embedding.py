@@ -1,39 +1,303 @@
 import os
-from typing import List, Dict, Any
+import random
+import hashlib
+import logging
+import asyncio
+import threading
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from collections import Counter
 import numpy as np
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
 from dotenv import load_dotenv
 
+from app.services.tokens import count_tokens
+from app.services.cache import DiskCache, LRUCache
+
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger("embedding")
+
+# Connection pool, timeout and concurrency limits for the embeddings API
+EMBEDDING_MAX_CONNECTIONS = int(os.getenv("EMBEDDING_MAX_CONNECTIONS", "20"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "60"))
+
+# Batches are capped by total tokens and by number of inputs, well under the
+# provider's per-request limits so each request stays small and fast
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "20000"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+# Retry with exponential backoff on rate limits and transient failures
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "1"))
+EMBEDDING_RETRY_MAX_DELAY = float(os.getenv("EMBEDDING_RETRY_MAX_DELAY", "60"))
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+# Persistent cache of embeddings keyed on model and normalized text; set EMBEDDING_CACHE_MB=0 to disable
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "embedding_cache.sqlite3"))
+)
+EMBEDDING_CACHE_MB = int(os.getenv("EMBEDDING_CACHE_MB", "1024"))
+
+# In-memory cache of query embeddings (number of entries and expiry in seconds)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+
+# Concurrent single-query embeddings arriving within this window are sent as one request;
+# set EMBEDDING_COALESCE_WINDOW_MS=0 to send each query on its own
+EMBEDDING_COALESCE_WINDOW_MS = float(os.getenv("EMBEDDING_COALESCE_WINDOW_MS", "5"))
+EMBEDDING_COALESCE_MAX_BATCH = int(os.getenv("EMBEDDING_COALESCE_MAX_BATCH", "64"))
+
+# Initialize a non-blocking OpenAI client; its connection pool is shared by every request in this worker
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    timeout=EMBEDDING_TIMEOUT,
+    # Retries are handled by EmbeddingService so they respect its backoff and concurrency limit
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        timeout=EMBEDDING_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=EMBEDDING_MAX_CONNECTIONS,
+            max_keepalive_connections=EMBEDDING_MAX_CONNECTIONS
+        )
+    )
+)
+
+# Shared by every EmbeddingService in this worker
+embedding_cache = DiskCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MB * 1024 * 1024) if EMBEDDING_CACHE_MB > 0 else None
+
+# Repeated questions are answered from memory without touching the disk cache or the API
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, ttl=QUERY_EMBEDDING_CACHE_TTL)
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """
+    Content address of an embedding: the model plus the text with whitespace normalized.
+
+    Args:
+        model: Embedding model name
+        text: Input text
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    normalized = " ".join(text.split())
+    return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCoalescer:
+    """
+    Collects single-text embedding requests for a short window and sends them as one batch.
+
+    Each caller awaits its own future, which is resolved with its vector (or the
+    batch's exception) once the batched request returns.
+    """
+
+    def __init__(self, service: "EmbeddingService", window_ms: float = None, max_batch: int = None):
+        """
+        Initialize the coalescer.
+
+        Args:
+            service: Embedding service used to send the batched requests
+            window_ms: How long to wait for more requests after the first one arrives
+            max_batch: Batch size that triggers an immediate send
+        """
+        self.service = service
+        self.window = (EMBEDDING_COALESCE_WINDOW_MS if window_ms is None else window_ms) / 1000
+        self.max_batch = max_batch or EMBEDDING_COALESCE_MAX_BATCH
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Keeps running batch tasks referenced until they finish
+        self._tasks = set()
+        self.batch_sizes: Counter = Counter()
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Embed one text as part of the next batch.
+
+        Args:
+            text: Text to embed
+
+        Returns:
+            Embedding vector
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Callers that were cancelled while waiting no longer need a vector
+        batch = [(text, future) for text, future in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+
+        self.batch_sizes[len(batch)] += 1
+        task = asyncio.ensure_future(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            vectors = await self.service.create_embeddings([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get batch size counters.
+
+        Returns:
+            Dictionary with the number of batches and requests and a batch size histogram
+        """
+        batches = sum(self.batch_sizes.values())
+        requests = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items()))
+        }
 
 
 class EmbeddingService:
     """Service for creating embeddings using OpenAI's API."""
 
-    def __init__(self, model: str = "text-embedding-3-small"):
+    def __init__(self, model: str = "text-embedding-3-small", max_concurrency: int = None, cache: Optional[DiskCache] = embedding_cache):
         """
         Initialize the embedding service.
 
         Args:
             model: The OpenAI embedding model to use
+            max_concurrency: Maximum number of embedding requests in flight at once
+            cache: Persistent embedding cache, or None to always call the API
         """
         self.model = model
+        self.max_concurrency = max_concurrency or EMBEDDING_MAX_CONCURRENCY
+        self.cache = cache
+        # Inputs and cache hits over every create_embeddings call, which may run concurrently
+        self.inputs = 0
+        self.cache_hits = 0
+        self._stats_lock = threading.Lock()
+        self.coalescer = EmbeddingCoalescer(self)
+        # Created on first use so it binds to the server's event loop
+        self._semaphore = None
         if not client.api_key:
             raise ValueError("OpenAI API key is not set")
 
-    async def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _make_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Group inputs into batches bounded by token count and batch size.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            List of batches, each a list of indexes into texts
+        """
+        batches = []
+        current: List[int] = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text, self.model)
+            if current and (current_tokens + tokens > EMBEDDING_BATCH_TOKENS or len(current) >= EMBEDDING_BATCH_SIZE):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """Backoff before the next attempt, honouring the server's Retry-After header."""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), EMBEDDING_RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+        delay = min(EMBEDDING_RETRY_BASE_DELAY * (2 ** attempt), EMBEDDING_RETRY_MAX_DELAY)
+        # Full jitter so parallel batches that were throttled together don't retry together
+        return random.uniform(0, delay)
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed one batch, retrying rate-limited and transient failures.
+
+        Args:
+            texts: Texts in the batch
+
+        Returns:
+            Embedding vectors in input order
+        """
+        attempt = 0
+        while True:
+            try:
+                # Cancelling the caller cancels the in-flight HTTP request and frees the slot
+                async with self._get_semaphore():
+                    response = await client.embeddings.create(
+                        input=texts,
+                        model=self.model,
+                        encoding_format="float"
+                    )
+                # The API returns an index per item; don't rely on response order
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt >= EMBEDDING_MAX_RETRIES:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                logger.warning(f"Embedding batch of {len(texts)} failed ({type(e).__name__}), "
+                               f"retry {attempt}/{EMBEDDING_MAX_RETRIES} in {delay:.1f}s")
+                # The semaphore is released while waiting so other batches can proceed
+                await asyncio.sleep(delay)
+
+    async def create_embeddings(
+        self,
+        texts: List[str],
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> List[List[float]]:
         """
         Create embeddings for the provided texts.
 
+        Inputs are split into token-bounded batches that are sent concurrently,
+        up to the service's in-flight limit.
+
         Args:
             texts: List of text strings to embed
+            progress_callback: Optional callable receiving (texts embedded, total texts)
+                as batches complete
 
         Returns:
-            List of embedding vectors
+            List of embedding vectors, in the same order as texts
         """
         try:
             # Handle empty list
@@ -43,20 +307,80 @@ class EmbeddingService:
             # OpenAI recommends replacing newlines with spaces for best results
             texts = [text.replace("\n", " ") for text in texts]
 
-            response = client.embeddings.create(
-                input=texts,
-                model=self.model,
-                encoding_format="float"
-            )
+            embeddings: List[List[float]] = [None] * len(texts)
+
+            # Serve what we can from the cache; identical inputs are embedded once
+            keys = [embedding_cache_key(self.model, text) for text in texts]
+            cached = await asyncio.to_thread(self.cache.get_many, keys) if self.cache else {}
+            pending: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                if key in cached:
+                    embeddings[i] = np.frombuffer(cached[key], dtype=np.float32).tolist()
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            hits = len(texts) - sum(len(indexes) for indexes in pending.values())
+            with self._stats_lock:
+                self.inputs += len(texts)
+                self.cache_hits += hits
+            if self.cache:
+                logger.info(f"Embedding cache: {hits}/{len(texts)} hits ({hits / len(texts):.0%})")
+            if not pending:
+                if progress_callback:
+                    progress_callback(len(texts), len(texts))
+                return embeddings
+
+            unique_keys = list(pending)
+            unique_texts = [texts[pending[key][0]] for key in unique_keys]
+            batches = self._make_batches(unique_texts)
+            completed = hits
+
+            async def run_batch(indexes: List[int]):
+                nonlocal completed
+                vectors = await self._embed_batch([unique_texts[i] for i in indexes])
+                new_entries = []
+                for i, vector in zip(indexes, vectors):
+                    key = unique_keys[i]
+                    for position in pending[key]:
+                        embeddings[position] = vector
+                    completed += len(pending[key])
+                    new_entries.append((key, np.asarray(vector, dtype=np.float32).tobytes()))
+                # Store each batch as it lands so a failed upload still keeps its progress
+                if self.cache:
+                    await asyncio.to_thread(self.cache.put_many, new_entries)
+                if progress_callback:
+                    progress_callback(completed, len(texts))
+
+            # If one batch fails for good, cancel the others instead of leaving them running
+            tasks = [asyncio.ensure_future(run_batch(indexes)) for indexes in batches]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
 
-            # Extract embeddings from response
-            embeddings = [item.embedding for item in response.data]
             return embeddings
 
         except Exception as e:
             print(f"Error creating embeddings: {e}")
             raise
 
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get embedding cache counters over every call.
+
+        Returns:
+            Dictionary with inputs embedded, inputs served from the cache and the hit ratio
+        """
+        with self._stats_lock:
+            return {
+                "inputs": self.inputs,
+                "cache_hits": self.cache_hits,
+                "hit_ratio": self.cache_hits / self.inputs if self.inputs else 0.0
+            }
+
     async def create_single_embedding(self, text: str) -> List[float]:
         """
         Create an embedding for a single text string.
@@ -67,5 +391,16 @@ class EmbeddingService:
         Returns:
             Embedding vector
         """
-        embeddings = await self.create_embeddings([text])
-        return embeddings[0] if embeddings else []
\ No newline at end of file
+        key = embedding_cache_key(self.model, text)
+        cached = query_embedding_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        if self.coalescer.window > 0:
+            embedding = await self.coalescer.embed(text)
+        else:
+            embeddings = await self.create_embeddings([text])
+            embedding = embeddings[0] if embeddings else []
+        if embedding:
+            query_embedding_cache.put(key, tuple(embedding))
+        return embedding
@@ -0,0 +1,532 @@
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
+from itertools import islice
+import asyncio
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal, IngestionJob, PDF, PDFChunk, DocumentStorage
+from app.services.document_storage import DocumentStorageRegistry, document_storage
+
+logger = logging.getLogger("ingestion")
+
+# Uploads processed at once; the stages inside each one share the embedding service's own limits
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+# Chunks sent for embedding together; batches are embedded while later pages are still being extracted
+INGESTION_BATCH_CHUNKS = int(os.getenv("INGESTION_BATCH_CHUNKS", "64"))
+# Where uploads wait until their job finishes, so unfinished jobs can be resumed after a restart.
+# Keep it on the same filesystem as db/pdfs so finished uploads are renamed into place rather than copied.
+INGESTION_UPLOAD_DIR = os.getenv(
+    "INGESTION_UPLOAD_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "uploads"))
+)
+# Largest upload accepted; larger ones are rejected as soon as they cross the limit
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "200"))
+# Bytes read from the request and written to disk at a time
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Room for the multipart boundaries and part headers around the file when checking Content-Length
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+# Partial uploads older than this were cut off by a crash and are removed when the workers start
+STALE_PARTIAL_UPLOAD_SECONDS = 24 * 3600
+
+# Receives (items done, total items) while a stage runs
+ProgressCallback = Callable[[int, int], None]
+# Extracts and chunks the PDF at a path, yielding chunk dictionaries with "text" and "page_number" in
+# document order and reporting (pages extracted, total pages)
+ChunkStream = Callable[[str, Optional[ProgressCallback]], Iterator[Dict[str, Any]]]
+# Path the original PDF is kept at, from (user ID, PDF ID)
+PDFPathBuilder = Callable[[str, str], Path]
+# Called with (user ID, PDF ID) once a document has been ingested
+IngestedCallback = Callable[[str, str], None]
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload is larger than the configured limit."""
+
+
+class StagedUpload:
+    """An upload written to the staging directory, not yet queued."""
+
+    def __init__(self, path: str, content_hash: str, size: int):
+        self.path = path
+        # SHA-256 of the file, computed while it was written
+        self.content_hash = content_hash
+        self.size = size
+
+
+class IngestionQueue:
+    """
+    Background queue that turns uploaded PDFs into searchable documents.
+
+    An upload is staged to disk and recorded as a job, then a bounded pool of
+    workers runs it through a pipeline: pages are extracted and chunked in a
+    thread, chunks are embedded in batches while later pages are still being
+    extracted, and finished batches are appended to storage. Jobs live in
+    the ingestion_jobs table, so their progress can be polled and any job a
+    restart interrupted is started over when the workers start again. A job
+    that fails or is restarted first removes whatever it had written. An
+    upload identical to one already ingested with the same settings is not
+    processed again; it gets a PDF row sharing the existing storage.
+    """
+
+    def __init__(self, retriever, iter_chunks: ChunkStream, pdf_path: PDFPathBuilder,
+                 on_ingested: IngestedCallback = None, session_factory=SessionLocal, workers: int = None,
+                 upload_dir: str = None, batch_size: int = None, max_upload_mb: int = None,
+                 storage: DocumentStorageRegistry = document_storage, storage_settings: str = ""):
+        """
+        Initialize the queue.
+
+        Args:
+            retriever: Retriever that embeds and stores the chunks
+            iter_chunks: Extracts and chunks PDF bytes page by page, reporting progress
+            pdf_path: Gives the path to keep the original PDF at
+            on_ingested: Called after a document is ingested, for work that may fail without failing the job
+            session_factory: Creates database sessions for the workers
+            workers: Jobs processed at once (defaults to INGESTION_WORKERS)
+            upload_dir: Directory for staged uploads (defaults to INGESTION_UPLOAD_DIR)
+            batch_size: Chunks per embedding batch (defaults to INGESTION_BATCH_CHUNKS)
+            max_upload_mb: Largest upload accepted in MB (defaults to MAX_UPLOAD_MB)
+            storage: Registry of storage shared by identical uploads
+            storage_settings: Chunking and embedding settings, fingerprinted with each upload so
+                documents are only shared when their chunks and vectors would come out the same
+        """
+        self.retriever = retriever
+        self.iter_chunks = iter_chunks
+        self.pdf_path = pdf_path
+        self.on_ingested = on_ingested
+        self.session_factory = session_factory
+        self.num_workers = workers or INGESTION_WORKERS
+        self.upload_dir = upload_dir or INGESTION_UPLOAD_DIR
+        self.batch_size = batch_size or INGESTION_BATCH_CHUNKS
+        self.max_upload_bytes = (max_upload_mb or MAX_UPLOAD_MB) * 1024 * 1024
+        self.storage = storage
+        self.storage_settings = storage_settings
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Jobs queued or running in this process
+        self._active: Set[str] = set()
+        # Progress of the running stage per job, between the database writes at stage boundaries
+        self._live: Dict[str, Dict[str, int]] = {}
+
+        self.completed = 0
+        self.failed = 0
+        self.resumed = 0
+
+    def start(self) -> None:
+        """
+        Start the workers and queue every job a previous run left unfinished.
+
+        Must be called from the event loop; calling it again is a no-op.
+        """
+        loop = asyncio.get_running_loop()
+        if self._workers and self._loop is loop:
+            return
+
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._active.clear()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+        db = self.session_factory()
+        try:
+            unfinished = db.query(IngestionJob).filter(
+                IngestionJob.status.in_(["queued", "running"])
+            ).order_by(IngestionJob.created_at).all()
+            for job in unfinished:
+                self._enqueue(job.id)
+            self.resumed += len(unfinished)
+        finally:
+            db.close()
+
+        self._remove_stale_partial_uploads()
+
+        if unfinished:
+            logger.info(f"Resuming {len(unfinished)} unfinished ingestion jobs")
+        logger.info(f"Started {self.num_workers} ingestion workers")
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs they were running stay unfinished and resume on the next start."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _enqueue(self, job_id: str) -> None:
+        if job_id not in self._active:
+            self._active.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def _too_large(self) -> UploadTooLargeError:
+        return UploadTooLargeError(f"File is larger than the {self.max_upload_bytes // (1024 * 1024)} MB limit")
+
+    def check_content_length(self, content_length: Optional[str]) -> None:
+        """
+        Reject an upload whose declared body size is already over the limit, before reading any of it.
+
+        Args:
+            content_length: The request's Content-Length header, if sent
+
+        Raises:
+            UploadTooLargeError: If the body cannot hold a file within the limit
+        """
+        if content_length and content_length.isdigit() and \
+                int(content_length) > self.max_upload_bytes + UPLOAD_FORM_OVERHEAD_BYTES:
+            raise self._too_large()
+
+    async def stage(self, upload) -> StagedUpload:
+        """
+        Write an upload to the staging directory in fixed-size pieces, hashing it on the way.
+
+        Only one piece is held in memory at a time, and the upload is
+        rejected as soon as it grows past the size limit. Given a
+        MultipartFileStream, the pieces come straight off the request body,
+        so reading stops within a piece of the limit and no other copy is made.
+
+        Args:
+            upload: Uploaded file with an async read(size) method, such as a MultipartFileStream
+
+        Returns:
+            The staged file
+
+        Raises:
+            UploadTooLargeError: If the upload is larger than the limit
+        """
+        os.makedirs(self.upload_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".part", dir=self.upload_dir)
+        digest = hashlib.sha256()
+        size = 0
+
+        def write(f, data: bytes) -> None:
+            digest.update(data)
+            f.write(data)
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    data = await upload.read(UPLOAD_CHUNK_BYTES)
+                    if not data:
+                        break
+                    size += len(data)
+                    if size > self.max_upload_bytes:
+                        raise self._too_large()
+                    await asyncio.to_thread(write, f, data)
+        except BaseException:
+            os.remove(path)
+            raise
+
+        return StagedUpload(path, digest.hexdigest(), size)
+
+    def discard(self, staged: StagedUpload) -> None:
+        """Remove a staged upload that will not be queued."""
+        try:
+            os.remove(staged.path)
+        except OSError:
+            pass
+
+    async def submit(self, db, user_id: str, filename: str, staged: StagedUpload) -> IngestionJob:
+        """
+        Queue a staged upload for ingestion.
+
+        Args:
+            db: Database session
+            user_id: The uploading user
+            filename: Original file name
+            staged: The upload, as returned by stage()
+
+        Returns:
+            The queued job
+        """
+        self.start()
+
+        job_id = str(uuid.uuid4())
+        upload_path = os.path.join(self.upload_dir, f"{job_id}.pdf")
+        os.replace(staged.path, upload_path)
+
+        job = IngestionJob(
+            id=job_id,
+            user_id=user_id,
+            pdf_id=str(uuid.uuid4()),
+            filename=filename,
+            upload_path=upload_path,
+            content_hash=staged.content_hash,
+            status="queued"
+        )
+        db.add(job)
+        db.commit()
+
+        self._enqueue(job_id)
+        logger.info(f"Queued ingestion job {job_id} for {filename} ({staged.size} bytes)")
+        return job
+
+    def _remove_stale_partial_uploads(self) -> None:
+        if not os.path.isdir(self.upload_dir):
+            return
+        cutoff = time.time() - STALE_PARTIAL_UPLOAD_SECONDS
+        for name in os.listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, name)
+            try:
+                if name.endswith(".part") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} could not be processed: {e}")
+            finally:
+                self._active.discard(job_id)
+
+    async def _run(self, job_id: str) -> None:
+        """Run one job through every stage, starting over if it was interrupted."""
+        db = self.session_factory()
+        try:
+            job = db.get(IngestionJob, job_id)
+            if job is None or job.status in ("completed", "failed"):
+                return
+
+            # The PDF row is written last, together with the job's completion
+            if db.query(PDF).filter(PDF.id == job.pdf_id).first() is not None:
+                self._finish(db, job, "completed")
+                return
+
+            fingerprint = self.storage.fingerprint(job.content_hash, self.storage_settings) if job.content_hash else None
+            existing = self.storage.find(db, fingerprint) if fingerprint else None
+            if existing is not None:
+                self._share(db, job, existing)
+                return
+
+            # Whatever an interrupted attempt wrote is rebuilt from the staged upload
+            await asyncio.to_thread(self.retriever.delete_document, job.pdf_id)
+            self._set_stage(db, job, "extracting", pages_total=0, pages_extracted=0, chunks_total=0,
+                            chunks_embedded=0, error=None)
+            live = self._live.setdefault(job_id, {})
+
+            def pages_extracted(done: int, total: int) -> None:
+                live["pages_extracted"], live["pages_total"] = done, total
+
+            def chunks_embedded(done: int, total: int) -> None:
+                live["chunks_embedded"], live["chunks_total"] = done, total
+
+            # The upload is read from disk page by page; an attempt interrupted while saving already moved it
+            pdf_path = self.pdf_path(job.user_id, job.pdf_id)
+            source_path = job.upload_path if os.path.exists(job.upload_path) else str(pdf_path)
+            chunks = self.iter_chunks(source_path, pages_extracted)
+
+            async def batches() -> AsyncIterator[List[Dict[str, Any]]]:
+                # Extraction and chunking run in a thread, one batch at a time, while earlier batches embed
+                produced = False
+                try:
+                    while True:
+                        batch = await asyncio.to_thread(lambda: list(islice(chunks, self.batch_size)))
+                        if not batch:
+                            break
+                        produced = True
+                        yield batch
+                finally:
+                    try:
+                        chunks.close()
+                    except ValueError:
+                        # Still running in its thread after a cancellation; it stops once that returns
+                        pass
+                if not produced:
+                    raise ValueError("No text could be extracted from the PDF")
+                self._set_stage(db, job, "embedding", pages_total=live.get("pages_total", 0),
+                                pages_extracted=live.get("pages_extracted", 0))
+
+            await self.retriever.add_document_batches(batches(), pdf_id=job.pdf_id, progress_callback=chunks_embedded)
+            num_chunks = live.get("chunks_embedded", 0)
+            self._set_stage(db, job, "saving", chunks_total=num_chunks, chunks_embedded=num_chunks)
+
+            if source_path != str(pdf_path):
+                await asyncio.to_thread(self._move_upload, source_path, str(pdf_path))
+
+            # An identical upload may have finished while this one ran; from here on nothing awaits until the commit
+            existing = self.storage.find(db, fingerprint) if fingerprint else None
+            if existing is not None:
+                await asyncio.to_thread(self._discard_output, job)
+                self._share(db, job, existing)
+                return
+
+            pdf = PDF(
+                id=job.pdf_id,
+                user_id=job.user_id,
+                title=job.filename,
+                filename=job.filename,
+                file_path=str(pdf_path)
+            )
+            try:
+                db.add(pdf)
+                if fingerprint:
+                    self.storage.register(db, pdf, fingerprint)
+                # Read back from storage so the chunks never have to be held in memory all at once
+                for i, chunk in enumerate(self.retriever.store.iter_chunks(job.pdf_id)):
+                    db.add(PDFChunk(pdf_id=job.pdf_id, content=chunk["text"], page_number=chunk["page_number"]))
+                    if (i + 1) % self.batch_size == 0:
+                        db.flush()
+                self._finish(db, job, "completed")
+            except IntegrityError:
+                # An identical upload in another process registered the fingerprint first
+                db.rollback()
+                existing = self.storage.find(db, fingerprint) if fingerprint else None
+                if existing is None:
+                    raise
+                job = db.get(IngestionJob, job_id)
+                await asyncio.to_thread(self._discard_output, job)
+                self._share(db, job, existing)
+                return
+
+            logger.info(f"Ingested {job.filename} as PDF ID {job.pdf_id}: "
+                        f"{job.pages_total} pages, {job.chunks_total} chunks")
+            if self.on_ingested:
+                try:
+                    self.on_ingested(job.user_id, job.pdf_id)
+                except Exception as e:
+                    logger.error(f"Post-ingestion step failed for PDF ID {job.pdf_id}: {e}")
+
+        except asyncio.CancelledError:
+            # Left as running so the next start picks it up again
+            raise
+        except Exception as e:
+            # HTTPException from the extractor carries its message in detail
+            error = str(getattr(e, "detail", None) or e)
+            logger.error(f"Ingestion job {job_id} failed: {error}")
+            db.rollback()
+            job = db.get(IngestionJob, job_id)
+            if job is not None:
+                await asyncio.to_thread(self._discard_output, job)
+                job.error = error
+                self._finish(db, job, "failed")
+        finally:
+            self._live.pop(job_id, None)
+            db.close()
+
+    def _share(self, db, job: IngestionJob, storage: DocumentStorage) -> None:
+        """Complete a job by giving its owner a PDF row on an identical document's storage."""
+        pdf = PDF(
+            id=job.pdf_id,
+            user_id=job.user_id,
+            title=job.filename,
+            filename=job.filename,
+            file_path=storage.file_path
+        )
+        db.add(pdf)
+        self.storage.attach(db, storage, pdf)
+
+        num_chunks = db.query(PDFChunk).join(PDF, PDFChunk.pdf_id == PDF.id).filter(
+            PDF.storage_id == storage.id
+        ).count()
+        job.chunks_total = job.chunks_embedded = num_chunks
+        self._finish(db, job, "completed")
+
+        logger.info(f"{job.filename} is identical to stored document {storage.id}; "
+                    f"shared it as PDF ID {job.pdf_id} ({storage.ref_count} owners)")
+        if self.on_ingested:
+            try:
+                self.on_ingested(job.user_id, job.pdf_id)
+            except Exception as e:
+                logger.error(f"Post-ingestion step failed for PDF ID {job.pdf_id}: {e}")
+
+    def _set_stage(self, db, job: IngestionJob, stage: str, **progress) -> None:
+        """Record the stage a job has reached and the progress counters it finished the last one with."""
+        job.status = "running"
+        job.stage = stage
+        for name, value in progress.items():
+            setattr(job, name, value)
+        job.updated_at = datetime.utcnow()
+        db.commit()
+
+    def _finish(self, db, job: IngestionJob, status: str) -> None:
+        job.status = status
+        job.stage = None
+        job.updated_at = job.finished_at = datetime.utcnow()
+        db.commit()
+
+        if status == "completed":
+            self.completed += 1
+        else:
+            self.failed += 1
+        try:
+            os.remove(job.upload_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _move_upload(source_path: str, pdf_path: str) -> None:
+        """Rename the upload into the user's PDF directory, copying only if that is on another filesystem."""
+        try:
+            os.replace(source_path, pdf_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(source_path, pdf_path)
+
+    def _discard_output(self, job: IngestionJob) -> None:
+        """Remove what a failed job wrote so no half-ingested document is left behind."""
+        self.retriever.delete_document(job.pdf_id)
+        try:
+            os.remove(self.pdf_path(job.user_id, job.pdf_id))
+        except OSError:
+            pass
+
+    def status(self, job: IngestionJob) -> Dict[str, Any]:
+        """
+        Describe a job, including progress within the stage it is running.
+
+        Args:
+            job: The job's database row
+
+        Returns:
+            Dictionary matching IngestionJobResponse
+        """
+        progress = {
+            "pages_total": job.pages_total or 0,
+            "pages_extracted": job.pages_extracted or 0,
+            "chunks_total": job.chunks_total or 0,
+            "chunks_embedded": job.chunks_embedded or 0,
+        }
+        progress.update(self._live.get(job.id, {}))
+
+        finished = job.finished_at is not None and job.created_at is not None
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "stage": job.stage,
+            "filename": job.filename,
+            # The document can only be used once the job has completed
+            "pdf_id": job.pdf_id if job.status == "completed" else None,
+            **progress,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else "",
+            "processing_time": (job.finished_at - job.created_at).total_seconds() if finished else None
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get queue counters.
+
+        Returns:
+            Dictionary with workers, jobs waiting and running, and jobs completed, failed and resumed since start
+        """
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": len(self._live),
+            "completed": self.completed,
+            "failed": self.failed,
+            "resumed": self.resumed
+        }
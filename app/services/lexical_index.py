@@ -0,0 +1,119 @@
+from typing import List, Dict, Any, Iterable, Tuple
+from collections import Counter
+import math
+import re
+
+LEXICAL_INDEX_FORMAT_VERSION = 1
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words joined by "-", "_", "." or "/" are kept together so part numbers,
+# error codes and versions ("AB-1234", "0x1F", "v2.3.1") stay searchable.
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-_./][^\W_]+)*")
+TOKEN_SEPARATORS = re.compile(r"[-_./]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase search terms.
+
+    Compound tokens such as "AB-1234" produce the whole token plus its
+    parts, so both "AB-1234" and "1234" match it.
+
+    Args:
+        text: Text to tokenize
+
+    Returns:
+        List of terms
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        parts = TOKEN_SEPARATORS.split(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+
+class LexicalIndex:
+    """Inverted index over the chunks of one PDF, scored with BM25."""
+
+    def __init__(self, postings: Dict[str, List[List[int]]] = None, doc_lengths: List[int] = None):
+        """
+        Initialize the index.
+
+        Args:
+            postings: Map of term to [chunk index, term frequency] pairs
+            doc_lengths: Number of terms in each chunk
+        """
+        self.postings = postings or {}
+        self.doc_lengths = doc_lengths or []
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "LexicalIndex":
+        """
+        Build an index from chunk texts.
+
+        Args:
+            texts: Chunk texts, in chunk order
+
+        Returns:
+            The populated index
+        """
+        postings: Dict[str, List[List[int]]] = {}
+        doc_lengths = []
+        for chunk_index, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append([chunk_index, frequency])
+        return cls(postings, doc_lengths)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint used to enforce the cache budget."""
+        return sum(len(term) + 64 * len(entries) for term, entries in self.postings.items())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the index for storage."""
+        return {
+            "format_version": LEXICAL_INDEX_FORMAT_VERSION,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LexicalIndex":
+        """Load an index serialized with to_dict."""
+        return cls(data["postings"], data["doc_lengths"])
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """
+        Rank chunks against a query with BM25.
+
+        Args:
+            query: The search query
+            top_k: Number of chunks to return
+
+        Returns:
+            List of (chunk index, BM25 score) tuples, best first
+        """
+        num_docs = len(self.doc_lengths)
+        if num_docs == 0:
+            return []
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = math.log(1 + (num_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            for chunk_index, frequency in entries:
+                length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[chunk_index] / (self.avg_doc_length or 1)
+                scores[chunk_index] = scores.get(chunk_index, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
@@ -0,0 +1,259 @@
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import faiss
+import bisect
+import json
+import math
+import os
+import threading
+import logging
+
+# Configure logging
+logger = logging.getLogger("library_index")
+logger.setLevel(logging.DEBUG)
+
+# Add file handler if not already added
+if not logger.handlers:
+    file_handler = logging.FileHandler("retriever.log")
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(file_handler)
+
+LIBRARY_INDEX_FORMAT_VERSION = 1
+LIBRARY_INDEX_FILENAME = "library.faiss"
+LIBRARY_MAP_FILENAME = "library.json"
+
+# Switch from exact search to an IVF index once a library has this many chunks
+IVF_THRESHOLD = int(os.getenv("LIBRARY_IVF_THRESHOLD", "50000"))
+IVF_NPROBE = int(os.getenv("LIBRARY_IVF_NPROBE", "16"))
+
+
+class LibraryIndex:
+    """
+    Aggregate FAISS index over the chunks of every PDF in one user's library.
+
+    Each PDF owns a contiguous range of vector IDs, so documents can be added
+    and removed incrementally without rebuilding the whole index. Once the
+    library outgrows exact search it is retrained as an IVF index in a
+    background thread; searches keep using the exact index until then.
+    """
+
+    def __init__(self, user_dir: str):
+        """
+        Initialize the library index, loading it from disk if present.
+
+        Args:
+            user_dir: Directory holding the user's library index
+        """
+        self.user_dir = user_dir
+        self.lock = threading.Lock()
+        self.index: Optional[faiss.Index] = None
+        self.next_id = 0
+        # pdf_id -> {"start": first vector ID, "count": number of chunks}
+        self.documents: Dict[str, Dict[str, int]] = {}
+        # Background IVF upgrade, and the adds and removals made while it trains
+        self._upgrade_thread: Optional[threading.Thread] = None
+        self._upgrading = False
+        self._changes_during_upgrade: List[Tuple[str, np.ndarray, Optional[np.ndarray]]] = []
+        self._load()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint used to enforce the cache budget."""
+        if self.index is None:
+            return 0
+        return self.index.ntotal * (self.index.d * 4 + 8)
+
+    def _load(self) -> None:
+        index_file = os.path.join(self.user_dir, LIBRARY_INDEX_FILENAME)
+        map_file = os.path.join(self.user_dir, LIBRARY_MAP_FILENAME)
+        if not (os.path.exists(index_file) and os.path.exists(map_file)):
+            return
+
+        try:
+            with open(map_file, 'r', encoding='utf-8') as f:
+                mapping = json.load(f)
+            if mapping.get("format_version") != LIBRARY_INDEX_FORMAT_VERSION:
+                logger.info(f"Discarding library index in {self.user_dir} with format {mapping.get('format_version')}")
+                return
+            self.index = faiss.read_index(index_file)
+            self.next_id = mapping["next_id"]
+            self.documents = mapping["documents"]
+            self._set_nprobe()
+        except Exception as e:
+            logger.error(f"Error loading library index from {self.user_dir}: {str(e)}")
+            self.index = None
+            self.next_id = 0
+            self.documents = {}
+
+    def _save(self) -> None:
+        os.makedirs(self.user_dir, exist_ok=True)
+        index_file = os.path.join(self.user_dir, LIBRARY_INDEX_FILENAME)
+        map_file = os.path.join(self.user_dir, LIBRARY_MAP_FILENAME)
+
+        if self.index is not None:
+            faiss.write_index(self.index, index_file + ".tmp")
+            os.replace(index_file + ".tmp", index_file)
+
+        with open(map_file + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                "format_version": LIBRARY_INDEX_FORMAT_VERSION,
+                "type": type(self.index).__name__ if self.index is not None else None,
+                "next_id": self.next_id,
+                "documents": self.documents
+            }, f)
+        os.replace(map_file + ".tmp", map_file)
+
+    def _set_nprobe(self) -> None:
+        if isinstance(self.index, faiss.IndexIVF):
+            self.index.nprobe = IVF_NPROBE
+
+    def _maybe_upgrade_to_ivf(self) -> None:
+        """Start retraining the library as an IVF index once it outgrows exact search. Called with the lock held."""
+        if self.index is None or isinstance(self.index, faiss.IndexIVF) or self.index.ntotal < IVF_THRESHOLD:
+            return
+        if self._upgrading:
+            return
+
+        ids = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        self._upgrading = True
+        self._changes_during_upgrade = []
+        self._upgrade_thread = threading.Thread(target=self._upgrade_to_ivf, args=(vectors, ids), daemon=True)
+        self._upgrade_thread.start()
+
+    def _build_ivf(self, vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+        nlist = int(4 * math.sqrt(len(vectors)))
+        logger.info(f"Upgrading library index in {self.user_dir} to IVF with {nlist} lists ({len(vectors)} vectors)")
+        quantizer = faiss.IndexFlatL2(vectors.shape[1])
+        ivf_index = faiss.IndexIVFFlat(quantizer, vectors.shape[1], nlist, faiss.METRIC_L2)
+        ivf_index.train(vectors)
+        ivf_index.add_with_ids(vectors, ids)
+        return ivf_index
+
+    def _upgrade_to_ivf(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        """Train an IVF index on a snapshot of the library, then swap it in with the changes made meanwhile."""
+        try:
+            ivf_index = self._build_ivf(vectors, ids)
+        except Exception as e:
+            logger.error(f"Error upgrading library index in {self.user_dir} to IVF: {str(e)}")
+            with self.lock:
+                self._upgrading = False
+                self._changes_during_upgrade = []
+            return
+
+        with self.lock:
+            for change, change_ids, embeddings in self._changes_during_upgrade:
+                if change == "add":
+                    ivf_index.add_with_ids(embeddings, change_ids)
+                else:
+                    ivf_index.remove_ids(change_ids)
+            self._upgrading = False
+            self._changes_during_upgrade = []
+            self.index = ivf_index
+            self._set_nprobe()
+            self._save()
+            logger.info(f"Library index in {self.user_dir} now uses IVF ({ivf_index.ntotal} vectors)")
+
+    def wait_for_upgrade(self, timeout: Optional[float] = None) -> None:
+        """Wait for a background IVF upgrade, if one is running, to finish."""
+        thread = self._upgrade_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def add_document(self, pdf_id: str, embeddings: np.ndarray) -> bool:
+        """
+        Add (or replace) the chunk vectors of one PDF.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            embeddings: Float32 matrix with one row per chunk
+
+        Returns:
+            True if the vectors were added
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if len(embeddings) == 0:
+            return False
+
+        with self.lock:
+            if self.index is not None and self.index.d != embeddings.shape[1]:
+                logger.warning(f"Skipping PDF ID {pdf_id}: dimension {embeddings.shape[1]} does not match library dimension {self.index.d}")
+                return False
+
+            self._remove(pdf_id)
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings.shape[1]))
+
+            start = self.next_id
+            ids = np.arange(start, start + len(embeddings), dtype=np.int64)
+            self.index.add_with_ids(embeddings, ids)
+            if self._upgrading:
+                self._changes_during_upgrade.append(("add", ids, embeddings))
+            self.documents[pdf_id] = {"start": start, "count": len(embeddings)}
+            self.next_id = start + len(embeddings)
+
+            self._maybe_upgrade_to_ivf()
+            self._save()
+            logger.info(f"Added {len(embeddings)} vectors for PDF ID {pdf_id} to library in {self.user_dir}")
+            return True
+
+    def _remove(self, pdf_id: str) -> bool:
+        document = self.documents.pop(pdf_id, None)
+        if document is None or self.index is None:
+            return False
+        ids = np.arange(document["start"], document["start"] + document["count"], dtype=np.int64)
+        self.index.remove_ids(ids)
+        if self._upgrading:
+            self._changes_during_upgrade.append(("remove", ids, None))
+        return True
+
+    def remove_document(self, pdf_id: str) -> bool:
+        """
+        Remove the chunk vectors of one PDF.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            True if the PDF was in the library
+        """
+        with self.lock:
+            removed = self._remove(pdf_id)
+            if removed:
+                self._save()
+                logger.info(f"Removed PDF ID {pdf_id} from library in {self.user_dir}")
+            return removed
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> List[Tuple[str, int, float]]:
+        """
+        Find the chunks closest to a query across the whole library.
+
+        Args:
+            query_embedding: Float32 query vector
+            top_k: Number of chunks to return
+
+        Returns:
+            List of (pdf_id, chunk index, L2 distance) tuples, closest first
+        """
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+
+            query = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            distances, ids = self.index.search(query, top_k)
+
+            # Map vector IDs back to (pdf_id, chunk index) using the sorted range starts
+            ranges = sorted((document["start"], pdf_id) for pdf_id, document in self.documents.items())
+            starts = [start for start, _ in ranges]
+
+            results = []
+            for distance, vector_id in zip(distances[0], ids[0]):
+                if vector_id < 0:
+                    continue
+                position = bisect.bisect_right(starts, vector_id) - 1
+                if position < 0:
+                    continue
+                start, pdf_id = ranges[position]
+                if vector_id < start + self.documents[pdf_id]["count"]:
+                    results.append((pdf_id, int(vector_id - start), float(distance)))
+            return results
@@ -2,10 +2,18 @@ import os
 import json
 import logging
 import sys
-from typing import List, Dict, Any
-from openai import OpenAI
+import asyncio
+import re
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI, BadRequestError, UnprocessableEntityError
 from dotenv import load_dotenv
 from pathlib import Path
+from app.services.streaming import QuestionStreamParser
+from app.services.response_cache import ResponseCache, response_cache, response_cache_key
+from app.services.tokens import count_tokens, truncate_to_tokens
+from app.services.context_packer import PackedContext, context_budget, pack_context
+from app.services.model_capabilities import ModelCapabilities, model_capabilities
 import traceback
 import time
 
@@ -26,8 +34,65 @@ ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 # Load environment variables with explicit path to .env file
 load_dotenv(ROOT_DIR / '.env')
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Connection pool, timeouts and concurrency limits for chat completions
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_STRUCTURED_TIMEOUT = float(os.getenv("LLM_STRUCTURED_TIMEOUT", "120"))
+
+# Errors meaning the request itself was rejected, as opposed to rate limits, timeouts or outages
+REJECTED_REQUEST_ERRORS = (BadRequestError, UnprocessableEntityError)
+
+
+# Ways providers state the largest max_tokens they accept. Only these are trusted: error messages also
+# carry status codes, context sizes, prompt token counts and dated model names, and a limit read from
+# one of those would be remembered and cap every later request.
+MAX_TOKENS_LIMIT_PATTERNS = [
+    # OpenAI and Azure: "This model supports at most 4096 completion tokens"
+    re.compile(r"supports at most (\d+) (?:completion |output )?tokens"),
+    # Groq: "`max_tokens` must be less than or equal to `8192`"
+    re.compile(r"max_tokens`? must be less than or equal to `?(\d+)`?"),
+    # Anthropic: "max_tokens: 10000 > 8192, which is the maximum allowed number of output tokens"
+    re.compile(r"max_tokens: \d+ > (\d+), which is the maximum allowed"),
+    # DeepSeek: "the valid range of max_tokens is [1, 8192]"
+    re.compile(r"valid range of max_tokens is \[\d+, (\d+)\]"),
+]
+
+
+def _reported_max_tokens(error: Exception, requested: int) -> Optional[int]:
+    """
+    The completion length limit stated in a rejected request's error message.
+
+    Args:
+        error: The rejection
+        requested: The max_tokens the request asked for
+
+    Returns:
+        The limit, or None unless the message states one below the request in a recognized form
+    """
+    message = str(error)
+    for pattern in MAX_TOKENS_LIMIT_PATTERNS:
+        match = pattern.search(message)
+        if match and 0 < int(match.group(1)) < requested:
+            return int(match.group(1))
+    return None
+
+# Tokens allowed for a structured request's system prompt, and for its instructions on top of the context budget
+STRUCTURED_SYSTEM_PROMPT_TOKENS = 1000
+STRUCTURED_INSTRUCTION_TOKENS = 1500
+
+# Initialize a non-blocking OpenAI client; its connection pool is shared by every request in this worker
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    timeout=LLM_TIMEOUT,
+    http_client=httpx.AsyncClient(
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS
+        )
+    )
+)
 
 # Print a debug message to check if the API key is loaded
 api_key = os.getenv("OPENAI_API_KEY")
@@ -39,19 +104,133 @@ else:
 class LLMService:
     """Service for interacting with OpenAI's language models."""
 
-    def __init__(self, model: str = None):
+    def __init__(self, model: str = None, llm_client: AsyncOpenAI = None, max_concurrency: int = None,
+                 cache: ResponseCache = response_cache, capabilities: ModelCapabilities = model_capabilities):
         """
         Initialize the LLM service.
 
         Args:
             model: The OpenAI model to use
+            llm_client: OpenAI-compatible async client (defaults to the shared client)
+            max_concurrency: Maximum number of completions in flight at once
+            cache: Cache of completion texts keyed on the request, or None to disable caching
+            capabilities: Record of the API features each model supports
         """
         self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        self.client = llm_client or client
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self.cache = cache
+        self.context_budget = context_budget(self.model)
+        self.capabilities = capabilities
+        self.capability_key = ModelCapabilities.key(self.client.base_url, self.model)
+        # Created on first use so it binds to the server's event loop
+        self._semaphore = None
         logger.info(f"Initialized LLMService with model: {self.model}")
-        if not client.api_key:
+        if not self.client.api_key:
             logger.error("OpenAI API key is not set. Please check your .env file.")
             raise ValueError("OpenAI API key is not set. Please check your .env file.")
 
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _create_completion(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                                 timeout: float, **kwargs):
+        """
+        Run a chat completion without blocking the event loop.
+
+        Args:
+            messages: Chat messages to send
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens to generate
+            timeout: Timeout for this call in seconds
+            **kwargs: Extra arguments for the completions API
+
+        Returns:
+            The chat completion response
+        """
+        # Bound the number of completions in flight; cancelling the caller cancels the request
+        async with self._get_semaphore():
+            return await self._request(messages, temperature, max_tokens, timeout, **kwargs)
+
+    async def _request(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                       timeout: float, **kwargs):
+        """
+        Send a chat completion request, keeping max_tokens within the model's known limit.
+
+        A request rejected for asking too many tokens is retried once at the
+        limit the error names, and the limit is remembered. The caller holds
+        the concurrency slot.
+
+        Args:
+            messages: Chat messages to send
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens to generate
+            timeout: Timeout for this call in seconds
+            **kwargs: Extra arguments for the completions API, such as stream or response_format
+
+        Returns:
+            The chat completion response, or a stream when stream=True
+        """
+        limit = self.capabilities.max_tokens(self.capability_key) if self.capabilities else None
+        if limit:
+            max_tokens = min(max_tokens, limit)
+
+        try:
+            return await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout,
+                **kwargs
+            )
+        except REJECTED_REQUEST_ERRORS as e:
+            limit = _reported_max_tokens(e, max_tokens) if self.capabilities else None
+            if limit is None:
+                raise
+            logger.warning(f"Model rejected max_tokens={max_tokens}, retrying with {limit}")
+            self.capabilities.record_max_tokens(self.capability_key, limit)
+            self.capabilities.count_fallback(self.capability_key, "max_tokens")
+            return await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=limit,
+                timeout=timeout,
+                **kwargs
+            )
+
+    def _supports(self, feature: str) -> Optional[bool]:
+        """Whether this service's model is known to support a feature (None if unknown or not tracked)."""
+        return self.capabilities.supports(self.capability_key, feature) if self.capabilities else None
+
+    def _record(self, feature: str, supported: bool) -> None:
+        if self.capabilities:
+            self.capabilities.record(self.capability_key, feature, supported)
+
+    def _count_fallback(self, feature: str, skipped: bool = False) -> None:
+        if self.capabilities:
+            self.capabilities.count_fallback(self.capability_key, feature, skipped)
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]], completion: str) -> int:
+        """Token count for a completion whose response did not report usage (streams)."""
+        return sum(count_tokens(message["content"], self.model) for message in messages) + count_tokens(completion, self.model)
+
+    def pack_context(self, context_chunks: List[Dict[str, Any]], budget: int = None) -> PackedContext:
+        """
+        Choose the chunks to send to the model within a token budget.
+
+        Args:
+            context_chunks: Candidate chunks, best first or with scores
+            budget: Token budget (defaults to the budget for this service's model)
+
+        Returns:
+            The packed context
+        """
+        return pack_context(context_chunks, budget or self.context_budget, self.model)
+
     def _format_context(self, context_chunks: List[Dict[str, Any]]) -> str:
         """
         Format the context chunks into a string for the prompt.
@@ -160,41 +339,136 @@ Answer:"""
 
         return False
 
-    async def generate_answer(self, question: str, context_chunks: List[Dict[str, Any]]) -> str:
+    async def generate_answer(self, question: str, context_chunks: List[Dict[str, Any]], timeout: float = None,
+                              use_cache: bool = True) -> str:
         """
         Generate an answer using the OpenAI API.
 
         Args:
             question: The user's question
             context_chunks: Relevant document chunks for context
+            timeout: Timeout for the completion in seconds (defaults to LLM_TIMEOUT)
+            use_cache: Whether to reuse and store answers in the response cache
 
         Returns:
             Generated answer
         """
+        messages = self._answer_messages(question, context_chunks)
+        cache_key = response_cache_key(self.model, messages, 0.3, 1000)
+        if use_cache and self.cache:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("Answer served from response cache")
+                return cached
+
+        response = await self._create_completion(
+            messages=messages,
+            temperature=0.3,
+            max_tokens=1000,
+            timeout=timeout or LLM_TIMEOUT
+        )
+
+        answer = response.choices[0].message.content
+        if use_cache and self.cache and answer:
+            await self.cache.put(cache_key, answer, response.usage.total_tokens if response.usage else 0)
+        return answer
+
+    async def stream_answer(self, question: str, context_chunks: List[Dict[str, Any]], timeout: float = None,
+                            use_cache: bool = True) -> AsyncIterator[str]:
+        """
+        Generate an answer and yield it piece by piece as the model produces it.
+
+        A cached answer is yielded in one piece.
+
+        Args:
+            question: The user's question
+            context_chunks: Relevant document chunks for context
+            timeout: Timeout for the completion in seconds (defaults to LLM_TIMEOUT)
+            use_cache: Whether to reuse and store answers in the response cache
+
+        Yields:
+            Answer text fragments, in order
+        """
+        messages = self._answer_messages(question, context_chunks)
+        cache_key = response_cache_key(self.model, messages, 0.3, 1000)
+        if use_cache and self.cache:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("Answer served from response cache")
+                yield cached
+                return
+
+        if self._supports("streaming") is False:
+            self._count_fallback("streaming", skipped=True)
+            yield await self.generate_answer(question, context_chunks, timeout=timeout, use_cache=use_cache)
+            return
+
+        parts = []
+        # The concurrency slot is held until the stream ends or the consumer stops reading
+        async with self._get_semaphore():
+            try:
+                stream = await self._request(messages, 0.3, 1000, timeout or LLM_TIMEOUT, stream=True)
+            except REJECTED_REQUEST_ERRORS as e:
+                logger.error(f"Streaming request rejected: {e}")
+                stream = None
+            if stream is not None:
+                self._record("streaming", True)
+                try:
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                finally:
+                    # Closes the connection early if the client disconnected mid-answer
+                    await stream.response.aclose()
+
+        if stream is None:
+            # Outside the concurrency slot, which generate_answer takes for itself
+            logger.info("Falling back to a non-streaming completion")
+            self._count_fallback("streaming")
+            answer = await self.generate_answer(question, context_chunks, timeout=timeout, use_cache=use_cache)
+            self._record("streaming", False)
+            yield answer
+            return
+
+        # Only answers that streamed to completion reach this point
+        answer = "".join(parts)
+        if use_cache and self.cache and answer:
+            await self.cache.put(cache_key, answer, self._estimate_tokens(messages, answer))
+
+    def _answer_messages(self, question: str, context_chunks: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """
+        Build the chat messages for answering a question.
+
+        Args:
+            question: The user's question
+            context_chunks: Relevant document chunks for context
+
+        Returns:
+            Chat messages for the completions API
+        """
         # Detect if question likely needs interpretation
         allow_interpretation = self._detect_interpretation_question(question)
 
-        prompt = self._create_prompt(question, context_chunks, allow_interpretation)
+        # Packing chunks that were already packed leaves them unchanged
+        packed = self.pack_context(context_chunks)
+        prompt = self._create_prompt(question, packed.chunks, allow_interpretation)
 
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant answering questions about PDF documents."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=1000
-        )
-
-        return response.choices[0].message.content
+        return [
+            {"role": "system", "content": "You are a helpful AI assistant answering questions about PDF documents."},
+            {"role": "user", "content": prompt}
+        ]
 
-    async def generate_structured_response(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+    async def generate_structured_response(self, system_prompt: str, user_prompt: str, timeout: float = None,
+                                           use_cache: bool = True) -> Dict[str, Any]:
         """
         Generate a structured JSON response using the OpenAI API.
 
         Args:
             system_prompt: The system prompt for the LLM
             user_prompt: The user prompt for the LLM
+            timeout: Timeout for each completion attempt in seconds (defaults to LLM_STRUCTURED_TIMEOUT)
+            use_cache: Whether to reuse and store responses in the response cache
 
         Returns:
             Parsed JSON response
@@ -204,51 +478,49 @@ Answer:"""
             logger.info(f"Generating structured response with model: {self.model}")
             start_time = time.time()
 
-            # Breaking up prompts if they're too long
-            max_system_prompt_length = 3000
-            max_user_prompt_length = 12000
-
-            if len(system_prompt) > max_system_prompt_length:
-                logger.warning(f"Truncating system prompt from {len(system_prompt)} chars to {max_system_prompt_length}")
-                system_prompt = system_prompt[:max_system_prompt_length]
+            system_prompt, user_prompt = self._truncate_structured_prompts(system_prompt, user_prompt)
 
-            if len(user_prompt) > max_user_prompt_length:
-                logger.warning(f"Truncating user prompt from {len(user_prompt)} chars to {max_user_prompt_length}")
-                # Keep the beginning and ending parts of the prompt
-                # This is important for quiz generation where the JSON format instructions are at the end
-                beginning = user_prompt[:max_user_prompt_length // 2]
-                ending = user_prompt[-max_user_prompt_length // 2:]
-                user_prompt = beginning + "\n\n[Content truncated due to length]\n\n" + ending
+            cache_key = self._structured_cache_key(system_prompt, user_prompt)
+            if use_cache and self.cache:
+                cached = await self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info("Structured response served from response cache")
+                    return self._parse_structured_response(cached)
 
-            logger.info(f"Prompt sizes - System: {len(system_prompt)}, User: {len(user_prompt)}")
-
-            # Try with JSON format first
-            try:
-                logger.info("Attempting with response_format=json_object")
-                response = client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
+            # Use JSON mode unless this model is known to reject it
+            response = None
+            json_mode_rejected = False
+            if self._supports("json_mode") is False:
+                self._count_fallback("json_mode", skipped=True)
+            else:
+                try:
+                    logger.info("Attempting with response_format=json_object")
+                    response = await self._create_completion(
+                        messages=self._structured_messages(system_prompt, user_prompt, json_mode=True),
+                        temperature=0.5,
+                        max_tokens=4000,
+                        timeout=timeout or LLM_STRUCTURED_TIMEOUT,
+                        response_format={"type": "json_object"}
+                    )
+                    logger.info("Successfully received response with json_object format")
+                    self._record("json_mode", True)
+                except Exception as e:
+                    logger.error(f"Failed with json_object format: {e}")
+                    logger.info("Falling back to standard completion without response_format")
+                    self._count_fallback("json_mode")
+                    json_mode_rejected = isinstance(e, REJECTED_REQUEST_ERRORS)
+
+            if response is None:
+                response = await self._create_completion(
+                    messages=self._structured_messages(system_prompt, user_prompt, json_mode=False),
                     temperature=0.5,
                     max_tokens=4000,
-                    response_format={"type": "json_object"}
-                )
-                logger.info("Successfully received response with json_object format")
-            except Exception as e:
-                logger.error(f"Failed with json_object format: {e}")
-                logger.info("Falling back to standard completion without response_format")
-                response = client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt + "\nRESPOND WITH VALID JSON ONLY."},
-                        {"role": "user", "content": user_prompt + "\n\nRemember to respond with valid JSON only."}
-                    ],
-                    temperature=0.5,
-                    max_tokens=4000
+                    timeout=timeout or LLM_STRUCTURED_TIMEOUT
                 )
                 logger.info("Successfully received response with standard completion")
+                # Only a rejection the plain request did not share says JSON mode itself is unsupported
+                if json_mode_rejected:
+                    self._record("json_mode", False)
 
             response_text = response.choices[0].message.content
             request_time = time.time() - start_time
@@ -258,13 +530,11 @@ Answer:"""
             sample_length = min(300, len(response_text))
             logger.info(f"Response preview: {response_text[:sample_length]}...")
 
-            # Parse the response as JSON
-            json_response = self._extract_and_validate_json(response_text)
+            json_response = self._parse_structured_response(response_text)
 
-            # If it's for a quiz, validate and fix the structure
-            if "questions" in json_response:
-                logger.info("Detected quiz structure, validating and fixing if needed")
-                json_response = self._validate_and_fix_quiz(json_response)
+            # Responses that failed to parse are not cached so a retry asks the model again
+            if use_cache and self.cache and "error" not in json_response:
+                await self.cache.put(cache_key, response_text, response.usage.total_tokens if response.usage else 0)
 
             return json_response
 
@@ -281,6 +551,228 @@ Answer:"""
             logger.error(f"Returning error response: {error_response['error']}")
             return error_response
 
+    async def stream_quiz_questions(self, system_prompt: str, user_prompt: str, timeout: float = None,
+                                    use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate a quiz and yield each question as soon as the model has finished writing it.
+
+        Each question is validated and repaired on its own, the same way
+        generate_structured_response repairs a whole quiz. A cached quiz is
+        yielded straight away.
+
+        Args:
+            system_prompt: The system prompt for the LLM
+            user_prompt: The user prompt for the LLM; it should ask for {"questions": [...]}
+            timeout: Timeout for the completion in seconds (defaults to LLM_STRUCTURED_TIMEOUT)
+            use_cache: Whether to reuse and store responses in the response cache
+
+        Yields:
+            Validated question dictionaries, in order
+        """
+        logger.info(f"Streaming quiz questions with model: {self.model}")
+        start_time = time.time()
+        system_prompt, user_prompt = self._truncate_structured_prompts(system_prompt, user_prompt)
+
+        cache_key = self._structured_cache_key(system_prompt, user_prompt)
+        if use_cache and self.cache:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("Quiz served from response cache")
+                for question in self._parse_structured_response(cached).get("questions", []):
+                    yield question
+                return
+
+        if self._supports("streaming") is False:
+            self._count_fallback("streaming", skipped=True)
+            async for question in self._unstreamed_quiz_questions(system_prompt, user_prompt, timeout, use_cache):
+                yield question
+            return
+
+        parser = QuestionStreamParser()
+        response_parts = []
+        count = 0
+
+        # The concurrency slot is held until the stream ends or the consumer stops reading
+        async with self._get_semaphore():
+            stream = await self._open_structured_stream(system_prompt, user_prompt, timeout or LLM_STRUCTURED_TIMEOUT)
+            if stream is not None:
+                try:
+                    async for chunk in stream:
+                        if not chunk.choices or not chunk.choices[0].delta.content:
+                            continue
+                        text = chunk.choices[0].delta.content
+                        response_parts.append(text)
+                        for question in parser.feed(text):
+                            if count == 0:
+                                logger.info(f"First question parsed after {time.time() - start_time:.2f}s")
+                            yield self._validate_and_fix_question(question, count)
+                            count += 1
+                finally:
+                    await stream.response.aclose()
+
+        if stream is None:
+            # Outside the concurrency slot, which generate_structured_response takes for itself
+            self._count_fallback("streaming")
+            async for question in self._unstreamed_quiz_questions(system_prompt, user_prompt, timeout, use_cache,
+                                                                  record=True):
+                yield question
+            return
+
+        if count == 0:
+            # Nothing recognizable streamed past; fall back to parsing the whole response
+            response_text = "".join(response_parts)
+            logger.warning("No questions parsed incrementally, parsing the full response")
+            quiz_json = self._extract_and_validate_json(response_text)
+            if "questions" in quiz_json:
+                for question in self._validate_and_fix_quiz(quiz_json)["questions"]:
+                    yield question
+                    count += 1
+            else:
+                logger.error(f"Could not find quiz questions in response: {response_text[:300]}...")
+
+        logger.info(f"Streamed {count} questions in {time.time() - start_time:.2f}s")
+
+        if use_cache and self.cache and count:
+            response_text = "".join(response_parts)
+            # A stream cut short still yielded its first questions, but replaying it would serve no quiz at all
+            quiz_json = self._extract_and_validate_json(response_text)
+            if "error" not in quiz_json and isinstance(quiz_json.get("questions"), list):
+                messages = self._structured_messages(system_prompt, user_prompt, json_mode=True)
+                await self.cache.put(cache_key, response_text, self._estimate_tokens(messages, response_text))
+            else:
+                logger.warning("Not caching the streamed quiz: the full response is not a valid quiz")
+
+    async def _open_structured_stream(self, system_prompt: str, user_prompt: str, timeout: float):
+        """
+        Open a streaming structured completion, in JSON mode unless the model is known to reject it.
+
+        The caller holds the concurrency slot.
+
+        Args:
+            system_prompt: The system prompt for the LLM
+            user_prompt: The user prompt for the LLM
+            timeout: Timeout for the completion in seconds
+
+        Returns:
+            The open stream, or None if the model rejected the streaming request
+        """
+        json_mode_rejected = False
+        if self._supports("json_mode") is False:
+            self._count_fallback("json_mode", skipped=True)
+        else:
+            try:
+                stream = await self._request(
+                    self._structured_messages(system_prompt, user_prompt, json_mode=True), 0.5, 4000, timeout,
+                    response_format={"type": "json_object"},
+                    stream=True
+                )
+                self._record("json_mode", True)
+                self._record("streaming", True)
+                return stream
+            except Exception as e:
+                logger.error(f"Failed with json_object format: {e}")
+                logger.info("Falling back to standard streaming completion without response_format")
+                self._count_fallback("json_mode")
+                json_mode_rejected = isinstance(e, REJECTED_REQUEST_ERRORS)
+
+        try:
+            stream = await self._request(
+                self._structured_messages(system_prompt, user_prompt, json_mode=False), 0.5, 4000, timeout,
+                stream=True
+            )
+        except REJECTED_REQUEST_ERRORS as e:
+            logger.error(f"Streaming request rejected: {e}")
+            return None
+
+        if json_mode_rejected:
+            self._record("json_mode", False)
+        self._record("streaming", True)
+        return stream
+
+    async def _unstreamed_quiz_questions(self, system_prompt: str, user_prompt: str, timeout: float, use_cache: bool,
+                                         record: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate a quiz in one completion for models that cannot stream, yielding its questions.
+
+        Args:
+            system_prompt: The system prompt for the LLM
+            user_prompt: The user prompt for the LLM
+            timeout: Timeout for each completion attempt in seconds
+            use_cache: Whether to reuse and store responses in the response cache
+            record: Whether to record streaming as unsupported once the completion succeeds
+
+        Yields:
+            Validated question dictionaries, in order
+        """
+        logger.info("Falling back to a non-streaming completion")
+        response = await self.generate_structured_response(system_prompt, user_prompt, timeout=timeout,
+                                                           use_cache=use_cache)
+        if record and "error" not in response:
+            self._record("streaming", False)
+        for question in response.get("questions", []):
+            yield question
+
+    def _structured_cache_key(self, system_prompt: str, user_prompt: str) -> str:
+        """Response cache key shared by generate_structured_response and stream_quiz_questions."""
+        return response_cache_key(
+            self.model,
+            self._structured_messages(system_prompt, user_prompt, json_mode=True),
+            0.5,
+            4000,
+            response_format={"type": "json_object"}
+        )
+
+    def _parse_structured_response(self, response_text: str) -> Dict[str, Any]:
+        """Parse a structured response and repair it if it is a quiz."""
+        # Parse the response as JSON
+        json_response = self._extract_and_validate_json(response_text)
+
+        # If it's for a quiz, validate and fix the structure
+        if "questions" in json_response:
+            logger.info("Detected quiz structure, validating and fixing if needed")
+            json_response = self._validate_and_fix_quiz(json_response)
+
+        return json_response
+
+    def _truncate_structured_prompts(self, system_prompt: str, user_prompt: str) -> Tuple[str, str]:
+        """
+        Shorten over-long structured prompts, keeping the format instructions at the end.
+
+        Callers should pack their context with pack_context so this only
+        catches prompts that were built without a budget.
+        """
+        system_tokens = count_tokens(system_prompt, self.model)
+        if system_tokens > STRUCTURED_SYSTEM_PROMPT_TOKENS:
+            logger.warning(f"Truncating system prompt from {system_tokens} tokens to {STRUCTURED_SYSTEM_PROMPT_TOKENS}")
+            system_prompt = truncate_to_tokens(system_prompt, STRUCTURED_SYSTEM_PROMPT_TOKENS, self.model)
+            system_tokens = STRUCTURED_SYSTEM_PROMPT_TOKENS
+
+        max_user_tokens = self.context_budget + STRUCTURED_INSTRUCTION_TOKENS
+        user_tokens = count_tokens(user_prompt, self.model)
+        if user_tokens > max_user_tokens:
+            logger.warning(f"Truncating user prompt from {user_tokens} tokens to {max_user_tokens}")
+            # Keep the beginning and ending parts of the prompt
+            # This is important for quiz generation where the JSON format instructions are at the end
+            beginning = truncate_to_tokens(user_prompt, max_user_tokens // 2, self.model)
+            ending = truncate_to_tokens(user_prompt, max_user_tokens // 2, self.model, from_end=True)
+            user_prompt = beginning + "\n\n[Content truncated due to length]\n\n" + ending
+            user_tokens = max_user_tokens
+
+        logger.info(f"Prompt sizes - System: {system_tokens} tokens, User: {user_tokens} tokens")
+        return system_prompt, user_prompt
+
+    def _structured_messages(self, system_prompt: str, user_prompt: str, json_mode: bool) -> List[Dict[str, str]]:
+        """Build the chat messages for a structured request, adding JSON reminders when JSON mode is off."""
+        if json_mode:
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+        return [
+            {"role": "system", "content": system_prompt + "\nRESPOND WITH VALID JSON ONLY."},
+            {"role": "user", "content": user_prompt + "\n\nRemember to respond with valid JSON only."}
+        ]
+
     def _extract_and_validate_json(self, text: str) -> Dict[str, Any]:
         """Extract and validate JSON from model response text."""
         try:
@@ -333,67 +825,81 @@ Answer:"""
 
         # Fix any malformed questions
         for i, question in enumerate(quiz_json['questions']):
-            logger.info(f"Checking question {i+1}")
-
-            # Ensure question has the required fields
-            if not isinstance(question, dict):
-                logger.warning(f"Question {i+1} is not a dictionary: {question}")
-                quiz_json['questions'][i] = {
-                    "question": f"Question {i+1} (malformed)",
-                    "answers": [
-                        {"text": "Option A", "is_correct": True},
-                        {"text": "Option B", "is_correct": False},
-                        {"text": "Option C", "is_correct": False},
-                        {"text": "Option D", "is_correct": False}
-                    ],
-                    "explanation": "This is a placeholder for a malformed question."
-                }
-                continue
-
-            # Fix missing fields
-            if "question" not in question or not question["question"]:
-                logger.warning(f"Question {i+1} missing question field")
-                question["question"] = f"Question {i+1}"
-
-            if "explanation" not in question or not question["explanation"]:
-                logger.warning(f"Question {i+1} missing explanation field")
-                question["explanation"] = "No explanation provided."
-
-            # Fix answers structure
-            if "answers" not in question or not isinstance(question["answers"], list) or len(question["answers"]) < 2:
-                logger.warning(f"Question {i+1} has invalid answers: {question.get('answers', 'missing')}")
-                question["answers"] = [
+            quiz_json['questions'][i] = self._validate_and_fix_question(question, i)
+
+        return quiz_json
+
+    def _validate_and_fix_question(self, question: Any, i: int) -> Dict[str, Any]:
+        """
+        Validate one quiz question and repair missing or malformed fields.
+
+        Args:
+            question: The question as parsed from the model output
+            i: Zero-based position of the question in the quiz
+
+        Returns:
+            A question dictionary with question, answers and explanation
+        """
+        logger.info(f"Checking question {i+1}")
+
+        # Ensure question has the required fields
+        if not isinstance(question, dict):
+            logger.warning(f"Question {i+1} is not a dictionary: {question}")
+            return {
+                "question": f"Question {i+1} (malformed)",
+                "answers": [
                     {"text": "Option A", "is_correct": True},
                     {"text": "Option B", "is_correct": False},
                     {"text": "Option C", "is_correct": False},
                     {"text": "Option D", "is_correct": False}
-                ]
-            else:
-                # Make sure each answer has text and is_correct fields
-                has_correct = False
-                for j, answer in enumerate(question["answers"]):
-                    if not isinstance(answer, dict):
-                        logger.warning(f"Question {i+1}, Answer {j+1} is not a dictionary")
-                        question["answers"][j] = {"text": f"Option {j+1}", "is_correct": j == 0}
-                        continue
-
-                    if "text" not in answer or not answer["text"]:
-                        logger.warning(f"Question {i+1}, Answer {j+1} missing text field")
-                        answer["text"] = f"Option {j+1}"
-
-                    if "is_correct" not in answer:
-                        logger.warning(f"Question {i+1}, Answer {j+1} missing is_correct field")
-                        answer["is_correct"] = False
-
-                    if answer["is_correct"]:
-                        has_correct = True
-
-                # Ensure at least one correct answer
-                if not has_correct and question["answers"]:
-                    logger.warning(f"Question {i+1} has no correct answer, fixing")
-                    question["answers"][0]["is_correct"] = True
+                ],
+                "explanation": "This is a placeholder for a malformed question."
+            }
 
-        return quiz_json
+        # Fix missing fields
+        if "question" not in question or not question["question"]:
+            logger.warning(f"Question {i+1} missing question field")
+            question["question"] = f"Question {i+1}"
+
+        if "explanation" not in question or not question["explanation"]:
+            logger.warning(f"Question {i+1} missing explanation field")
+            question["explanation"] = "No explanation provided."
+
+        # Fix answers structure
+        if "answers" not in question or not isinstance(question["answers"], list) or len(question["answers"]) < 2:
+            logger.warning(f"Question {i+1} has invalid answers: {question.get('answers', 'missing')}")
+            question["answers"] = [
+                {"text": "Option A", "is_correct": True},
+                {"text": "Option B", "is_correct": False},
+                {"text": "Option C", "is_correct": False},
+                {"text": "Option D", "is_correct": False}
+            ]
+        else:
+            # Make sure each answer has text and is_correct fields
+            has_correct = False
+            for j, answer in enumerate(question["answers"]):
+                if not isinstance(answer, dict):
+                    logger.warning(f"Question {i+1}, Answer {j+1} is not a dictionary")
+                    question["answers"][j] = {"text": f"Option {j+1}", "is_correct": j == 0}
+                    continue
+
+                if "text" not in answer or not answer["text"]:
+                    logger.warning(f"Question {i+1}, Answer {j+1} missing text field")
+                    answer["text"] = f"Option {j+1}"
+
+                if "is_correct" not in answer:
+                    logger.warning(f"Question {i+1}, Answer {j+1} missing is_correct field")
+                    answer["is_correct"] = False
+
+                if answer["is_correct"]:
+                    has_correct = True
+
+            # Ensure at least one correct answer
+            if not has_correct and question["answers"]:
+                logger.warning(f"Question {i+1} has no correct answer, fixing")
+                question["answers"][0]["is_correct"] = True
+
+        return question
 
 # Function to get a singleton OpenAI client instance
 def get_llm_client():
@@ -401,6 +907,6 @@ def get_llm_client():
     Returns the initialized OpenAI client instance.
 
     Returns:
-        OpenAI: The initialized OpenAI client
+        AsyncOpenAI: The initialized OpenAI client
     """
     return client
\ No newline at end of file
@@ -0,0 +1,149 @@
+from typing import Any, Dict, Optional
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger("model_capabilities")
+
+MODEL_CAPABILITIES_PATH = os.getenv(
+    "MODEL_CAPABILITIES_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "model_capabilities.json"))
+)
+
+# Optional API features whose support is learned per endpoint and model
+FEATURES = ("json_mode", "streaming")
+
+
+class ModelCapabilities:
+    """
+    What each endpoint and model has been seen to support, persisted to a JSON file.
+
+    A feature is unknown until a call using it succeeds or is rejected. Callers
+    use the recorded answer to pick the call path that works the first time,
+    and record every fallback so their frequency can be monitored.
+    """
+
+    def __init__(self, path: Optional[str] = MODEL_CAPABILITIES_PATH):
+        """
+        Initialize the store.
+
+        Args:
+            path: JSON file to load from and save to, or None to keep capabilities in memory only
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, Any]] = self._load()
+
+    @staticmethod
+    def key(base_url: Any, model: str) -> str:
+        """Key for a model behind a particular API endpoint, since proxies differ in what they accept."""
+        return f"{str(base_url).rstrip('/')}|{model}"
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("models", {})
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable model capabilities file {self.path}: {e}")
+            return {}
+
+    def _save(self) -> None:
+        """Write the file; the caller holds the lock."""
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({"models": self._models}, f, indent=2, sort_keys=True)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            logger.warning(f"Could not save model capabilities to {self.path}: {e}")
+
+    def _entry(self, key: str) -> Dict[str, Any]:
+        return self._models.setdefault(key, {"max_tokens": None, "fallbacks": {}, "skipped": {}})
+
+    def supports(self, key: str, feature: str) -> Optional[bool]:
+        """
+        Whether a model supports a feature.
+
+        Args:
+            key: Endpoint and model key from ModelCapabilities.key
+            feature: One of FEATURES
+
+        Returns:
+            True or False once known, None before the feature has been tried
+        """
+        with self._lock:
+            return self._models.get(key, {}).get(feature)
+
+    def record(self, key: str, feature: str, supported: bool) -> None:
+        """
+        Record whether a model accepted a feature.
+
+        Args:
+            key: Endpoint and model key from ModelCapabilities.key
+            feature: One of FEATURES
+            supported: Whether the call using the feature succeeded
+        """
+        with self._lock:
+            entry = self._entry(key)
+            if entry.get(feature) == supported:
+                return
+            entry[feature] = supported
+            logger.info(f"{key}: {feature} {'supported' if supported else 'not supported'}")
+            self._save()
+
+    def max_tokens(self, key: str) -> Optional[int]:
+        """Largest completion length a model has accepted, if it has rejected a larger one."""
+        with self._lock:
+            return self._models.get(key, {}).get("max_tokens")
+
+    def record_max_tokens(self, key: str, limit: int) -> None:
+        """
+        Record the completion length limit a model reported.
+
+        Args:
+            key: Endpoint and model key from ModelCapabilities.key
+            limit: Maximum tokens per completion
+        """
+        with self._lock:
+            entry = self._entry(key)
+            if entry.get("max_tokens") == limit:
+                return
+            entry["max_tokens"] = limit
+            logger.info(f"{key}: max_tokens limited to {limit}")
+            self._save()
+
+    def count_fallback(self, key: str, feature: str, skipped: bool = False) -> None:
+        """
+        Count a call that could not use a feature.
+
+        Args:
+            key: Endpoint and model key from ModelCapabilities.key
+            feature: The feature that was not used
+            skipped: True if the feature was known to be unsupported and not tried,
+                False if it was tried and the call had to be repeated without it
+        """
+        with self._lock:
+            counters = self._entry(key)["skipped" if skipped else "fallbacks"]
+            counters[feature] = counters.get(feature, 0) + 1
+            # Skips happen on every call once a feature is known to be missing, so only real fallbacks are written
+            if not skipped:
+                self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the recorded capabilities and fallback counters.
+
+        Returns:
+            Dictionary keyed by endpoint and model
+        """
+        with self._lock:
+            return json.loads(json.dumps(self._models))
+
+
+# Shared by every LLMService in this process
+model_capabilities = ModelCapabilities()
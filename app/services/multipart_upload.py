@@ -0,0 +1,145 @@
+from typing import AsyncIterator, Mapping, Optional
+
+from multipart.exceptions import FormParserError
+from multipart.multipart import MultipartParser, parse_options_header
+
+# Most of the body parsed at a time, however large the pieces the server receives it in
+PARSE_PIECE_BYTES = 64 * 1024
+
+
+class MalformedUploadError(ValueError):
+    """Raised when an upload request is not a multipart form holding the expected file."""
+
+
+class MultipartFileStream:
+    """
+    Reads one file out of a multipart/form-data request body as the body arrives.
+
+    FastAPI's File parameters spool the whole body to a temporary file before
+    the route runs. This parser is fed the raw request stream instead and hands
+    out the file's bytes through read(size), like UploadFile, so the reader can
+    write them where they belong and stop reading the body whenever it wants.
+    Other form fields are skipped.
+    """
+
+    def __init__(self, headers: Mapping[str, str], body: AsyncIterator[bytes], field_name: str = "file"):
+        """
+        Initialize the stream.
+
+        Args:
+            headers: Request headers, for the Content-Type boundary
+            body: The request body as it arrives, such as Request.stream()
+            field_name: Form field holding the file
+
+        Raises:
+            MalformedUploadError: If the request is not multipart/form-data
+        """
+        content_type, params = parse_options_header(headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+            raise MalformedUploadError("Upload must be sent as multipart/form-data")
+
+        self.field_name = field_name.encode()
+        self.filename: Optional[str] = None
+        # Bytes of the body parsed so far
+        self.received = 0
+        self._body = body.__aiter__()
+        self._unparsed = memoryview(b"")
+        self._parser = MultipartParser(params[b"boundary"], callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+        # File bytes parsed but not read yet; at most one parsed piece beyond what was asked for
+        self._pending = bytearray()
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._in_file = False
+        self._file_done = False
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if self.filename is None and options.get(b"name") == self.field_name:
+            self.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._pending += data[start:end]
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _feed(self) -> None:
+        """Parse the next piece of the body."""
+        while not self._unparsed:
+            try:
+                self._unparsed = memoryview(await self._body.__anext__())
+            except StopAsyncIteration:
+                if self.filename is None:
+                    raise MalformedUploadError(f"No '{self.field_name.decode()}' file in the upload")
+                raise MalformedUploadError("Upload ended before the file was complete")
+
+        data = bytes(self._unparsed[:PARSE_PIECE_BYTES])
+        self._unparsed = self._unparsed[PARSE_PIECE_BYTES:]
+        self.received += len(data)
+        try:
+            self._parser.write(data)
+        except FormParserError as e:
+            raise MalformedUploadError(f"Malformed multipart upload: {str(e)}")
+
+    async def open(self) -> str:
+        """
+        Read the body up to the start of the file.
+
+        Returns:
+            The file's name as sent by the client
+
+        Raises:
+            MalformedUploadError: If the body ends without the file
+        """
+        while self.filename is None:
+            await self._feed()
+        return self.filename
+
+    async def read(self, size: int = -1) -> bytes:
+        """
+        Read the next bytes of the file.
+
+        Args:
+            size: Most bytes to return, or -1 for the rest of the file
+
+        Returns:
+            The bytes read, or b"" once the file has been read to its end
+
+        Raises:
+            MalformedUploadError: If the body is malformed or ends inside the file
+        """
+        await self.open()
+        while not self._file_done and (size < 0 or len(self._pending) < size):
+            await self._feed()
+        count = len(self._pending) if size < 0 else size
+        data = bytes(self._pending[:count])
+        del self._pending[:count]
+        return data
@@ -0,0 +1,155 @@
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import fitz  # PyMuPDF
+
+logger = logging.getLogger("pdf_extractor")
+
+# Processes extracting page text; 1 extracts in the calling thread
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages per task handed to a worker process
+PDF_EXTRACT_PAGES_PER_TASK = int(os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "50"))
+# Documents shorter than this are extracted in the calling thread, where starting tasks would cost more than it saves
+PDF_EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv("PDF_EXTRACT_PARALLEL_MIN_PAGES", "100"))
+
+
+def _extract_range(path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF file; runs in a worker process."""
+    with fitz.open(path) as doc:
+        return [doc.load_page(page_num).get_text() for page_num in range(start, end)]
+
+
+def page_ranges(num_pages: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    """
+    Split a document's pages into consecutive ranges.
+
+    Args:
+        num_pages: Pages in the document
+        pages_per_task: Most pages per range
+
+    Returns:
+        (start, end) ranges in page order, end exclusive
+    """
+    return [(start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+
+
+class PDFExtractor:
+    """
+    Page text extraction spread over a pool of worker processes.
+
+    PyMuPDF holds the GIL while it extracts, so threads do not help. Each
+    worker opens the document file and extracts a range of pages, and the
+    ranges are joined back in page order. Documents given as bytes are
+    written to a temporary file first.
+    The pool is started on first use and shared by every extraction.
+    """
+
+    def __init__(self, workers: int = None, pages_per_task: int = None, parallel_min_pages: int = None):
+        """
+        Initialize the extractor.
+
+        Args:
+            workers: Worker processes (defaults to PDF_EXTRACT_WORKERS)
+            pages_per_task: Pages per task (defaults to PDF_EXTRACT_PAGES_PER_TASK)
+            parallel_min_pages: Smallest document extracted in the pool (defaults to PDF_EXTRACT_PARALLEL_MIN_PAGES)
+        """
+        self.workers = workers or PDF_EXTRACT_WORKERS
+        self.pages_per_task = pages_per_task or PDF_EXTRACT_PAGES_PER_TASK
+        self.parallel_min_pages = PDF_EXTRACT_PARALLEL_MIN_PAGES if parallel_min_pages is None else parallel_min_pages
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Forking a process that runs threads (the event loop's executor, FAISS) can deadlock the child
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def extract(self, pdf_file: Union[bytes, str],
+                progress_callback: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        """
+        Extract the text of every page of a PDF.
+
+        Args:
+            pdf_file: PDF file bytes, or the path of a PDF file
+            progress_callback: Optional callable receiving (pages extracted, total pages)
+
+        Returns:
+            List of text strings, one per page, in page order
+        """
+        return list(self.iter_pages(pdf_file, progress_callback))
+
+    def iter_pages(self, pdf_file: Union[bytes, str],
+                   progress_callback: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+        """
+        Extract the text of a PDF's pages, yielding each page as soon as it and every page before it are done.
+
+        Workers keep extracting up to two ranges each ahead of the consumer,
+        so a slow consumer holds back extraction instead of piling up pages.
+
+        Args:
+            pdf_file: PDF file bytes, or the path of a PDF file, which is read from disk as needed
+            progress_callback: Optional callable receiving (pages extracted, total pages)
+
+        Yields:
+            Page texts, in page order
+        """
+        from_path = isinstance(pdf_file, str)
+        with (fitz.open(pdf_file) if from_path else fitz.open(stream=pdf_file, filetype="pdf")) as doc:
+            num_pages = len(doc)
+            if self.workers <= 1 or num_pages < max(self.parallel_min_pages, 2):
+                for page_num in range(num_pages):
+                    text = doc.load_page(page_num).get_text()
+                    if progress_callback:
+                        progress_callback(page_num + 1, num_pages)
+                    yield text
+                return
+
+        ranges = deque(page_ranges(num_pages, self.pages_per_task))
+        logger.info(f"Extracting {num_pages} pages in {len(ranges)} ranges across {self.workers} processes")
+
+        if from_path:
+            path = pdf_file
+        else:
+            fd, path = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf_file)
+
+        futures: deque = deque()
+        extracted = 0
+        try:
+            pool = self._get_pool()
+            while ranges or futures:
+                while ranges and len(futures) < 2 * self.workers:
+                    start, end = ranges.popleft()
+                    futures.append(pool.submit(_extract_range, path, start, end))
+
+                pages = futures.popleft().result()
+                extracted += len(pages)
+                if progress_callback:
+                    progress_callback(extracted, num_pages)
+                yield from pages
+        finally:
+            for future in futures:
+                future.cancel()
+            # Running tasks still read the file; unlinking it leaves their open handles valid
+            if not from_path:
+                os.remove(path)
+
+    def shutdown(self) -> None:
+        """Stop the worker processes; the next extraction starts a new pool."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Shared by every upload in this process
+pdf_extractor = PDFExtractor()
@@ -0,0 +1,232 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import math
+import os
+import random
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, PooledQuestion
+from app.services.quiz_generator import question_words, is_duplicate_question
+
+logger = logging.getLogger("question_pool")
+
+# Pre-generation is off unless enabled, since it spends tokens on documents that may never be quizzed
+QUESTION_POOL_ENABLED = os.getenv("QUESTION_POOL_ENABLED", "false").lower() == "true"
+QUESTION_POOL_DIFFICULTIES = [
+    difficulty.strip().lower()
+    for difficulty in os.getenv("QUESTION_POOL_DIFFICULTIES", "easy,medium,hard").split(",")
+    if difficulty.strip()
+]
+# Questions kept per document and difficulty, the level that triggers a top-up, and questions asked for per call
+QUESTION_POOL_TARGET = int(os.getenv("QUESTION_POOL_TARGET", "15"))
+QUESTION_POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "5"))
+QUESTION_POOL_BATCH = int(os.getenv("QUESTION_POOL_BATCH", "10"))
+
+# Builds (system prompt, user prompt) from a number of questions, a difficulty and document text
+PoolPromptBuilder = Callable[[int, str, str], Tuple[str, str]]
+
+
+def _is_usable(question: Any) -> bool:
+    """Whether a validated question is complete enough to serve without review."""
+    if not isinstance(question, dict) or not str(question.get("question", "")).strip():
+        return False
+    answers = question.get("answers")
+    if not isinstance(answers, list) or len(answers) < 2:
+        return False
+    return sum(1 for answer in answers if isinstance(answer, dict) and answer.get("is_correct")) == 1
+
+
+class QuestionPool:
+    """
+    Pool of pre-generated quiz questions per document and difficulty.
+
+    After upload a background task fills the pool; quizzes then take their
+    questions from it instead of waiting on the model. Questions are removed
+    as they are served, and the pool tops itself up in the background once
+    it falls below the low-water mark.
+    """
+
+    def __init__(self, llm_service, retriever, build_prompts: PoolPromptBuilder, session_factory=SessionLocal,
+                 enabled: bool = None, difficulties: List[str] = None, target: int = None, low_water: int = None,
+                 batch_size: int = None):
+        """
+        Initialize the pool.
+
+        Args:
+            llm_service: Service used to generate questions
+            retriever: Retriever used to pick each document's context
+            build_prompts: Builds the prompts for a number of questions, a difficulty and document text
+            session_factory: Creates database sessions for the background tasks
+            enabled: Whether to pre-generate and serve pooled questions (defaults to QUESTION_POOL_ENABLED)
+            difficulties: Difficulty levels to keep questions for
+            target: Questions kept per document and difficulty
+            low_water: Remaining questions below which the pool is topped up
+            batch_size: Questions asked for per completion
+        """
+        self.llm_service = llm_service
+        self.retriever = retriever
+        self.build_prompts = build_prompts
+        self.session_factory = session_factory
+        self.enabled = QUESTION_POOL_ENABLED if enabled is None else enabled
+        self.difficulties = difficulties or QUESTION_POOL_DIFFICULTIES
+        self.target = target or QUESTION_POOL_TARGET
+        self.low_water = QUESTION_POOL_LOW_WATER if low_water is None else low_water
+        self.batch_size = batch_size or QUESTION_POOL_BATCH
+        # Running fill task per document
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        self.served = 0
+        self.misses = 0
+        self.generated = 0
+
+    def schedule_fill(self, pdf_id: str) -> None:
+        """
+        Start filling a document's pool in the background unless it is already being filled.
+
+        Must be called from the event loop.
+
+        Args:
+            pdf_id: The document to generate questions for
+        """
+        if not self.enabled:
+            return
+        task = self._tasks.get(pdf_id)
+        if task is not None and not task.done():
+            return
+
+        task = asyncio.create_task(self._fill(pdf_id))
+        self._tasks[pdf_id] = task
+
+        def forget(finished: asyncio.Task) -> None:
+            if self._tasks.get(pdf_id) is finished:
+                del self._tasks[pdf_id]
+
+        task.add_done_callback(forget)
+
+    def cancel(self, pdf_id: str) -> None:
+        """Stop filling a document's pool, for example because it was deleted."""
+        task = self._tasks.pop(pdf_id, None)
+        if task is not None:
+            task.cancel()
+
+    def draw(self, db: Session, pdf_id: str, difficulty: str, count: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Take questions for a quiz out of the pool.
+
+        Args:
+            db: Database session
+            pdf_id: The document the quiz is for
+            difficulty: Requested difficulty level
+            count: Number of questions wanted
+
+        Returns:
+            The questions, or None if the pool is disabled or holds too few
+            (the caller should generate the quiz itself)
+        """
+        if not self.enabled:
+            return None
+
+        difficulty = difficulty.lower()
+        rows = db.query(PooledQuestion).filter(
+            PooledQuestion.pdf_id == pdf_id,
+            PooledQuestion.difficulty == difficulty
+        ).all()
+
+        pooled = difficulty in self.difficulties
+        if len(rows) < count:
+            self.misses += 1
+            if pooled:
+                self.schedule_fill(pdf_id)
+            return None
+
+        chosen = random.sample(rows, count)
+        try:
+            for row in chosen:
+                db.delete(row)
+            db.commit()
+        except Exception as e:
+            # Another request took some of the same questions first
+            logger.warning(f"Could not take pooled questions for PDF ID {pdf_id}: {e}")
+            db.rollback()
+            self.misses += 1
+            return None
+
+        self.served += 1
+        if pooled and len(rows) - count < self.low_water:
+            self.schedule_fill(pdf_id)
+        return [row.question for row in chosen]
+
+    async def _fill(self, pdf_id: str) -> None:
+        """Bring every difficulty of a document's pool up to the target size."""
+        try:
+            chunks = await asyncio.to_thread(self.retriever.get_topic_chunks, pdf_id)
+            if not chunks:
+                logger.warning(f"No content to pre-generate questions for PDF ID {pdf_id}")
+                return
+            context = "\n\n".join(chunk["text"] for chunk in self.llm_service.pack_context(chunks).chunks)
+
+            for difficulty in self.difficulties:
+                await self._fill_difficulty(pdf_id, difficulty, context)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error filling question pool for PDF ID {pdf_id}: {e}")
+
+    async def _fill_difficulty(self, pdf_id: str, difficulty: str, context: str) -> None:
+        db = self.session_factory()
+        try:
+            existing = [row.question for row in db.query(PooledQuestion).filter(
+                PooledQuestion.pdf_id == pdf_id,
+                PooledQuestion.difficulty == difficulty
+            ).all()]
+            seen = [question_words(question) for question in existing]
+            missing = self.target - len(existing)
+
+            # One extra attempt to make up for duplicates and unusable questions
+            attempts = math.ceil(max(missing, 0) / self.batch_size) + 1
+            while missing > 0 and attempts > 0:
+                attempts -= 1
+                system_prompt, user_prompt = self.build_prompts(min(missing, self.batch_size), difficulty, context)
+                if existing:
+                    user_prompt += "\n\nDo not repeat any of these existing questions:\n" + "\n".join(
+                        f"- {question.get('question', '')}" for question in existing[-self.target:]
+                    )
+
+                # Top-ups need new questions, not a cached copy of the last batch
+                response = await self.llm_service.generate_structured_response(system_prompt, user_prompt, use_cache=False)
+
+                added = 0
+                for question in response.get("questions", []):
+                    if added >= missing or not _is_usable(question):
+                        continue
+                    words = question_words(question)
+                    if is_duplicate_question(words, seen):
+                        continue
+                    seen.append(words)
+                    existing.append(question)
+                    db.add(PooledQuestion(pdf_id=pdf_id, difficulty=difficulty, question=question))
+                    added += 1
+                db.commit()
+
+                missing -= added
+                self.generated += added
+                logger.info(f"Added {added} {difficulty} questions to the pool for PDF ID {pdf_id}")
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get pool usage counters.
+
+        Returns:
+            Dictionary with quizzes served from the pool, misses, questions generated and fills running
+        """
+        return {
+            "enabled": self.enabled,
+            "served": self.served,
+            "misses": self.misses,
+            "generated": self.generated,
+            "filling": len(self._tasks)
+        }
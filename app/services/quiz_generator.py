@@ -0,0 +1,211 @@
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, List, Tuple
+import asyncio
+import logging
+import math
+import os
+import re
+
+from app.services.llm import LLMService
+from app.services.tokens import count_tokens
+
+logger = logging.getLogger("quiz_generator")
+
+# Target tokens of document text per section, and the most sections one quiz is split into
+QUIZ_SECTION_TOKENS = int(os.getenv("QUIZ_SECTION_TOKENS", "3000"))
+QUIZ_MAX_SECTIONS = int(os.getenv("QUIZ_MAX_SECTIONS", "8"))
+# Sections generated at once for one quiz
+QUIZ_MAP_CONCURRENCY = int(os.getenv("QUIZ_MAP_CONCURRENCY", "4"))
+# Extra candidates asked of each section to replace duplicates and sections that fail
+QUIZ_SPARE_QUESTIONS = int(os.getenv("QUIZ_SPARE_QUESTIONS", "1"))
+# Word overlap (Jaccard) above which two questions count as the same question
+QUIZ_DUPLICATE_SIMILARITY = float(os.getenv("QUIZ_DUPLICATE_SIMILARITY", "0.8"))
+
+# Builds (system prompt, user prompt) asking for a number of questions about some content
+PromptBuilder = Callable[[int, str], Tuple[str, str]]
+
+
+def question_words(question: Dict[str, Any]) -> FrozenSet[str]:
+    """Lowercased words of a question's text, for duplicate detection."""
+    return frozenset(re.findall(r"\w+", str(question.get("question", "")).lower()))
+
+
+def is_duplicate_question(words: FrozenSet[str], seen: List[FrozenSet[str]]) -> bool:
+    """Whether a question's words overlap any already seen question's beyond QUIZ_DUPLICATE_SIMILARITY."""
+    for other in seen:
+        union = len(words | other)
+        if union and len(words & other) / union >= QUIZ_DUPLICATE_SIMILARITY:
+            return True
+    return False
+
+
+class QuizGenerator:
+    """
+    Map-reduce quiz generation over a whole document.
+
+    The document is split into sections of consecutive chunks, each section is
+    asked for its share of the questions concurrently (map), and the candidates
+    are deduplicated and cut down to the requested number (reduce). Every part
+    of the document gets questions, and wall time follows the slowest section
+    rather than the length of the document.
+    """
+
+    def __init__(self, llm_service: LLMService, max_concurrency: int = None, section_tokens: int = None,
+                 max_sections: int = None):
+        """
+        Initialize the generator.
+
+        Args:
+            llm_service: Service used to generate each section's questions
+            max_concurrency: Sections generated at once for one quiz
+            section_tokens: Target tokens of document text per section
+            max_sections: Most sections one quiz is split into
+        """
+        self.llm_service = llm_service
+        self.max_concurrency = max_concurrency or QUIZ_MAP_CONCURRENCY
+        self.section_tokens = section_tokens or QUIZ_SECTION_TOKENS
+        self.max_sections = max_sections or QUIZ_MAX_SECTIONS
+
+    def split_sections(self, chunks: List[Dict[str, Any]], num_questions: int) -> List[List[Dict[str, Any]]]:
+        """
+        Split a document's chunks into sections of roughly equal size.
+
+        There are never more sections than questions, so each section is
+        asked for at least one.
+
+        Args:
+            chunks: The document's chunks in document order
+            num_questions: Number of questions the quiz should have
+
+        Returns:
+            Sections, each a list of consecutive chunks
+        """
+        tokens = [count_tokens(chunk.get("text", ""), self.llm_service.model) for chunk in chunks]
+        total = sum(tokens)
+        count = max(1, min(self.max_sections, num_questions, len(chunks), math.ceil(total / self.section_tokens)))
+        target = total / count
+
+        sections = [[]]
+        cumulative = 0
+        for chunk, chunk_tokens in zip(chunks, tokens):
+            if sections[-1] and len(sections) < count and cumulative >= target * len(sections):
+                sections.append([])
+            sections[-1].append(chunk)
+            cumulative += chunk_tokens
+        return sections
+
+    def _section_text(self, section: List[Dict[str, Any]]) -> str:
+        """Text of a section, sampled evenly across it when it is larger than one request allows."""
+        budget = min(self.section_tokens, self.llm_service.context_budget)
+        total = sum(count_tokens(chunk.get("text", ""), self.llm_service.model) for chunk in section)
+        if total > budget:
+            section = section[::math.ceil(total / budget)]
+        packed = self.llm_service.pack_context(section, budget)
+        return "\n\n".join(chunk["text"] for chunk in packed.chunks)
+
+    @staticmethod
+    def _quotas(num_sections: int, num_questions: int) -> List[int]:
+        """Questions to take from each section, with the remainder spread evenly over the document."""
+        quotas = [num_questions // num_sections] * num_sections
+        remainder = num_questions % num_sections
+        for i in range(remainder):
+            quotas[int((i + 0.5) * num_sections / remainder)] += 1
+        return quotas
+
+    async def _iter_questions(self, chunks: List[Dict[str, Any]], num_questions: int, build_prompts: PromptBuilder,
+                              use_cache: bool) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Run the map step and yield (section index, question) as questions pass the reduce step."""
+        sections = self.split_sections(chunks, num_questions)
+        quotas = self._quotas(len(sections), num_questions)
+        logger.info(f"Generating {num_questions} questions from {len(sections)} sections of {len(chunks)} chunks")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def generate_section(index: int, section: List[Dict[str, Any]]) -> None:
+            try:
+                async with semaphore:
+                    system_prompt, user_prompt = build_prompts(quotas[index] + QUIZ_SPARE_QUESTIONS,
+                                                               self._section_text(section))
+                    async for question in self.llm_service.stream_quiz_questions(system_prompt, user_prompt,
+                                                                                 use_cache=use_cache):
+                        await queue.put((index, question))
+            except Exception as e:
+                logger.error(f"Quiz section {index + 1}/{len(sections)} failed: {e}")
+            finally:
+                # Marks the section as finished
+                await queue.put((index, None))
+
+        tasks = [asyncio.create_task(generate_section(i, section)) for i, section in enumerate(sections)]
+        taken = [0] * len(sections)
+        seen: List[FrozenSet[str]] = []
+        spares = []
+        finished = 0
+        duplicates = 0
+
+        try:
+            while finished < len(tasks) and sum(taken) < num_questions:
+                index, question = await queue.get()
+                if question is None:
+                    finished += 1
+                    continue
+                words = question_words(question)
+                if is_duplicate_question(words, seen):
+                    duplicates += 1
+                elif taken[index] < quotas[index]:
+                    seen.append(words)
+                    taken[index] += 1
+                    yield index, question
+                else:
+                    spares.append((index, words, question))
+
+            # Make up for sections that came up short with spares, least-covered sections first
+            for index, words, question in sorted(spares, key=lambda spare: (taken[spare[0]], spare[0])):
+                if sum(taken) >= num_questions:
+                    break
+                if is_duplicate_question(words, seen):
+                    duplicates += 1
+                    continue
+                seen.append(words)
+                taken[index] += 1
+                yield index, question
+        finally:
+            # Stops sections that are no longer needed, or whose consumer went away
+            for task in tasks:
+                task.cancel()
+
+        logger.info(f"Selected {sum(taken)} questions per section {taken}, dropped {duplicates} duplicates")
+
+    async def stream(self, chunks: List[Dict[str, Any]], num_questions: int, build_prompts: PromptBuilder,
+                     use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate a quiz and yield each question as soon as it is selected.
+
+        Args:
+            chunks: The document's chunks in document order
+            num_questions: Number of questions to generate
+            build_prompts: Builds the prompts asking for a number of questions about a section's text
+            use_cache: Whether to reuse and store responses in the response cache
+
+        Yields:
+            Validated question dictionaries, in the order their sections finish
+        """
+        async for _, question in self._iter_questions(chunks, num_questions, build_prompts, use_cache):
+            yield question
+
+    async def generate(self, chunks: List[Dict[str, Any]], num_questions: int, build_prompts: PromptBuilder,
+                       use_cache: bool = True) -> List[Dict[str, Any]]:
+        """
+        Generate a quiz covering the whole document.
+
+        Args:
+            chunks: The document's chunks in document order
+            num_questions: Number of questions to generate
+            build_prompts: Builds the prompts asking for a number of questions about a section's text
+            use_cache: Whether to reuse and store responses in the response cache
+
+        Returns:
+            Up to num_questions validated question dictionaries, in document order
+        """
+        selected = [item async for item in self._iter_questions(chunks, num_questions, build_prompts, use_cache)]
+        # Sorting on the section index alone keeps each section's questions in the order they were written
+        return [question for _, question in sorted(selected, key=lambda item: item[0])]
@@ -0,0 +1,138 @@
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+import asyncio
+
+from app.services.cache import LRUCache, DiskCache
+
+logger = logging.getLogger("response_cache")
+
+# Memory and disk budgets in MB (0 disables a tier) and entry lifetime in seconds
+LLM_RESPONSE_CACHE_MEMORY_MB = int(os.getenv("LLM_RESPONSE_CACHE_MEMORY_MB", "32"))
+LLM_RESPONSE_CACHE_DISK_MB = int(os.getenv("LLM_RESPONSE_CACHE_DISK_MB", "256"))
+LLM_RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "86400"))
+LLM_RESPONSE_CACHE_PATH = os.getenv(
+    "LLM_RESPONSE_CACHE_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "response_cache.sqlite3"))
+)
+
+
+def response_cache_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int, **kwargs) -> str:
+    """
+    Fingerprint of a completion request.
+
+    Args:
+        model: Model name
+        messages: Chat messages
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens to generate
+        **kwargs: Other request options that change the output, such as response_format
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens, **kwargs},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of completion texts: an in-memory LRU in front of a SQLite file.
+
+    Entries record how many tokens the original completion used, so hits can be
+    reported as tokens saved. Either tier may be omitted.
+    """
+
+    def __init__(self, memory: Optional[LRUCache] = None, disk: Optional[DiskCache] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            memory: Per-worker in-memory tier
+            disk: Persistent tier shared by all workers on the host
+        """
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Look up a completion.
+
+        Args:
+            key: Request fingerprint from response_cache_key
+
+        Returns:
+            The cached completion text, or None on a miss
+        """
+        entry = self.memory.get(key) if self.memory else None
+        if entry is None and self.disk:
+            raw = await asyncio.to_thread(self.disk.get, key)
+            if raw is not None:
+                entry = json.loads(raw)
+                # Promote to memory so the next hit skips the disk
+                if self.memory:
+                    self.memory.put(key, entry)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_tokens += entry.get("tokens", 0)
+        return entry["text"]
+
+    async def put(self, key: str, text: str, tokens: int = 0) -> None:
+        """
+        Store a completion.
+
+        Args:
+            key: Request fingerprint from response_cache_key
+            text: Completion text
+            tokens: Total tokens the completion used
+        """
+        entry = {"text": text, "tokens": tokens}
+        if self.memory:
+            self.memory.put(key, entry)
+        if self.disk:
+            await asyncio.to_thread(self.disk.put, key, json.dumps(entry).encode("utf-8"))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache usage counters.
+
+        Returns:
+            Dictionary with overall hits, misses and tokens saved, plus per-tier counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+                "memory": self.memory.stats() if self.memory else None,
+                "disk": self.disk.stats() if self.disk else None
+            }
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    return len(entry["text"].encode("utf-8")) + 64
+
+
+# Shared by every LLMService in this worker
+response_cache = ResponseCache(
+    memory=LRUCache(LLM_RESPONSE_CACHE_MEMORY_MB * 1024 * 1024, sizeof=_entry_size, ttl=LLM_RESPONSE_CACHE_TTL)
+    if LLM_RESPONSE_CACHE_MEMORY_MB > 0 else None,
+    disk=DiskCache(LLM_RESPONSE_CACHE_PATH, LLM_RESPONSE_CACHE_DISK_MB * 1024 * 1024, ttl=LLM_RESPONSE_CACHE_TTL)
+    if LLM_RESPONSE_CACHE_DISK_MB > 0 else None
+)
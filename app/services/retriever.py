@@ -1,4 +1,6 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional, Callable, AsyncIterator
+from collections import deque
+import asyncio
 import numpy as np
 import faiss
 import uuid
@@ -9,6 +11,12 @@ from pathlib import Path
 import logging
 import traceback
 from .embedding import EmbeddingService
+from .document_store import DocumentStore, embeddings_fingerprint
+from .document_storage import document_storage
+from .cache import LRUCache
+from .library_index import LIBRARY_INDEX_FILENAME, LIBRARY_MAP_FILENAME, LibraryIndex
+from .lexical_index import LexicalIndex
+from .topic_clusters import TopicClusters, QUIZ_TOPIC_CLUSTERS, cluster_topics
 
 # Configure logging
 logger = logging.getLogger("retriever")
@@ -21,17 +29,73 @@ if not logger.handlers:
     logger.addHandler(file_handler)
 
 
+# Search modes accepted by Retriever.search
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+# Chunk batches being embedded at once while a document is added in batches
+EMBEDDING_BATCHES_IN_FLIGHT = int(os.getenv("EMBEDDING_BATCHES_IN_FLIGHT", "4"))
+
+# Reciprocal rank fusion constant; larger values flatten the rank weighting
+RRF_K = 60
+
+
+class LoadedDocument:
+    """Chunks, embedding vectors and search indexes of one PDF, held in memory."""
+
+    def __init__(self, chunks: List[Dict], embeddings: Optional[np.ndarray], index: Optional[faiss.Index], lexical: LexicalIndex):
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.index = index
+        self.lexical = lexical
+        # K-means topics, computed on first use
+        self.topics: Optional[TopicClusters] = None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate resident memory, used to enforce the cache budget.
+
+        Counts the chunk texts and metadata, the FAISS index's own copy of the
+        vectors and the BM25 index. Embeddings memory-mapped from disk are not
+        counted: their pages belong to the OS page cache, which can drop them,
+        and the index holds the copy that searches use.
+        """
+        size = sum(len(chunk.get("text", "")) for chunk in self.chunks) + 200 * len(self.chunks)
+        if self.embeddings is not None and not isinstance(self.embeddings, np.memmap):
+            size += self.embeddings.nbytes
+        if self.index is not None:
+            size += self.index.ntotal * self.index.d * 4
+        size += self.lexical.nbytes
+        return size
+
+
+# Loaded documents, shared by every Retriever in this worker and bounded by memory
+document_cache = LRUCache(
+    max_bytes=int(os.getenv("RETRIEVER_CACHE_MB", "256")) * 1024 * 1024,
+    sizeof=lambda document: document.nbytes
+)
+
+# Per-user aggregate indexes for library-wide search
+library_cache = LRUCache(
+    max_bytes=int(os.getenv("RETRIEVER_CACHE_MB", "256")) * 1024 * 1024,
+    sizeof=lambda library: library.nbytes
+)
+
+
 class Retriever:
     """Service for managing document chunks and retrieval using FAISS."""
 
-    def __init__(self, embedding_service=None):
+    def __init__(self, embedding_service=None, resolve_storage: Callable[[str], str] = None):
         """
         Initialize the retriever service.
 
         Args:
             embedding_service: Service for creating embeddings
+            resolve_storage: Gives the ID a PDF's chunks are stored under, which identical
+                uploads share (defaults to the shared document storage registry)
         """
         self.embedding_service = embedding_service or EmbeddingService()
+        self.resolve_storage = resolve_storage or document_storage.storage_id
         logger.info("Retriever service initialized")
 
         # Get the path to the pdf database directory
@@ -39,65 +103,208 @@ class Retriever:
         self.root_dir = os.path.abspath(os.path.join(current_dir, "..", ".."))
         self.pdfs_dir = os.path.join(self.root_dir, "db", "pdfs")
         logger.info(f"PDF directory set to: {self.pdfs_dir}")
+        # Per-user library indexes live apart from PDF storage so user and storage IDs never share a directory
+        self.libraries_dir = os.path.join(self.root_dir, "db", "libraries")
 
-    def get_chunks_by_id(self, pdf_id: str) -> List[Dict]:
+        # On-disk chunk, vector and index storage
+        self.store = DocumentStore(self.pdfs_dir)
+
+    def _cache_key(self, storage_id: str) -> Tuple[str, str]:
+        return (self.pdfs_dir, storage_id)
+
+    def invalidate(self, pdf_id: str) -> None:
         """
-        Get all chunks for a specific PDF by ID.
+        Drop a PDF from the in-memory document cache.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+        """
+        document_cache.invalidate(self._cache_key(self.resolve_storage(pdf_id)))
+
+    def delete_document(self, pdf_id: str) -> None:
+        """
+        Remove stored chunks, vectors and indexes.
+
+        Args:
+            pdf_id: The storage ID, which is the PDF ID of the upload that was ingested
+        """
+        self.store.delete_document(pdf_id)
+        document_cache.invalidate(self._cache_key(pdf_id))
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Get hit/miss/eviction counters for the document cache.
+
+        Returns:
+            Dictionary of cache statistics
+        """
+        return document_cache.stats()
+
+    def load_document(self, pdf_id: str) -> Optional[LoadedDocument]:
+        """
+        Get the chunks, vectors and FAISS index for a PDF, from cache or disk.
 
         Args:
             pdf_id: The unique ID of the PDF
 
         Returns:
-            List of chunk dictionaries with content and metadata
+            The loaded document, or None if the PDF has no stored chunks
         """
-        logger.info(f"Getting all chunks for PDF ID: {pdf_id}")
-        try:
-            # Construct the path to the chunks file
-            pdf_dir = os.path.join(self.pdfs_dir, pdf_id)
-            chunks_file = os.path.join(pdf_dir, "chunks.json")
+        # Identical uploads share one stored copy, cached once for all of them
+        storage_id = self.resolve_storage(pdf_id)
+        document = document_cache.get(self._cache_key(storage_id))
+        if document is not None:
+            return document
 
-            logger.debug(f"Looking for chunks file at: {chunks_file}")
+        logger.info(f"Loading PDF ID {pdf_id} from disk")
+        try:
+            pdf_dir = self.store.pdf_dir(storage_id)
 
-            # Check if the directory and file exist
+            # Check if the directory and chunks exist
             if not os.path.exists(pdf_dir):
                 logger.error(f"PDF directory not found: {pdf_dir}")
-                return []
+                return None
 
-            if not os.path.exists(chunks_file):
-                logger.error(f"Chunks file not found: {chunks_file}")
-                return []
+            if not self.store.has_chunks(storage_id):
+                logger.error(f"No chunks stored in: {pdf_dir}")
+                return None
 
-            # Load the chunks from the file
-            with open(chunks_file, 'r', encoding='utf-8') as f:
-                chunks_data = json.load(f)
+            # Load the chunk texts and metadata (embeddings are stored separately)
+            chunks_data = self.store.read_chunks(storage_id)
 
-            if not chunks_data or not isinstance(chunks_data, list):
-                logger.warning(f"Chunks file empty or invalid format: {chunks_file}")
-                return []
+            if not chunks_data:
+                logger.warning(f"Chunks file empty or invalid format in: {pdf_dir}")
+                return None
 
             logger.info(f"Successfully loaded {len(chunks_data)} chunks for PDF ID: {pdf_id}")
 
             # Log a sample chunk for debugging
-            if chunks_data:
-                sample_chunk = chunks_data[0]
-                keys = list(sample_chunk.keys())
-                logger.debug(f"Sample chunk keys: {keys}")
-                logger.debug(f"Sample chunk preview: {json.dumps(sample_chunk, default=str)[:200]}...")
-
-            return chunks_data
+            sample_chunk = chunks_data[0]
+            logger.debug(f"Sample chunk keys: {list(sample_chunk.keys())}")
+            logger.debug(f"Sample chunk preview: {json.dumps(sample_chunk, default=str)[:200]}...")
+
+            # Load the persisted FAISS index, rebuilding it for legacy directories
+            # and when it was built from a different set of vectors
+            embeddings = self.store.read_embeddings(storage_id)
+            index = self.store.read_index(storage_id)
+            if embeddings is not None and (index is None or index.ntotal != len(embeddings)):
+                index = self.store.rebuild_index(storage_id)
+
+            # Load the BM25 inverted index, building it for older directories
+            lexical = self.store.read_lexical_index(storage_id)
+            if lexical is None:
+                lexical = LexicalIndex.build([chunk.get("text", "") for chunk in chunks_data])
+                self.store.save_lexical_index(storage_id, lexical)
+
+            document = LoadedDocument(chunks_data, embeddings, index, lexical)
+            if not document_cache.put(self._cache_key(storage_id), document):
+                logger.warning(f"PDF ID {pdf_id} ({document.nbytes} bytes) exceeds the document cache budget")
+            return document
 
         except Exception as e:
-            logger.error(f"Error getting chunks for PDF ID {pdf_id}: {str(e)}")
+            logger.error(f"Error loading PDF ID {pdf_id}: {str(e)}")
             logger.error(traceback.format_exc())
+            return None
+
+    def rebuild_index(self, pdf_id: str) -> Optional[faiss.Index]:
+        """
+        Rebuild the FAISS index for a PDF from its stored embedding vectors.
+
+        This is the upgrade path for documents stored before indexes were
+        persisted, and for indexes written with an older format version.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            The rebuilt index, or None if the PDF has no embeddings
+        """
+        self.invalidate(pdf_id)
+        return self.store.rebuild_index(self.resolve_storage(pdf_id))
+
+    def load_index(self, pdf_id: str) -> Optional[faiss.Index]:
+        """
+        Get the FAISS index for a PDF, loading or rebuilding it if needed.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            The FAISS index, or None if the PDF has no embeddings
+        """
+        document = self.load_document(pdf_id)
+        return document.index if document else None
+
+    def get_chunks_by_id(self, pdf_id: str) -> List[Dict]:
+        """
+        Get all chunks for a specific PDF by ID.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            List of chunk dictionaries with content and metadata
+        """
+        logger.info(f"Getting all chunks for PDF ID: {pdf_id}")
+        document = self.load_document(pdf_id)
+        if document is None:
             return []
 
-    async def add_document(self, chunks: List[str], metadata: List[Dict[str, Any]]) -> str:
+        # Return copies so callers can annotate chunks without touching the cache
+        return [dict(chunk) for chunk in document.chunks]
+
+    def get_topic_chunks(self, pdf_id: str, num_topics: int = None) -> List[Dict]:
+        """
+        Get one representative chunk per topic of a PDF.
+
+        Topics are k-means clusters of the stored chunk embeddings, so this
+        covers the whole document without an embedding call. They are computed
+        once per document and persisted next to the FAISS index.
+
+        Args:
+            pdf_id: The unique ID of the PDF
+            num_topics: Number of topics (defaults to QUIZ_TOPIC_CLUSTERS)
+
+        Returns:
+            Chunk dictionaries, largest topic first, scored by the share of the document their topic covers
+        """
+        num_topics = num_topics or QUIZ_TOPIC_CLUSTERS
+        document = self.load_document(pdf_id)
+        if document is None:
+            return []
+
+        if document.embeddings is None or len(document.embeddings) != len(document.chunks):
+            # Without vectors, spread the picks evenly over the document
+            logger.warning(f"No embeddings for PDF ID {pdf_id}, picking evenly spaced chunks")
+            step = max(1, len(document.chunks) // num_topics)
+            return [
+                {**document.chunks[i], "chunk_index": i, "score": 1.0}
+                for i in range(0, len(document.chunks), step)
+            ][:num_topics]
+
+        topics = document.topics
+        if topics is None or topics.num_topics != num_topics:
+            storage_id = self.resolve_storage(pdf_id)
+            fingerprint = embeddings_fingerprint(document.embeddings)
+            topics = self.store.read_topics(storage_id, num_topics, fingerprint)
+            if topics is None:
+                logger.info(f"Clustering PDF ID {pdf_id} into {num_topics} topics")
+                topics = cluster_topics(document.embeddings, num_topics)
+                self.store.save_topics(storage_id, topics, fingerprint)
+            document.topics = topics
+
+        return topics.chunks(document.chunks)
+
+    async def add_document(self, chunks: List[str], metadata: List[Dict[str, Any]], pdf_id: Optional[str] = None,
+                           progress_callback: Optional[Callable[[int, int], None]] = None) -> str:
         """
         Add document chunks to a new FAISS index.
 
         Args:
             chunks: List of text chunks from the document
             metadata: List of metadata for each chunk (must match chunks length)
+            pdf_id: ID to store the document under (a new one is generated when omitted)
+            progress_callback: Optional callable receiving (chunks embedded, total chunks)
 
         Returns:
             pdf_id: Unique ID for the indexed document
@@ -105,99 +312,185 @@ class Retriever:
         if len(chunks) != len(metadata):
             raise ValueError("Chunks and metadata must have the same length")
 
-        if not chunks:
-            raise ValueError("No chunks provided")
+        # Combine chunk text with metadata; the vectors are stored separately
+        chunks_with_data = []
+        for chunk_text, chunk_metadata in zip(chunks, metadata):
+            chunks_with_data.append({**chunk_metadata, "text": chunk_text})
+
+        async def single_batch() -> AsyncIterator[List[Dict[str, Any]]]:
+            yield chunks_with_data
+
+        return await self.add_document_batches(single_batch(), pdf_id, progress_callback)
 
+    async def add_document_batches(self, batches: AsyncIterator[List[Dict[str, Any]]], pdf_id: Optional[str] = None,
+                                   progress_callback: Optional[Callable[[int, int], None]] = None) -> str:
+        """
+        Add a document whose chunks arrive in batches, embedding and storing them as they come.
+
+        Up to EMBEDDING_BATCHES_IN_FLIGHT batches are embedded while later
+        ones are still being produced. Finished batches are appended to
+        storage and the FAISS index in document order, so neither the chunks
+        nor their vectors are held in memory beyond the index itself.
+
+        Args:
+            batches: Lists of chunk dictionaries with "text" and metadata, in document order
+            pdf_id: ID to store the document under (a new one is generated when omitted)
+            progress_callback: Optional callable receiving (chunks embedded, chunks received so far)
+
+        Returns:
+            pdf_id: Unique ID for the indexed document
+        """
         # Generate a unique ID for this PDF
-        pdf_id = str(uuid.uuid4())
+        pdf_id = pdf_id or str(uuid.uuid4())
         logger.info(f"Creating new document with ID: {pdf_id}")
 
-        # Create embeddings for all chunks
-        embeddings = await self.embedding_service.create_embeddings(chunks)
+        writer = self.store.open_writer(pdf_id)
+        pending: deque = deque()
+        index = None
+        received = 0
+
+        async def store_next() -> None:
+            nonlocal index
+            batch, task = pending.popleft()
+            embeddings = np.array(await task, dtype=np.float32)
+            writer.append(batch, embeddings)
+            if index is None:
+                index = self.store.build_index(embeddings)
+            else:
+                index.add(embeddings)
+            if progress_callback:
+                progress_callback(writer.count, received)
 
-        # Create directory for this PDF if it doesn't exist
-        pdf_dir = os.path.join(self.pdfs_dir, pdf_id)
-        os.makedirs(pdf_dir, exist_ok=True)
-        logger.info(f"Created directory for PDF: {pdf_dir}")
+        try:
+            async for batch in batches:
+                if not batch:
+                    continue
+                # Store batches as soon as they are ready, waiting only when too many are in flight
+                while pending and (pending[0][1].done() or len(pending) >= EMBEDDING_BATCHES_IN_FLIGHT):
+                    await store_next()
+
+                received += len(batch)
+                task = asyncio.create_task(
+                    self.embedding_service.create_embeddings([chunk["text"] for chunk in batch])
+                )
+                pending.append((batch, task))
+
+            while pending:
+                await store_next()
+
+            if writer.count == 0:
+                raise ValueError("No chunks provided")
+            writer.commit()
+        except BaseException:
+            for _, task in pending:
+                task.cancel()
+            writer.abort()
+            raise
+
+        # Persist the search indexes so queries don't rebuild them
+        self.store.save_index(pdf_id, index)
+        self.store.save_lexical_index(
+            pdf_id, LexicalIndex.build(chunk["text"] for chunk in self.store.iter_chunks(pdf_id))
+        )
+        self.invalidate(pdf_id)
+        logger.info(f"Saved {writer.count} chunks for PDF ID: {pdf_id}")
 
-        # Combine chunk text with metadata and embeddings
-        chunks_with_data = []
-        for i, (chunk_text, chunk_metadata) in enumerate(zip(chunks, metadata)):
-            chunk_data = {**chunk_metadata, "text": chunk_text, "embedding": embeddings[i]}
-            chunks_with_data.append(chunk_data)
+        return pdf_id
 
-        # Save chunks with embeddings to a file
-        chunks_file = os.path.join(pdf_dir, "chunks.json")
-        with open(chunks_file, 'w', encoding='utf-8') as f:
-            json.dump(chunks_with_data, f, ensure_ascii=False, default=str)
+    async def _vector_search(self, query: str, document: LoadedDocument, top_k: int,
+                             query_embedding: Optional[List[float]] = None) -> List[Tuple[int, float]]:
+        """
+        Rank chunks by embedding distance to the query.
 
-        logger.info(f"Saved {len(chunks_with_data)} chunks with embeddings to {chunks_file}")
+        Returns:
+            List of (chunk index, score) tuples, best first
+        """
+        index = document.index
 
-        # Create PDF info file
-        info = {
-            "pdf_id": pdf_id,
-            "chunk_count": len(chunks),
-            "created_at": time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        info_file = os.path.join(pdf_dir, "pdf_info.json")
-        with open(info_file, 'w', encoding='utf-8') as f:
-            json.dump(info, f)
+        # Create a query embedding unless the caller already has one
+        if query_embedding is None:
+            query_embedding = await self.embedding_service.create_single_embedding(query)
+        query_embedding = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+
+        if query_embedding.shape[1] != index.d:
+            logger.error(f"Query dimension {query_embedding.shape[1]} does not match index dimension {index.d}")
+            return []
 
-        logger.info(f"Saved PDF info to {info_file}")
+        # Search for similar chunks
+        distances, indices = index.search(query_embedding, top_k)
+        return [
+            (int(idx), float(1.0 / (1.0 + distance)))
+            for idx, distance in zip(indices[0], distances[0])
+            if 0 <= idx < len(document.chunks)
+        ]
 
-        return pdf_id
+    def _reciprocal_rank_fusion(self, rankings: List[List[Tuple[int, float]]], top_k: int) -> List[Tuple[int, float]]:
+        """
+        Merge several rankings of chunks with reciprocal rank fusion.
 
-    async def search(self, query: str, pdf_id: str, top_k: int = 10) -> List[Dict]:
+        Returns:
+            List of (chunk index, fused score) tuples, best first
+        """
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, (idx, _) in enumerate(ranking):
+                fused[idx] = fused.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    async def search(self, query: str, pdf_id: str, top_k: int = 10, mode: str = "vector",
+                     query_embedding: Optional[List[float]] = None) -> List[Dict]:
         """
-        Search for relevant document chunks using semantic search.
+        Search for relevant document chunks.
 
         Args:
             query: The search query
             pdf_id: ID of the PDF to search within
             top_k: Number of chunks to return
+            mode: "vector" for semantic search, "lexical" for BM25 keyword
+                search (no embedding call), or "hybrid" to fuse both rankings
+            query_embedding: Precomputed embedding of the query, to skip embedding it again
 
         Returns:
             List of relevant document chunks
         """
-        logger.info(f"Searching for query: '{query}' in PDF ID: {pdf_id}")
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        logger.info(f"Searching ({mode}) for query: '{query}' in PDF ID: {pdf_id}")
         try:
-            # Get all chunks for the PDF
-            chunks = self.get_chunks_by_id(pdf_id)
+            # Get all chunks and the search indexes for the PDF
+            document = self.load_document(pdf_id)
 
-            if not chunks:
+            if document is None:
                 logger.warning(f"No chunks found for PDF ID: {pdf_id}")
                 return []
 
+            chunks = document.chunks
             logger.info(f"Found {len(chunks)} chunks for PDF ID: {pdf_id}")
 
-            # Check if chunks have embeddings
-            if "embedding" not in chunks[0]:
-                logger.warning("Chunks don't have embeddings, attempting to retrieve content only")
-                # Return chunks without ranking if no embeddings
-                return chunks[:top_k]
-
-            # Extract embeddings from chunks
-            chunk_embeddings = np.array([chunk["embedding"] for chunk in chunks], dtype=np.float32)
-
-            # Create a query embedding
-            query_embedding = await self.embedding_service.create_single_embedding(query)
-            query_embedding = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
-
-            # Set up a FAISS index for efficient similarity search
-            dimension = query_embedding.shape[1]
-            index = faiss.IndexFlatL2(dimension)
-            index.add(chunk_embeddings)
-
-            # Search for similar chunks
-            distances, indices = index.search(query_embedding, top_k)
+            if document.index is None and mode != "lexical":
+                logger.warning("Chunks don't have embeddings, falling back to lexical search")
+                mode = "lexical"
+
+            if mode == "vector":
+                ranked = await self._vector_search(query, document, top_k, query_embedding)
+            elif mode == "lexical":
+                ranked = document.lexical.search(query, top_k)
+            else:
+                # Fuse deeper candidate lists so chunks ranked well by only one method survive
+                depth = max(top_k * 4, 20)
+                ranked = self._reciprocal_rank_fusion([
+                    await self._vector_search(query, document, depth, query_embedding),
+                    document.lexical.search(query, depth)
+                ], top_k)
 
             # Get the relevant chunks
             results = []
-            for i, idx in enumerate(indices[0]):
-                if idx < len(chunks):
-                    chunk = chunks[idx]
-                    chunk["score"] = float(1.0 / (1.0 + distances[0][i]))
-                    results.append(chunk)
+            for idx, score in ranked:
+                chunk = dict(chunks[idx])
+                chunk["chunk_index"] = idx
+                chunk["score"] = score
+                results.append(chunk)
 
             logger.info(f"Returning {len(results)} relevant chunks")
             return results
@@ -207,6 +500,120 @@ class Retriever:
             logger.error(traceback.format_exc())
             return []
 
+    def _library_key(self, user_id: str) -> Tuple[str, str]:
+        return (self.libraries_dir, user_id)
+
+    def _get_library(self, user_id: str) -> LibraryIndex:
+        key = self._library_key(user_id)
+        library = library_cache.get(key)
+        if library is None:
+            library_dir = os.path.join(self.libraries_dir, user_id)
+            self._move_legacy_library(user_id, library_dir)
+            library = LibraryIndex(library_dir)
+            library_cache.put(key, library)
+        return library
+
+    def _move_legacy_library(self, user_id: str, library_dir: str) -> None:
+        """Move a library index saved inside the user's PDF directory by earlier versions to its own root."""
+        legacy_dir = os.path.join(self.pdfs_dir, user_id)
+        legacy_files = [
+            name for name in (LIBRARY_INDEX_FILENAME, LIBRARY_MAP_FILENAME)
+            if os.path.exists(os.path.join(legacy_dir, name))
+        ]
+        if not legacy_files or os.path.exists(os.path.join(library_dir, LIBRARY_MAP_FILENAME)):
+            return
+        os.makedirs(library_dir, exist_ok=True)
+        for name in legacy_files:
+            os.replace(os.path.join(legacy_dir, name), os.path.join(library_dir, name))
+        logger.info(f"Moved library index of user {user_id} to {library_dir}")
+
+    def add_to_library(self, user_id: str, pdf_id: str) -> bool:
+        """
+        Add a stored PDF's chunk vectors to the user's library index.
+
+        Args:
+            user_id: ID of the user who owns the PDF
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            True if the PDF was added
+        """
+        document = self.load_document(pdf_id)
+        if document is None or document.embeddings is None:
+            logger.warning(f"Cannot add PDF ID {pdf_id} to library: no embeddings found")
+            return False
+
+        library = self._get_library(user_id)
+        added = library.add_document(pdf_id, document.embeddings)
+        # Re-insert so the cache accounts for the library's new size
+        library_cache.put(self._library_key(user_id), library)
+        return added
+
+    def remove_from_library(self, user_id: str, pdf_id: str) -> bool:
+        """
+        Remove a PDF's chunk vectors from the user's library index.
+
+        Args:
+            user_id: ID of the user who owned the PDF
+            pdf_id: The unique ID of the PDF
+
+        Returns:
+            True if the PDF was in the library
+        """
+        library = self._get_library(user_id)
+        removed = library.remove_document(pdf_id)
+        # Re-insert so the cache accounts for the library's new size
+        library_cache.put(self._library_key(user_id), library)
+        return removed
+
+    async def search_library(self, query: str, user_id: str, pdf_ids: List[str], top_k: int = 10) -> List[Dict]:
+        """
+        Search for relevant chunks across all of a user's PDFs.
+
+        PDFs missing from the library index (for example uploads from before
+        library search existed) are added, and PDFs no longer in the user's
+        library are removed, before searching.
+
+        Args:
+            query: The search query
+            user_id: ID of the user whose library to search
+            pdf_ids: IDs of the PDFs currently in the user's library
+            top_k: Number of chunks to return
+
+        Returns:
+            List of relevant chunks tagged with their pdf_id
+        """
+        logger.info(f"Searching library of user {user_id} for query: '{query}'")
+        try:
+            library = self._get_library(user_id)
+
+            for pdf_id in set(library.documents) - set(pdf_ids):
+                library.remove_document(pdf_id)
+            for pdf_id in set(pdf_ids) - set(library.documents):
+                self.add_to_library(user_id, pdf_id)
+
+            query_embedding = await self.embedding_service.create_single_embedding(query)
+            matches = library.search(np.array(query_embedding, dtype=np.float32), top_k)
+
+            results = []
+            for pdf_id, chunk_index, distance in matches:
+                document = self.load_document(pdf_id)
+                if document is None or chunk_index >= len(document.chunks):
+                    continue
+                chunk = dict(document.chunks[chunk_index])
+                chunk["pdf_id"] = pdf_id
+                chunk["chunk_index"] = chunk_index
+                chunk["score"] = float(1.0 / (1.0 + distance))
+                results.append(chunk)
+
+            logger.info(f"Returning {len(results)} chunks from library search")
+            return results
+
+        except Exception as e:
+            logger.error(f"Error during library search: {str(e)}")
+            logger.error(traceback.format_exc())
+            return []
+
 # Function to get an instance of the Retriever class
 def get_pdf_retriever(embedding_service: EmbeddingService) -> Retriever:
     """
@@ -218,4 +625,5 @@ def get_pdf_retriever(embedding_service: EmbeddingService) -> Retriever:
     Returns:
         An initialized Retriever object
     """
-    return Retriever(embedding_service)
\ No newline at end of file
+    return Retriever(embedding_service)
+
@@ -0,0 +1,202 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import os
+import threading
+import time
+import numpy as np
+
+# Minimum cosine similarity between two questions for one's answer to be reused for the other
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Answers kept per document, documents kept per worker, and entry lifetime in seconds
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500"))
+SEMANTIC_CACHE_MAX_DOCUMENTS = int(os.getenv("SEMANTIC_CACHE_MAX_DOCUMENTS", "200"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "604800"))
+# Most recent past questions embedded when a document's answers are first loaded in a worker
+SEMANTIC_CACHE_SEED_LIMIT = int(os.getenv("SEMANTIC_CACHE_SEED_LIMIT", "100"))
+
+
+class CachedAnswer:
+    """A previously answered question and the chunks the answer was based on."""
+
+    def __init__(self, question: str, embedding: np.ndarray, answer: str, sources: Optional[List[Dict]]):
+        self.question = question
+        self.embedding = embedding
+        self.answer = answer
+        # None for answers seeded from conversation history, which doesn't store sources
+        self.sources = sources
+        self.created_at = time.time()
+
+
+class _DocumentAnswers:
+    """Answers for one document plus a matrix of their unit-length question embeddings."""
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self.matrix: Optional[np.ndarray] = None
+        self.seeded = False
+
+    def rebuild(self) -> None:
+        self.matrix = np.vstack([entry.embedding for entry in self.entries.values()]) if self.entries else None
+
+
+class SemanticAnswerCache:
+    """
+    Per-document cache of answered questions, looked up by embedding similarity.
+
+    A question whose embedding is within the similarity threshold of an earlier
+    question about the same document gets that earlier answer back.
+    """
+
+    def __init__(self, threshold: float = None, max_entries: int = None, max_documents: int = None, ttl: float = None):
+        """
+        Initialize the cache.
+
+        Args:
+            threshold: Minimum cosine similarity for a hit
+            max_entries: Answers kept per document; the least recently used are evicted
+            max_documents: Documents kept; the least recently used are dropped
+            ttl: Seconds after which an answer expires
+        """
+        self.threshold = SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        self.max_entries = max_entries or SEMANTIC_CACHE_MAX_ENTRIES
+        self.max_documents = max_documents or SEMANTIC_CACHE_MAX_DOCUMENTS
+        self.ttl = SEMANTIC_CACHE_TTL if ttl is None else ttl
+        self._documents: "OrderedDict[str, _DocumentAnswers]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _question_key(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def _document(self, pdf_id: str) -> _DocumentAnswers:
+        document = self._documents.get(pdf_id)
+        if document is None:
+            document = self._documents[pdf_id] = _DocumentAnswers()
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        self._documents.move_to_end(pdf_id)
+        return document
+
+    def is_seeded(self, pdf_id: str) -> bool:
+        """Whether conversation history has been loaded for a document in this worker."""
+        with self._lock:
+            document = self._documents.get(pdf_id)
+            return document is not None and document.seeded
+
+    def seed(self, pdf_id: str, items: List[Tuple[str, List[float], str]]) -> None:
+        """
+        Load past answers for a document.
+
+        Args:
+            pdf_id: The document the answers belong to
+            items: (question, question embedding, answer) tuples, oldest first
+        """
+        with self._lock:
+            document = self._document(pdf_id)
+            for question, embedding, answer in items[-self.max_entries:]:
+                key = self._question_key(question)
+                if key not in document.entries:
+                    document.entries[key] = CachedAnswer(question, self._normalize(embedding), answer, None)
+            document.seeded = True
+            document.rebuild()
+
+    def lookup(self, pdf_id: str, embedding: List[float]) -> Optional[Tuple[CachedAnswer, float]]:
+        """
+        Find the most similar earlier question about a document.
+
+        Args:
+            pdf_id: The document being asked about
+            embedding: Embedding of the new question
+
+        Returns:
+            (cached answer, cosine similarity) if one is above the threshold, otherwise None
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            document = self._documents.get(pdf_id)
+            if document is not None:
+                self._documents.move_to_end(pdf_id)
+                self._expire(document)
+            if document is None or document.matrix is None or document.matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            similarities = document.matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            key = list(document.entries)[best]
+            document.entries.move_to_end(key)
+            document.rebuild()
+            self.hits += 1
+            return document.entries[key], similarity
+
+    def add(self, pdf_id: str, question: str, embedding: List[float], answer: str, sources: List[Dict]) -> None:
+        """
+        Remember an answer.
+
+        Args:
+            pdf_id: The document the question was about
+            question: The question text
+            embedding: Embedding of the question
+            answer: The generated answer
+            sources: The chunks the answer was based on
+        """
+        with self._lock:
+            document = self._document(pdf_id)
+            key = self._question_key(question)
+            document.entries.pop(key, None)
+            document.entries[key] = CachedAnswer(question, self._normalize(embedding), answer, [dict(chunk) for chunk in sources])
+            while len(document.entries) > self.max_entries:
+                document.entries.popitem(last=False)
+                self.evictions += 1
+            document.rebuild()
+
+    def _expire(self, document: _DocumentAnswers) -> None:
+        cutoff = time.time() - self.ttl
+        expired = [key for key, entry in document.entries.items() if entry.created_at < cutoff]
+        if expired:
+            for key in expired:
+                del document.entries[key]
+            document.rebuild()
+
+    def invalidate(self, pdf_id: str) -> None:
+        """Forget all answers for a document."""
+        with self._lock:
+            self._documents.pop(pdf_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache usage counters.
+
+        Returns:
+            Dictionary with hit/miss/eviction counters and current size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "documents": len(self._documents),
+                "entries": sum(len(document.entries) for document in self._documents.values()),
+                "threshold": self.threshold
+            }
+
+
+# Shared by every request in this worker
+semantic_cache = SemanticAnswerCache()
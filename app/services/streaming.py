@@ -0,0 +1,101 @@
+from typing import Any, Dict, List
+import json
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """
+    Format one server-sent event with a JSON payload.
+
+    Args:
+        event: Event name
+        data: JSON-serializable payload
+
+    Returns:
+        The event, terminated by a blank line
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class QuestionStreamParser:
+    """
+    Incremental parser that picks complete question objects out of a streamed quiz JSON.
+
+    Text is fed as it arrives. Every object that closes directly inside the
+    questions array (`{"questions": [{...}, {...}]}`, or a bare `[{...}]`) is
+    returned as soon as its closing brace is seen. Braces inside strings are
+    ignored, and strings are only tracked once the JSON has opened, so any
+    markdown or prose around it is skipped.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._position = 0
+        # Open brackets enclosing the current position
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        # Buffer offset and nesting depth of the question currently being read
+        self._item_start = None
+        self._item_depth = 0
+
+    def feed(self, text: str) -> List[Any]:
+        """
+        Add more streamed text.
+
+        Args:
+            text: The next fragment of the model output
+
+        Returns:
+            Questions completed by this fragment. Each is the parsed object,
+            or the raw text if it could not be parsed
+        """
+        self._buffer += text
+        completed = []
+
+        while self._position < len(self._buffer):
+            char = self._buffer[self._position]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._stack:
+                # Quotes in prose before the JSON starts don't open strings
+                self._in_string = True
+            elif char in "{[":
+                # An object opening directly inside the top-level array is a question
+                if char == "{" and self._stack and self._stack[-1] == "[" and len(self._stack) <= 2:
+                    self._item_start = self._position
+                    self._item_depth = len(self._stack)
+                self._stack.append(char)
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and self._item_start is not None and len(self._stack) == self._item_depth:
+                    completed.append(self._parse(self._buffer[self._item_start:self._position + 1]))
+                    self._item_start = None
+
+            self._position += 1
+
+        # Drop text that can no longer be part of a question to keep the buffer small
+        keep_from = self._item_start if self._item_start is not None else self._position
+        self._buffer = self._buffer[keep_from:]
+        self._position -= keep_from
+        if self._item_start is not None:
+            self._item_start = 0
+
+        return completed
+
+    @staticmethod
+    def _parse(raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            pass
+        try:
+            # Same repair as LLMService._extract_and_validate_json
+            return json.loads(raw.replace("'", '"'))
+        except json.JSONDecodeError:
+            return raw
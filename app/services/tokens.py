@@ -0,0 +1,78 @@
+from functools import lru_cache
+import logging
+import math
+
+logger = logging.getLogger("tokens")
+
+# Rough characters-per-token ratio for English text, used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Load the tiktoken encoding for a model, or None if it cannot be loaded."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # The encoding files are downloaded on first use and may be unreachable
+        logger.warning(f"Falling back to estimated token counts for {model}: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "text-embedding-3-small") -> int:
+    """
+    Count the tokens in a text for the given model.
+
+    Uses tiktoken when it is installed and falls back to an estimate
+    of one token per four characters otherwise.
+
+    Args:
+        text: Text to measure
+        model: Model whose tokenizer should be used
+
+    Returns:
+        Number of tokens
+    """
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "text-embedding-3-small", from_end: bool = False) -> str:
+    """
+    Shorten a text to at most the given number of tokens.
+
+    Args:
+        text: Text to shorten
+        max_tokens: Maximum number of tokens to keep
+        model: Model whose tokenizer should be used
+        from_end: Keep the end of the text instead of the beginning
+
+    Returns:
+        The text, or the kept part of it
+    """
+    if max_tokens <= 0:
+        return ""
+
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[-max_tokens:] if from_end else tokens[:max_tokens])
+
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[-max_chars:] if from_end else text[:max_chars]
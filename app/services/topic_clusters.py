@@ -0,0 +1,91 @@
+from typing import Any, Dict, List
+import numpy as np
+import faiss
+import logging
+import os
+
+logger = logging.getLogger("topic_clusters")
+
+# Topics a document is clustered into when picking quiz context
+QUIZ_TOPIC_CLUSTERS = int(os.getenv("QUIZ_TOPIC_CLUSTERS", "10"))
+
+# Fixed seed so the same document always gets the same topics
+KMEANS_ITERATIONS = 20
+KMEANS_SEED = 1234
+# Nearest chunks considered per centroid when a closer centroid already took the nearest one
+REPRESENTATIVE_CANDIDATES = 8
+
+
+class TopicClusters:
+    """K-means topics of a document and the chunk that best represents each one."""
+
+    def __init__(self, num_topics: int, centroids: np.ndarray, representatives: List[int], sizes: List[int]):
+        # The number of topics asked for; fewer are found when chunks are scarce or clusters come out empty
+        self.num_topics = num_topics
+        self.centroids = centroids
+        # Chunk index nearest each centroid, largest topic first
+        self.representatives = representatives
+        # Chunks assigned to each topic, in the same order
+        self.sizes = sizes
+
+    def chunks(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Get the representative chunks, scored by the share of the document their topic covers.
+
+        Args:
+            chunks: All chunks of the document
+
+        Returns:
+            One chunk per topic, largest topic first
+        """
+        total = sum(self.sizes) or 1
+        return [
+            {**chunks[index], "chunk_index": index, "score": size / total}
+            for index, size in zip(self.representatives, self.sizes)
+            if index < len(chunks)
+        ]
+
+
+def cluster_topics(embeddings: np.ndarray, num_topics: int = None) -> TopicClusters:
+    """
+    Cluster a document's chunk embeddings and pick one representative chunk per cluster.
+
+    Args:
+        embeddings: Float32 matrix with one row per chunk
+        num_topics: Number of clusters (defaults to QUIZ_TOPIC_CLUSTERS)
+
+    Returns:
+        The topics, largest first
+    """
+    num_topics = num_topics or QUIZ_TOPIC_CLUSTERS
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    count, dimension = vectors.shape
+
+    if count <= num_topics:
+        # Every chunk is its own topic
+        return TopicClusters(num_topics, vectors.copy(), list(range(count)), [1] * count)
+
+    kmeans = faiss.Kmeans(dimension, num_topics, niter=KMEANS_ITERATIONS, seed=KMEANS_SEED, spherical=True,
+                          min_points_per_centroid=1)
+    kmeans.train(vectors)
+    _, assignments = kmeans.index.search(vectors, 1)
+    sizes = np.bincount(assignments[:, 0], minlength=num_topics)
+
+    # The chunk nearest each centroid stands in for its topic (an approximate medoid)
+    index = faiss.IndexFlatL2(dimension)
+    index.add(vectors)
+    _, nearest = index.search(kmeans.centroids, min(count, REPRESENTATIVE_CANDIDATES))
+
+    centroids, representatives, topic_sizes = [], [], []
+    for topic in np.argsort(-sizes, kind="stable"):
+        if sizes[topic] == 0:
+            continue
+        chunk_index = next((int(i) for i in nearest[topic] if i >= 0 and int(i) not in representatives), None)
+        if chunk_index is None:
+            continue
+        centroids.append(kmeans.centroids[topic])
+        representatives.append(chunk_index)
+        topic_sizes.append(int(sizes[topic]))
+
+    logger.info(f"Clustered {count} chunks into {len(representatives)} topics of sizes {topic_sizes}")
+    return TopicClusters(num_topics, np.vstack(centroids), representatives, topic_sizes)
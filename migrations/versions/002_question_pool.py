@@ -0,0 +1,33 @@
+"""Add pre-generated question pool
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Create question pool table
+    op.create_table(
+        'question_pool',
+        sa.Column('id', sa.Integer(), autoincrement=True, primary_key=True),
+        sa.Column('pdf_id', sa.String(), sa.ForeignKey('pdfs.id')),
+        sa.Column('difficulty', sa.String()),
+        sa.Column('question', sa.JSON()),
+        sa.Column('created_at', sa.DateTime(), default=sa.func.now())
+    )
+    op.create_index('ix_question_pool_pdf_id', 'question_pool', ['pdf_id'])
+
+
+def downgrade():
+    op.drop_index('ix_question_pool_pdf_id', table_name='question_pool')
+    op.drop_table('question_pool')
@@ -0,0 +1,43 @@
+"""Add background ingestion jobs
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Create ingestion jobs table
+    op.create_table(
+        'ingestion_jobs',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('user_id', sa.String(), sa.ForeignKey('users.id')),
+        sa.Column('pdf_id', sa.String()),
+        sa.Column('filename', sa.String()),
+        sa.Column('upload_path', sa.String()),
+        sa.Column('status', sa.String()),
+        sa.Column('stage', sa.String(), nullable=True),
+        sa.Column('pages_total', sa.Integer()),
+        sa.Column('pages_extracted', sa.Integer()),
+        sa.Column('chunks_total', sa.Integer()),
+        sa.Column('chunks_embedded', sa.Integer()),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(), default=sa.func.now()),
+        sa.Column('finished_at', sa.DateTime(), nullable=True)
+    )
+    op.create_index('ix_ingestion_jobs_user_id', 'ingestion_jobs', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_ingestion_jobs_user_id', table_name='ingestion_jobs')
+    op.drop_table('ingestion_jobs')
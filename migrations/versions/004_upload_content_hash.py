@@ -0,0 +1,23 @@
+"""Record the content hash of uploads
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('ingestion_jobs', sa.Column('content_hash', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('ingestion_jobs', 'content_hash')
@@ -0,0 +1,43 @@
+"""Share chunk and vector storage between identical uploads
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Create shared document storage table
+    op.create_table(
+        'document_storage',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('fingerprint', sa.String()),
+        sa.Column('file_path', sa.String()),
+        sa.Column('ref_count', sa.Integer()),
+        sa.Column('created_at', sa.DateTime(), default=sa.func.now())
+    )
+    op.create_index('ix_document_storage_fingerprint', 'document_storage', ['fingerprint'], unique=True)
+
+    # Point PDFs at their storage (batch mode, since SQLite cannot add a foreign key to an existing table)
+    with op.batch_alter_table('pdfs') as batch_op:
+        batch_op.add_column(sa.Column('storage_id', sa.String(), nullable=True))
+        batch_op.create_foreign_key('fk_pdfs_storage_id', 'document_storage', ['storage_id'], ['id'])
+        batch_op.create_index('ix_pdfs_storage_id', ['storage_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('pdfs') as batch_op:
+        batch_op.drop_index('ix_pdfs_storage_id')
+        batch_op.drop_constraint('fk_pdfs_storage_id', type_='foreignkey')
+        batch_op.drop_column('storage_id')
+    op.drop_index('ix_document_storage_fingerprint', table_name='document_storage')
+    op.drop_table('document_storage')
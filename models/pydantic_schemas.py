@@ -1,11 +1,15 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Literal
 
 
 class QuestionRequest(BaseModel):
     """Request model for asking a question about a PDF document."""
     question: str = Field(..., description="The question to ask about the PDF content")
     pdf_id: str = Field(..., description="ID of the previously uploaded PDF")
+    search_mode: Optional[Literal["vector", "lexical", "hybrid"]] = Field(
+        None, description="Retrieval mode: semantic, BM25 keyword, or both fused (server default if omitted)"
+    )
+    use_cache: bool = Field(True, description="Reuse a cached answer to an identical request if one exists")
 
 
 class ChunkInfo(BaseModel):
@@ -24,6 +28,32 @@ class AnswerResponse(BaseModel):
     processing_time: float = Field(
         ..., description="Time taken to process the question in seconds"
     )
+    context_tokens: Optional[int] = Field(
+        None, description="Tokens of document context sent to the model (0 when an earlier answer was reused)"
+    )
+
+
+class LibrarySearchRequest(BaseModel):
+    """Request model for searching across all PDFs in the user's library."""
+    question: str = Field(..., description="The search query")
+    top_k: int = Field(10, description="Number of chunks to return", ge=1, le=50)
+
+
+class LibraryChunkInfo(BaseModel):
+    """A text chunk returned by a library-wide search."""
+    pdf_id: str = Field(..., description="ID of the PDF this chunk comes from")
+    filename: str = Field(..., description="Name of the PDF file")
+    text: str = Field(..., description="Text content of the chunk")
+    page_number: int = Field(..., description="Page number where this chunk appears")
+    score: float = Field(..., description="Relevance score of this chunk to the query")
+
+
+class LibrarySearchResponse(BaseModel):
+    """Response model for a library-wide search."""
+    results: List[LibraryChunkInfo] = Field(..., description="Matching chunks, most relevant first")
+    processing_time: float = Field(
+        ..., description="Time taken to process the search in seconds"
+    )
 
 
 class PDFUploadResponse(BaseModel):
@@ -37,6 +67,26 @@ class PDFUploadResponse(BaseModel):
     )
 
 
+class IngestionJobResponse(BaseModel):
+    """Status of a background PDF ingestion job."""
+    job_id: str = Field(..., description="ID of the ingestion job")
+    status: Literal["queued", "running", "completed", "failed"] = Field(..., description="Job state")
+    stage: Optional[Literal["extracting", "embedding", "saving"]] = Field(
+        None, description="Pipeline stage while the job is running; chunks are embedded while pages are extracted"
+    )
+    filename: str = Field(..., description="Name of the uploaded PDF file")
+    pdf_id: Optional[str] = Field(None, description="ID of the ingested PDF, once the job has completed")
+    pages_total: int = Field(0, description="Pages in the PDF, once known")
+    pages_extracted: int = Field(0, description="Pages whose text has been extracted")
+    chunks_total: int = Field(0, description="Text chunks extracted so far")
+    chunks_embedded: int = Field(0, description="Chunks whose embeddings have been created")
+    error: Optional[str] = Field(None, description="Why the job failed")
+    created_at: str = Field(..., description="Upload timestamp")
+    processing_time: Optional[float] = Field(
+        None, description="Seconds from upload until the job finished"
+    )
+
+
 class ErrorResponse(BaseModel):
     """Model for API error responses."""
     detail: str = Field(..., description="Error message")
@@ -94,6 +144,7 @@ class QuizRequest(BaseModel):
     pdf_id: str = Field(..., description="ID of the previously uploaded PDF")
     num_questions: int = Field(5, description="Number of questions to generate", ge=1, le=20)
     difficulty: str = Field("medium", description="Quiz difficulty level")
+    use_cache: bool = Field(True, description="Reuse a cached quiz for an identical request if one exists")
 
 
 class QuizAnswer(BaseModel):
@@ -66,7 +66,15 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(`HTTP error ${response.status}`);
             }
 
-            const data = await response.json();
+            // Processing continues in the background; wait for the job to finish
+            const job = await waitForUploadJob(await response.json());
+
+            const data = {
+                pdf_id: job.pdf_id,
+                filename: job.filename,
+                num_pages: job.pages_total,
+                num_chunks: job.chunks_total
+            };
 
             // Store the PDF ID for later use
             currentPdfId = data.pdf_id;
@@ -84,6 +92,39 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Poll an upload's ingestion job until it completes, showing its progress
+    async function waitForUploadJob(job) {
+        while (job.status === 'queued' || job.status === 'running') {
+            showStatus(describeUploadJob(job), 'loading');
+            await new Promise(resolve => setTimeout(resolve, 1000));
+
+            const response = await fetch(`/api/upload/${job.job_id}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error ${response.status}`);
+            }
+            job = await response.json();
+        }
+
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Processing failed');
+        }
+        return job;
+    }
+
+    // Describe the stage an ingestion job is in
+    function describeUploadJob(job) {
+        if (job.stage === 'extracting' && job.pages_total) {
+            return `Extracting text... ${job.pages_extracted}/${job.pages_total} pages, ${job.chunks_embedded} chunks embedded`;
+        }
+        if (job.stage === 'embedding' && job.chunks_total) {
+            return `Creating embeddings... ${job.chunks_embedded}/${job.chunks_total} chunks`;
+        }
+        if (job.stage === 'saving') {
+            return 'Processing PDF...';
+        }
+        return 'Waiting to process PDF...';
+    }
+
     // Handle question submission
     questionForm.addEventListener('submit', async function(event) {
         event.preventDefault();
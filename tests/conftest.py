@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import fitz  # PyMuPDF
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+
+def make_text_pdf(num_pages: int, label: str = "Page") -> bytes:
+    """Generate a PDF with a paragraph of text on every page"""
+    doc = fitz.open()
+    for page_num in range(num_pages):
+        doc.new_page().insert_textbox(
+            fitz.Rect(72, 72, 540, 760),
+            f"{label} {page_num + 1}. " + "Photosynthesis turns light into chemical energy. " * 40
+        )
+    return doc.tobytes()
+
+
+@pytest.fixture
+def isolated_app(tmp_path, monkeypatch):
+    """
+    The application wired to a temporary database and storage directory.
+
+    Embeddings are computed locally, and requests are made as the user named
+    by `env.user` (u1 and u2 exist).
+    """
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.auth import utils as auth_utils
+    from app.auth.utils import get_current_user
+    from app.database import Base, User, get_db
+    from app.routes import pdf_routes, quiz_routes
+    from app.services.document_store import DocumentStore
+    from app.services.document_storage import document_storage
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = Session()
+    for user_id in ("u1", "u2"):
+        db.add(User(id=user_id, username=user_id, email=f"{user_id}@example.com", password="x"))
+    db.commit()
+    db.close()
+
+    pdfs_dir = tmp_path / "pdfs"
+    pdfs_dir.mkdir()
+    monkeypatch.setattr(auth_utils, "PDFS_DIR", pdfs_dir)
+    for retriever in (pdf_routes.retriever, quiz_routes.retriever):
+        monkeypatch.setattr(retriever, "pdfs_dir", str(pdfs_dir))
+        monkeypatch.setattr(retriever, "store", DocumentStore(str(pdfs_dir)))
+        monkeypatch.setattr(retriever, "libraries_dir", str(tmp_path / "libraries"))
+    monkeypatch.setattr(pdf_routes.ingestion_queue, "upload_dir", str(tmp_path / "uploads"))
+    monkeypatch.setattr(pdf_routes.ingestion_queue, "session_factory", Session)
+    monkeypatch.setattr(document_storage, "session_factory", Session)
+    monkeypatch.setattr(document_storage, "_storage_ids", {})
+
+    embed_calls = []
+
+    async def fake_embed(texts, progress_callback=None):
+        embed_calls.append(len(texts))
+        if progress_callback:
+            progress_callback(len(texts), len(texts))
+        return [[float(len(text) % 13), float(text.count("e") % 7), 1.0] for text in texts]
+
+    monkeypatch.setattr(pdf_routes.embedding_service, "create_embeddings", fake_embed)
+
+    def override_get_db():
+        session = Session()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    env = SimpleNamespace(user="u1", session=Session, pdfs_dir=pdfs_dir, upload_dir=tmp_path / "uploads",
+                          embed_calls=embed_calls)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_current_user] = lambda: {"user_id": env.user}
+    try:
+        with TestClient(app) as client:
+            env.client = client
+            yield env
+    finally:
+        app.dependency_overrides.clear()
+        engine.dispose()
+
+
+def upload_and_wait(env, pdf: bytes, filename: str = "notes.pdf", timeout: float = 30) -> dict:
+    """Upload a PDF as the current user and poll its ingestion job until it finishes"""
+    response = env.client.post("/api/upload", files={"file": (filename, pdf, "application/pdf")})
+    assert response.status_code == 202, response.text
+    job_id = response.json()["job_id"]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = env.client.get(f"/api/upload/{job_id}").json()
+        if status["status"] in ("completed", "failed"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"Ingestion job {job_id} did not finish")
+
+
+def parse_events(body: str):
+    """Split a server-sent event stream into (event, data) pairs"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
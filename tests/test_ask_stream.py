@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import pytest
+from conftest import make_text_pdf, parse_events, upload_and_wait
+
+from app.database import Message
+from app.routes import pdf_routes
+from app.services.cache import LRUCache
+from app.services.llm import LLMService
+from app.services.model_capabilities import ModelCapabilities
+from app.services.response_cache import ResponseCache
+
+ANSWER = "Photosynthesis turns light into chemical energy, as page 1 explains."
+
+
+class FakeAnswerStream:
+    """Streamed completion delivering an answer a few characters at a time, failing after `fail_after` pieces"""
+
+    def __init__(self, text: str, fail_after: int = None):
+        self.pieces = [text[i:i + 8] for i in range(0, len(text), 8)]
+        self.fail_after = fail_after
+
+        async def aclose():
+            pass
+
+        self.response = SimpleNamespace(aclose=aclose)
+
+    async def __aiter__(self):
+        for i, piece in enumerate(self.pieces):
+            if i == self.fail_after:
+                raise ConnectionError("stream interrupted")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+        self.fail_after = None
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        assert kwargs.get("stream")
+        return FakeAnswerStream(ANSWER, self.fail_after)
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    """Answers /api/ask/stream from a fake model through a fresh response cache"""
+    completions = FakeCompletions()
+    llm_client = SimpleNamespace(api_key="test-key", base_url="http://fake/v1",
+                                 chat=SimpleNamespace(completions=completions))
+    service = LLMService(model="gpt-4o-mini", llm_client=llm_client,
+                         cache=ResponseCache(memory=LRUCache(max_bytes=1024 * 1024)),
+                         capabilities=ModelCapabilities(path=None))
+    monkeypatch.setattr(pdf_routes, "llm_service", service)
+    return completions
+
+
+def ask(env, pdf_id, **options):
+    # Lexical search skips the semantic answer cache, so only the response cache can answer repeats
+    body = {"pdf_id": pdf_id, "question": "What does photosynthesis do?", "search_mode": "lexical", **options}
+    response = env.client.post("/api/ask/stream", json=body)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/event-stream")
+    return parse_events(response.text)
+
+
+def test_sources_then_tokens_then_done(isolated_app, completions):
+    env = isolated_app
+    pdf_id = upload_and_wait(env, make_text_pdf(2))["pdf_id"]
+
+    events = ask(env, pdf_id)
+    names = [event for event, _ in events]
+    assert names[0] == "sources" and names[-1] == "done"
+    assert set(names[1:-1]) == {"token"} and len(names) > 3
+
+    assert events[0][1]["source_chunks"]
+    assert "".join(data["text"] for event, data in events if event == "token") == ANSWER
+    done = events[-1][1]
+    assert done["answer"] == ANSWER
+    assert done["first_token_time"] <= done["processing_time"]
+    assert done["context_tokens"] > 0
+
+    db = env.session()
+    assert [message.content for message in db.query(Message).filter(Message.is_user.is_(False))] == [ANSWER]
+    db.close()
+
+
+def test_failure_mid_answer_ends_with_an_error_event(isolated_app, completions):
+    env = isolated_app
+    pdf_id = upload_and_wait(env, make_text_pdf(2))["pdf_id"]
+    completions.fail_after = 2
+
+    events = ask(env, pdf_id)
+    assert [event for event, _ in events] == ["sources", "token", "token", "error"]
+    assert "stream interrupted" in events[-1][1]["detail"]
+    db = env.session()
+    assert db.query(Message).count() == 0
+    db.close()
+
+    # The partial answer was not cached; asking again goes back to the model
+    completions.fail_after = None
+    assert ask(env, pdf_id)[-1][1]["answer"] == ANSWER
+    assert completions.calls == 2
+
+
+def test_cached_answer_is_replayed_in_one_token(isolated_app, completions):
+    env = isolated_app
+    pdf_id = upload_and_wait(env, make_text_pdf(2))["pdf_id"]
+    ask(env, pdf_id)
+
+    events = ask(env, pdf_id)
+    assert [event for event, _ in events] == ["sources", "token", "done"]
+    assert events[1][1]["text"] == events[2][1]["answer"] == ANSWER
+    assert completions.calls == 1
+
+    # Opting out asks the model again
+    ask(env, pdf_id, use_cache=False)
+    assert completions.calls == 2
+
+
+def test_stream_requires_owning_the_pdf(isolated_app, completions):
+    env = isolated_app
+    pdf_id = upload_and_wait(env, make_text_pdf(2))["pdf_id"]
+    env.user = "u2"
+    response = env.client.post("/api/ask/stream", json={"pdf_id": pdf_id, "question": "What?"})
+    assert response.status_code == 404
+    assert completions.calls == 0
@@ -0,0 +1,142 @@
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services import cache as cache_module
+from app.services.cache import DiskCache, LRUCache
+
+
+class Clock:
+    """Controllable replacement for time.time/time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_disk_cache_round_trip_and_persistence(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = DiskCache(path, max_bytes=1000)
+    cache.put_many([("a", b"alpha"), ("b", b"beta")])
+
+    assert cache.get_many(["a", "b", "c", "a"]) == {"a": b"alpha", "b": b"beta"}
+    assert cache.get("c") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+    # Another process opening the same file sees the entries and their size
+    reopened = DiskCache(path, max_bytes=1000)
+    assert reopened.get("b") == b"beta"
+    assert reopened.stats()["bytes"] == len(b"alpha") + len(b"beta")
+
+
+def test_disk_cache_replacing_a_key_counts_its_size_once(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000)
+    cache.put("a", b"x" * 100)
+    cache.put("a", b"y" * 40)
+    assert cache.get("a") == b"y" * 40
+    assert cache.stats()["bytes"] == 40
+
+
+def test_disk_cache_evicts_least_recently_read(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=300)
+
+    for key in "abc":
+        clock.now += 1
+        cache.put(key, key.encode() * 100)
+    # Reading "a" makes "b" the least recently used
+    clock.now += 1
+    assert cache.get("a") is not None
+
+    clock.now += 1
+    cache.put("d", b"d" * 100)
+
+    # Eviction frees down to 90% of the budget
+    assert set(cache.get_many("abcd")) == {"a", "d"}
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["bytes"] == 200
+
+
+def test_disk_cache_skips_values_larger_than_the_budget(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=50)
+    cache.put("small", b"s" * 10)
+    cache.put("huge", b"h" * 51)
+    assert cache.get("huge") is None
+    assert cache.get("small") == b"s" * 10
+
+
+def test_disk_cache_entries_expire_after_ttl(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000, ttl=60)
+    cache.put("old", b"o" * 10)
+    clock.now += 30
+    cache.put("new", b"n" * 10)
+
+    # Reading doesn't extend an entry's lifetime
+    assert cache.get("old") is not None
+    clock.now += 31
+    assert cache.get_many(["old", "new"]) == {"new": b"n" * 10}
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["bytes"] == 10
+
+    clock.now += 30
+    assert cache.get("new") is None
+
+
+def test_disk_cache_upgrades_files_without_stored_at(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "cache.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                 "last_access REAL NOT NULL)")
+    conn.execute("INSERT INTO entries VALUES ('k', x'01', 1, ?)", (time.time(),))
+    conn.commit()
+    conn.close()
+
+    cache = DiskCache(path, max_bytes=1000)
+    assert cache.get("k") == b"\x01"
+    cache.put("k2", b"\x02")
+    assert cache.get("k2") == b"\x02"
+
+
+def test_lru_cache_evicts_least_recently_used_within_byte_budget():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa" and cache.get("c") == "cccc"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 8
+    # A value over the whole budget is refused rather than flushing everything
+    assert cache.put("huge", "x" * 11) is False
+    assert cache.stats()["entries"] == 2
+
+
+def test_lru_cache_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.put("a", 1)
+    clock.now += 59
+    assert cache.get("a") == 1
+
+    # Reading doesn't extend the lifetime, storing again does
+    clock.now += 1
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["entries"] == 0
+    cache.put("a", 2)
+    clock.now += 59
+    assert cache.get("a") == 2
@@ -0,0 +1,120 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services import context_packer
+from app.services.context_packer import pack_context
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    """Count one token per word so budgets are easy to reason about"""
+    monkeypatch.setattr(context_packer, "count_tokens", lambda text, model: len(text.split()))
+    monkeypatch.setattr(context_packer, "truncate_to_tokens",
+                        lambda text, max_tokens, model: " ".join(text.split()[:max_tokens]))
+
+
+def words(label, count):
+    return " ".join(f"{label}{i}" for i in range(count))
+
+
+def pack(chunks, budget):
+    return pack_context(chunks, budget, "test-model", overhead_tokens=0)
+
+
+def test_highest_scores_fill_the_budget_and_come_back_in_document_order():
+    chunks = [
+        {"text": words("a", 10), "chunk_index": 0, "score": 0.2},
+        {"text": words("b", 10), "chunk_index": 1, "score": 0.9},
+        {"text": words("c", 10), "chunk_index": 2, "score": 0.5},
+        {"text": words("d", 10), "chunk_index": 3, "score": 0.7},
+    ]
+    packed = pack(chunks, budget=25)
+
+    assert [chunk["chunk_index"] for chunk in packed.chunks] == [1, 3]
+    assert packed.tokens == 20
+    assert packed.dropped == 2
+
+
+def test_chunk_that_does_not_fit_is_skipped_for_smaller_ones():
+    chunks = [
+        {"text": words("a", 10), "chunk_index": 0, "score": 0.9},
+        {"text": words("b", 20), "chunk_index": 1, "score": 0.8},
+        {"text": words("c", 5), "chunk_index": 2, "score": 0.1},
+    ]
+    assert [chunk["chunk_index"] for chunk in pack(chunks, budget=16).chunks] == [0, 2]
+
+
+def test_best_chunk_is_truncated_when_nothing_fits():
+    packed = pack([{"text": words("a", 50), "score": 1.0}], budget=8)
+    assert packed.chunks[0]["text"] == words("a", 8)
+    assert packed.tokens == 8
+
+
+def test_unscored_chunks_are_spread_over_the_input():
+    """Without scores, a small budget samples the whole input rather than its beginning"""
+    chunks = [{"text": words(f"p{i}x", 10), "chunk_index": i} for i in range(8)]
+    packed = pack(chunks, budget=40)
+    assert [chunk["chunk_index"] for chunk in packed.chunks] == [0, 2, 4, 6]
+
+
+def test_scored_chunks_come_before_unscored_ones():
+    chunks = [
+        {"text": words("a", 10), "chunk_index": 0},
+        {"text": words("b", 10), "chunk_index": 1, "score": 0.0},
+        {"text": words("c", 10), "chunk_index": 2},
+    ]
+    assert [chunk["chunk_index"] for chunk in pack(chunks, budget=20).chunks] == [0, 1]
+    assert [chunk["chunk_index"] for chunk in pack(chunks, budget=10).chunks] == [1]
+
+
+def test_overlap_between_neighbouring_chunks_is_sent_once():
+    shared = words("shared", 12)
+    first = words("first", 10) + " " + shared
+    second = shared + " " + words("second", 10)
+    third = words("third", 10)
+
+    # The earlier neighbour is taken first, then the later one
+    packed = pack([
+        {"text": first, "chunk_index": 0, "score": 0.9},
+        {"text": second, "chunk_index": 1, "score": 0.8},
+        {"text": third, "chunk_index": 5, "score": 0.7},
+    ], budget=100)
+    texts = [chunk["text"] for chunk in packed.chunks]
+    assert texts == [first, " " + words("second", 10), third]
+    assert " ".join(texts).count("shared0 ") == 1
+    assert packed.tokens == 22 + 10 + 10
+
+    # The later neighbour is taken first; the earlier one loses its end instead
+    packed = pack([
+        {"text": first, "chunk_index": 0, "score": 0.1},
+        {"text": second, "chunk_index": 1, "score": 0.9},
+    ], budget=100)
+    assert [chunk["text"] for chunk in packed.chunks] == [words("first", 10) + " ", second]
+
+
+def test_overlap_is_only_removed_between_neighbours_of_the_same_document():
+    shared = words("shared", 12)
+    chunks = [
+        {"text": words("first", 5) + " " + shared, "chunk_index": 0, "pdf_id": "a", "score": 0.9},
+        {"text": shared + " " + words("second", 5), "chunk_index": 1, "pdf_id": "b", "score": 0.8},
+        {"text": shared + " " + words("third", 5), "chunk_index": 3, "pdf_id": "a", "score": 0.7},
+    ]
+    packed = pack(chunks, budget=100)
+    # Document order groups chunks by PDF
+    assert [chunk["text"] for chunk in packed.chunks] == [chunks[0]["text"], chunks[2]["text"], chunks[1]["text"]]
+
+
+def test_repeated_chunks_are_dropped():
+    chunks = [
+        {"text": "Same  text here", "chunk_index": 0, "score": 0.9},
+        {"text": "Same text\nhere", "chunk_index": 4, "score": 0.8},
+        {"text": "   ", "chunk_index": 5, "score": 0.7},
+    ]
+    packed = pack(chunks, budget=100)
+    assert [chunk["chunk_index"] for chunk in packed.chunks] == [0]
+    assert packed.dropped == 2
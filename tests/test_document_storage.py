@@ -0,0 +1,156 @@
+import logging
+import os
+
+from conftest import make_text_pdf, upload_and_wait
+from sqlalchemy import create_engine, inspect, text
+
+from app import database
+from app.database import DocumentStorage, PDF, PDFChunk
+from app.routes import quiz_routes
+from app.services.document_storage import document_storage
+
+
+class FakeQuizGenerator:
+    """Quiz generator that writes one question per chunk it is given, without a model"""
+
+    def __init__(self):
+        self.chunks_seen = []
+
+    async def generate(self, chunks, num_questions, build_prompts, use_cache=True):
+        self.chunks_seen.append(len(chunks))
+        return [
+            {
+                "question": f"What does chunk {i + 1} say?",
+                "answers": [{"text": "Something", "is_correct": True}, {"text": "Nothing", "is_correct": False}],
+                "explanation": chunk["text"][:40]
+            }
+            for i, chunk in enumerate(chunks[:num_questions])
+        ]
+
+
+def test_identical_upload_shares_storage(isolated_app):
+    """A second owner's identical upload should reuse the first one's chunks and vectors"""
+    env = isolated_app
+    pdf = make_text_pdf(6)
+
+    first = upload_and_wait(env, pdf)
+    embeds_after_first = len(env.embed_calls)
+    env.user = "u2"
+    second = upload_and_wait(env, pdf)
+
+    assert first["status"] == second["status"] == "completed"
+    assert second["chunks_total"] == first["chunks_total"] > 0
+    # Nothing was embedded for the second upload
+    assert len(env.embed_calls) == embeds_after_first
+
+    db = env.session()
+    storage = db.query(DocumentStorage).one()
+    assert storage.id == first["pdf_id"]
+    assert storage.ref_count == 2
+    assert db.get(PDF, second["pdf_id"]).storage_id == storage.id
+    assert db.query(PDFChunk).count() == first["chunks_total"]
+    assert not (env.pdfs_dir / second["pdf_id"]).exists()
+    db.close()
+
+
+def test_second_owner_can_generate_quiz(isolated_app, monkeypatch):
+    """/api/generate should find the chunks of an upload that shares another upload's storage"""
+    env = isolated_app
+    generator = FakeQuizGenerator()
+    monkeypatch.setattr(quiz_routes, "quiz_generator", generator)
+    pdf = make_text_pdf(4)
+
+    upload_and_wait(env, pdf)
+    env.user = "u2"
+    second = upload_and_wait(env, pdf)
+
+    response = env.client.post("/api/generate", json={"pdf_id": second["pdf_id"], "num_questions": 3})
+    assert response.status_code == 200, response.text
+    assert len(response.json()["questions"]) == 3
+    assert generator.chunks_seen == [second["chunks_total"]]
+
+    # Another user's PDF is not found
+    env.user = "u1"
+    response = env.client.post("/api/generate", json={"pdf_id": second["pdf_id"], "num_questions": 3})
+    assert response.status_code == 404
+
+
+def test_storage_is_reclaimed_with_last_owner(isolated_app):
+    """Deleting one owner's copy keeps the shared storage; deleting the last one removes it"""
+    env = isolated_app
+    pdf = make_text_pdf(3)
+
+    first = upload_and_wait(env, pdf)
+    env.user = "u2"
+    second = upload_and_wait(env, pdf)
+    storage_dir = env.pdfs_dir / first["pdf_id"]
+
+    env.user = "u1"
+    assert env.client.delete(f"/api/pdf/{first['pdf_id']}").status_code == 200
+    db = env.session()
+    assert db.query(DocumentStorage).one().ref_count == 1
+    # The chunk rows moved to the remaining owner
+    assert db.query(PDFChunk).filter(PDFChunk.pdf_id == second["pdf_id"]).count() == second["chunks_total"]
+    shared_file = db.get(PDF, second["pdf_id"]).file_path
+    db.close()
+    assert storage_dir.exists()
+    assert os.path.exists(shared_file)
+
+    env.user = "u2"
+    assert env.client.delete(f"/api/pdf/{second['pdf_id']}").status_code == 200
+    db = env.session()
+    assert db.query(DocumentStorage).count() == 0
+    assert db.query(PDFChunk).count() == 0
+    db.close()
+    assert not storage_dir.exists()
+    assert not os.path.exists(shared_file)
+
+
+def test_concurrent_registration_shares_the_first_storage(isolated_app, monkeypatch):
+    """An upload that loses the race to register a fingerprint shares the winner's storage"""
+    env = isolated_app
+    pdf = make_text_pdf(3)
+    first = upload_and_wait(env, pdf)
+
+    # The second upload doesn't see the first one's storage until its own registration fails,
+    # as when the two run in separate processes
+    real_find = document_storage.find
+    calls = []
+
+    def find_after_commit(db, fingerprint):
+        calls.append(fingerprint)
+        return None if len(calls) <= 2 else real_find(db, fingerprint)
+
+    monkeypatch.setattr(document_storage, "find", find_after_commit)
+    env.user = "u2"
+    second = upload_and_wait(env, pdf)
+
+    assert second["status"] == "completed", second
+    assert len(calls) == 3
+    db = env.session()
+    storage = db.query(DocumentStorage).one()
+    assert storage.id == first["pdf_id"]
+    assert storage.ref_count == 2
+    assert db.get(PDF, second["pdf_id"]).storage_id == storage.id
+    assert db.query(PDFChunk).count() == first["chunks_total"]
+    db.close()
+    assert not (env.pdfs_dir / second["pdf_id"]).exists()
+
+
+def test_missing_columns_are_reported_not_altered(tmp_path, monkeypatch, caplog):
+    """Tables created before a column was added get a warning pointing to the migrations"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE pdfs (id VARCHAR PRIMARY KEY, user_id VARCHAR, title VARCHAR, "
+                          "filename VARCHAR, created_at DATETIME, file_path VARCHAR)"))
+    monkeypatch.setattr(database, "engine", engine)
+
+    with caplog.at_level(logging.WARNING, logger="database"):
+        database.warn_missing_columns()
+
+    assert "pdfs is missing columns storage_id" in caplog.text
+    assert "alembic upgrade head" in caplog.text
+    assert [column["name"] for column in inspect(engine).get_columns("pdfs")] == [
+        "id", "user_id", "title", "filename", "created_at", "file_path"
+    ]
+    engine.dispose()
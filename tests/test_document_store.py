@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services import document_store
+from app.services.document_store import DocumentStore, INDEX_FILENAME, LEGACY_CHUNKS_FILENAME
+
+
+def write_legacy_document(pdfs_dir, pdf_id, num_chunks=20, dimension=4):
+    pdf_dir = pdfs_dir / pdf_id
+    pdf_dir.mkdir(parents=True)
+    chunks = [
+        {"text": f"chunk {i}", "page": i + 1, "embedding": [float(i)] * dimension}
+        for i in range(num_chunks)
+    ]
+    (pdf_dir / LEGACY_CHUNKS_FILENAME).write_text(json.dumps(chunks))
+    (pdf_dir / "pdf_info.json").write_text(json.dumps({"pdf_id": pdf_id}))
+    return pdf_dir
+
+
+def assert_converted(store, pdf_dir, pdf_id, num_chunks=20):
+    assert not store.is_legacy(pdf_id)
+    assert not (pdf_dir / LEGACY_CHUNKS_FILENAME).exists()
+    assert [chunk["text"] for chunk in store.read_chunks(pdf_id)] == [f"chunk {i}" for i in range(num_chunks)]
+    embeddings = store.read_embeddings(pdf_id)
+    assert embeddings.shape == (num_chunks, 4)
+    assert np.array_equal(embeddings[:, 0], np.arange(num_chunks, dtype=np.float32))
+    assert not [name for name in os.listdir(pdf_dir) if name.endswith(".tmp")]
+
+
+def write_random_document(store, pdf_id, num_chunks=30, dimension=8, seed=0):
+    embeddings = np.random.default_rng(seed).random((num_chunks, dimension), dtype=np.float32)
+    store.write_document(pdf_id, [{"text": f"chunk {i}"} for i in range(num_chunks)], embeddings)
+    return embeddings
+
+
+def test_saved_index_gives_the_same_search_results(tmp_path):
+    """An index read back from disk ranks and scores exactly like the one that was saved"""
+    store = DocumentStore(str(tmp_path))
+    embeddings = write_random_document(store, "doc")
+    index = store.build_index(embeddings)
+    store.save_index("doc", index)
+
+    assert store.read_info("doc")["index"] == {
+        "format_version": document_store.INDEX_FORMAT_VERSION, "file": INDEX_FILENAME,
+        "type": "IndexFlatL2", "dimension": 8, "ntotal": 30}
+    loaded = store.read_index("doc")
+    queries = np.random.default_rng(1).random((5, 8), dtype=np.float32)
+    expected_distances, expected_ids = index.search(queries, 4)
+    distances, ids = loaded.search(queries, 4)
+    assert np.array_equal(ids, expected_ids)
+    assert np.array_equal(distances, expected_distances)
+    assert not [name for name in os.listdir(tmp_path / "doc") if name.endswith(".tmp")]
+
+
+def test_outdated_or_mismatched_index_is_not_read(tmp_path, monkeypatch):
+    """Indexes from another format version, or for a different set of vectors, are left for a rebuild"""
+    store = DocumentStore(str(tmp_path))
+    assert store.read_index("doc") is None
+    store.save_index("doc", store.build_index(write_random_document(store, "doc")))
+    assert store.read_index("doc").ntotal == 30
+
+    monkeypatch.setattr(document_store, "INDEX_FORMAT_VERSION", document_store.INDEX_FORMAT_VERSION + 1)
+    assert store.index_file_if_current("doc") is None
+    assert store.read_index("doc") is None
+    monkeypatch.undo()
+
+    # The index file doesn't hold the vectors pdf_info.json describes
+    write_random_document(store, "doc", num_chunks=40)
+    info = store.read_info("doc")
+    info["index"]["ntotal"] = 40
+    store.write_info("doc", info)
+    assert store.read_index("doc") is None
+
+    assert store.rebuild_index("doc").ntotal == 40
+    assert store.read_index("doc").ntotal == 40
+    assert store.read_info("doc")["index"]["ntotal"] == 40
+
+
+def test_reading_legacy_directory_does_not_convert_it(tmp_path):
+    """Reads leave legacy directories alone; conversion is a separate step"""
+    pdf_dir = write_legacy_document(tmp_path, "doc")
+    before = sorted(os.listdir(pdf_dir))
+    store = DocumentStore(str(tmp_path))
+
+    assert store.read_chunks("doc") == []
+    assert store.read_embeddings("doc") is None
+    assert sorted(os.listdir(pdf_dir)) == before
+
+    assert store.convert_all() == 1
+    assert_converted(store, pdf_dir, "doc")
+
+
+def test_concurrent_conversions_in_one_process_convert_once(tmp_path):
+    """Threads converting the same PDF take turns, and only the first one does the work"""
+    pdf_dir = write_legacy_document(tmp_path, "doc")
+    store = DocumentStore(str(tmp_path))
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(store.convert_legacy("doc"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False] * 7 + [True]
+    assert_converted(store, pdf_dir, "doc")
+
+
+def test_concurrent_conversions_across_stores_leave_a_complete_document(tmp_path):
+    """Stores that don't share locks, like separate worker processes, never publish partial files"""
+    pdf_dir = write_legacy_document(tmp_path, "doc", num_chunks=500)
+    stores = [DocumentStore(str(tmp_path)) for _ in range(4)]
+    errors = []
+
+    def convert(store):
+        try:
+            store.convert_legacy("doc")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=convert, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert_converted(stores[0], pdf_dir, "doc", num_chunks=500)
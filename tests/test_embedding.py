@@ -0,0 +1,305 @@
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app.services import embedding
+from app.services.cache import DiskCache, LRUCache
+from app.services.embedding import EmbeddingCoalescer, EmbeddingService
+
+
+def vector_for(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 97)]
+
+
+class FakeEmbeddingsAPI:
+    """Stands in for client.embeddings, recording each request and how many overlap"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, input, model, encoding_format):
+        self.requests.append(list(input))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        # Out of order on purpose; callers must sort by index
+        data = [SimpleNamespace(index=i, embedding=vector_for(text)) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    api = FakeEmbeddingsAPI()
+    monkeypatch.setattr(embedding, "client", SimpleNamespace(api_key="test-key", embeddings=api))
+    return api
+
+
+def test_requests_in_flight_are_capped_without_blocking_the_loop(fake_api, monkeypatch):
+    """Concurrent batches overlap up to max_concurrency, and other tasks keep running meanwhile"""
+    fake_api.delay = 0.05
+    monkeypatch.setattr(embedding, "EMBEDDING_BATCH_SIZE", 1)
+    service = EmbeddingService(max_concurrency=3, cache=None)
+    texts = [f"text {i}" for i in range(9)]
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticking = asyncio.ensure_future(ticker())
+        vectors = await service.create_embeddings(texts)
+        ticking.cancel()
+        return vectors, ticks
+
+    vectors, ticks = asyncio.run(run())
+
+    assert vectors == [vector_for(text) for text in texts]
+    assert len(fake_api.requests) == 9
+    assert fake_api.max_in_flight == 3
+    # The loop served the ticker while requests were waiting
+    assert ticks >= 10
+
+
+def test_cancelling_the_caller_releases_its_slots(fake_api):
+    fake_api.delay = 10
+    service = EmbeddingService(max_concurrency=1, cache=None)
+
+    async def run():
+        task = asyncio.ensure_future(service.create_embeddings(["slow"]))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        fake_api.delay = 0
+        return await asyncio.wait_for(service.create_embeddings(["fast"]), timeout=1)
+
+    assert asyncio.run(run()) == [vector_for("fast")]
+    assert fake_api.in_flight == 0
+
+
+def test_batches_are_bounded_by_tokens_and_size(fake_api, monkeypatch):
+    """Inputs are split by total tokens and by count, and vectors come back in input order"""
+    monkeypatch.setattr(embedding, "count_tokens", lambda text, model: len(text.split()))
+    monkeypatch.setattr(embedding, "EMBEDDING_BATCH_TOKENS", 10)
+    monkeypatch.setattr(embedding, "EMBEDDING_BATCH_SIZE", 3)
+    service = EmbeddingService(cache=None)
+    texts = ["one two three four", "five six", "seven eight nine ten", "a", "b", "c", "d",
+             " ".join(["long"] * 25), "tail"]
+    progress = []
+
+    vectors = asyncio.run(service.create_embeddings(texts, lambda done, total: progress.append((done, total))))
+
+    assert vectors == [vector_for(text) for text in texts]
+    # At most 3 inputs and 10 tokens per request; an input over the token limit is sent on its own
+    assert sorted(fake_api.requests) == sorted([texts[0:3], texts[3:6], ["d"], [texts[7]], ["tail"]])
+    assert progress[-1] == (len(texts), len(texts))
+
+
+def rate_limit_error():
+    response = httpx.Response(429, headers={"retry-after": "0"}, request=httpx.Request("POST", "https://api.test"))
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_rate_limited_batches_are_retried(fake_api, monkeypatch):
+    failures = [rate_limit_error(), rate_limit_error()]
+    create = fake_api.create
+
+    async def flaky_create(**kwargs):
+        if failures:
+            raise failures.pop()
+        return await create(**kwargs)
+
+    monkeypatch.setattr(fake_api, "create", flaky_create)
+    service = EmbeddingService(cache=None)
+
+    assert asyncio.run(service.create_embeddings(["retry me"])) == [vector_for("retry me")]
+    assert failures == []
+
+
+def test_retries_give_up_after_the_limit(fake_api, monkeypatch):
+    attempts = []
+
+    async def always_limited(**kwargs):
+        attempts.append(kwargs["input"])
+        raise rate_limit_error()
+
+    monkeypatch.setattr(fake_api, "create", always_limited)
+    monkeypatch.setattr(embedding, "EMBEDDING_MAX_RETRIES", 2)
+    service = EmbeddingService(cache=None)
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(service.create_embeddings(["never"]))
+    assert len(attempts) == 3
+
+
+def test_retry_delay_honours_retry_after_and_caps_backoff(monkeypatch):
+    monkeypatch.setattr(embedding, "EMBEDDING_RETRY_MAX_DELAY", 30)
+    response = httpx.Response(429, headers={"retry-after": "7"}, request=httpx.Request("POST", "https://api.test"))
+    assert EmbeddingService._retry_delay(RateLimitError("limited", response=response, body=None), 0) == 7
+
+    for attempt in range(10):
+        delay = EmbeddingService._retry_delay(ValueError("no response"), attempt)
+        assert 0 <= delay <= min(embedding.EMBEDDING_RETRY_BASE_DELAY * 2 ** attempt, 30)
+
+
+def test_embeddings_are_reused_from_the_disk_cache(fake_api, tmp_path):
+    """Texts embedded before, even by another service or with different whitespace, aren't sent again"""
+    cache = DiskCache(str(tmp_path / "embeddings.sqlite3"), max_bytes=1024 * 1024)
+    first = EmbeddingService(cache=cache)
+    asyncio.run(first.create_embeddings(["alpha beta", "gamma"]))
+    assert fake_api.requests == [["alpha beta", "gamma"]]
+
+    second = EmbeddingService(cache=cache)
+    vectors = asyncio.run(second.create_embeddings(["gamma", "alpha\nbeta", "delta", "delta"]))
+
+    assert vectors == [vector_for("gamma"), vector_for("alpha beta"), vector_for("delta"), vector_for("delta")]
+    # Only the new text was sent, once
+    assert fake_api.requests[1:] == [["delta"]]
+    assert second.stats() == {"inputs": 4, "cache_hits": 2, "hit_ratio": 0.5}
+
+    # Another model has its own entries
+    other_model = EmbeddingService(model="text-embedding-3-large", cache=cache)
+    asyncio.run(other_model.create_embeddings(["gamma"]))
+    assert fake_api.requests[-1] == ["gamma"]
+
+
+def test_cache_counters_add_up_across_concurrent_calls(fake_api, tmp_path):
+    """Calls running at once each count their own hits, none overwriting another's"""
+    fake_api.delay = 0.01
+    cache = DiskCache(str(tmp_path / "embeddings.sqlite3"), max_bytes=1024 * 1024)
+    service = EmbeddingService(cache=cache)
+    asyncio.run(service.create_embeddings(["cached"]))
+
+    async def run():
+        return await asyncio.gather(
+            service.create_embeddings(["cached", "new one"]),
+            service.create_embeddings(["new two", "new three", "new four"]),
+            service.create_embeddings(["cached"]),
+        )
+
+    asyncio.run(run())
+    assert service.stats() == {"inputs": 7, "cache_hits": 2, "hit_ratio": 2 / 7}
+
+
+def test_repeated_queries_are_served_from_memory(fake_api, monkeypatch):
+    """A repeated question is embedded once until its cache entry expires"""
+    monkeypatch.setattr(embedding, "query_embedding_cache", LRUCache(10, ttl=0.2))
+    service = EmbeddingService(cache=None)
+    service.coalescer.window = 0
+
+    assert asyncio.run(service.create_single_embedding("What is photosynthesis?")) == vector_for("What is photosynthesis?")
+    assert asyncio.run(service.create_single_embedding("What  is\nphotosynthesis?")) == vector_for("What is photosynthesis?")
+    assert len(fake_api.requests) == 1
+
+    time.sleep(0.25)
+    asyncio.run(service.create_single_embedding("What is photosynthesis?"))
+    assert len(fake_api.requests) == 2
+
+
+def test_concurrent_queries_are_coalesced_into_one_request(fake_api, monkeypatch):
+    monkeypatch.setattr(embedding, "query_embedding_cache", LRUCache(100))
+    service = EmbeddingService(cache=None)
+    service.coalescer = EmbeddingCoalescer(service, window_ms=20, max_batch=64)
+    questions = [f"question {i}" for i in range(10)]
+
+    async def ask_all():
+        return await asyncio.gather(*(service.create_single_embedding(question) for question in questions))
+
+    assert asyncio.run(ask_all()) == [vector_for(question) for question in questions]
+    assert fake_api.requests == [questions]
+    assert service.coalescer.stats() == {
+        "batches": 1, "requests": 10, "mean_batch_size": 10.0, "batch_size_histogram": {10: 1}
+    }
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window(fake_api, monkeypatch):
+    monkeypatch.setattr(embedding, "query_embedding_cache", LRUCache(100))
+    service = EmbeddingService(cache=None)
+    # A window far longer than the test; only the batch size can trigger a send
+    service.coalescer = EmbeddingCoalescer(service, window_ms=60000, max_batch=4)
+
+    async def ask(count):
+        return await asyncio.wait_for(
+            asyncio.gather(*(service.create_single_embedding(f"q{i}") for i in range(count))), timeout=2)
+
+    asyncio.run(ask(8))
+    assert [len(request) for request in fake_api.requests] == [4, 4]
+
+
+def test_a_failed_batch_fails_every_waiting_caller_but_not_later_ones(fake_api, monkeypatch):
+    monkeypatch.setattr(embedding, "query_embedding_cache", LRUCache(100))
+    service = EmbeddingService(cache=None)
+    service.coalescer = EmbeddingCoalescer(service, window_ms=10, max_batch=64)
+    create = fake_api.create
+    failures = [ValueError("bad request")]
+
+    async def failing_once(**kwargs):
+        if failures:
+            raise failures.pop()
+        return await create(**kwargs)
+
+    monkeypatch.setattr(fake_api, "create", failing_once)
+
+    async def run():
+        first = await asyncio.gather(*(service.create_single_embedding(f"q{i}") for i in range(3)),
+                                     return_exceptions=True)
+        second = await service.create_single_embedding("q0")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in first)
+    assert second == vector_for("q0")
+
+
+def test_cancelled_caller_is_left_out_of_the_batch(fake_api, monkeypatch):
+    monkeypatch.setattr(embedding, "query_embedding_cache", LRUCache(100))
+    service = EmbeddingService(cache=None)
+    service.coalescer = EmbeddingCoalescer(service, window_ms=20, max_batch=64)
+
+    async def run():
+        gone = asyncio.ensure_future(service.create_single_embedding("gone"))
+        kept = asyncio.ensure_future(service.create_single_embedding("kept"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        return await kept
+
+    assert asyncio.run(run()) == vector_for("kept")
+    assert fake_api.requests == [["kept"]]
+
+
+def test_retries_are_logged(fake_api, monkeypatch, caplog):
+    failures = [rate_limit_error()]
+    create = fake_api.create
+
+    async def flaky_create(**kwargs):
+        if failures:
+            raise failures.pop()
+        return await create(**kwargs)
+
+    monkeypatch.setattr(fake_api, "create", flaky_create)
+    service = EmbeddingService(cache=None)
+
+    with caplog.at_level("WARNING", logger="embedding"):
+        asyncio.run(service.create_embeddings(["retry me"]))
+    assert any("retry 1/" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,352 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+
+import fitz  # PyMuPDF
+import pytest
+from conftest import make_text_pdf, upload_and_wait
+
+from app.database import IngestionJob, PDF, PDFChunk
+from app.routes import pdf_routes
+from app.services import ingestion
+from app.services.ingestion import IngestionQueue, UploadTooLargeError
+from app.services.multipart_upload import MalformedUploadError, MultipartFileStream
+
+
+def make_queue(env, **settings):
+    """A queue on the test database and storage, as a restarted process would build it"""
+    return IngestionQueue(pdf_routes.retriever, pdf_routes.iter_pdf_chunks, pdf_routes.pdf_file_path,
+                          session_factory=env.session, upload_dir=str(env.upload_dir), **settings)
+
+
+def add_job(env, status="running", stage="embedding", pdf: bytes = None):
+    """Record a job as a previous run would have left it, with its upload staged unless pdf is None"""
+    job_id = str(uuid.uuid4())
+    upload_path = env.upload_dir / f"{job_id}.pdf"
+    if pdf is not None:
+        env.upload_dir.mkdir(exist_ok=True)
+        upload_path.write_bytes(pdf)
+    db = env.session()
+    pdf_id = str(uuid.uuid4())
+    db.add(IngestionJob(id=job_id, user_id=env.user, pdf_id=pdf_id, filename="notes.pdf",
+                        upload_path=str(upload_path), status=status, stage=stage))
+    db.commit()
+    db.close()
+    return job_id, pdf_id
+
+
+def restart(queue, env, job_ids, timeout=30):
+    """Start the queue, wait for the given jobs to finish and stop it again"""
+
+    async def run():
+        queue.start()
+        try:
+            for _ in range(int(timeout / 0.05)):
+                db = env.session()
+                statuses = [db.get(IngestionJob, job_id).status for job_id in job_ids]
+                db.close()
+                if all(status in ("completed", "failed") for status in statuses):
+                    return statuses
+                await asyncio.sleep(0.05)
+            raise AssertionError(f"Jobs did not finish: {statuses}")
+        finally:
+            await queue.stop()
+
+    return asyncio.run(run())
+
+
+def test_unfinished_jobs_are_started_over_after_a_restart(isolated_app):
+    env = isolated_app
+    pdf = make_text_pdf(3)
+    expected = upload_and_wait(env, pdf)
+    env.user = "u2"
+    job_id, pdf_id = add_job(env, status="running", pdf=pdf)
+    queued_id, queued_pdf_id = add_job(env, status="queued", stage=None, pdf=make_text_pdf(2, "Chapter"))
+    # Half-written output of the interrupted attempt
+    pdf_routes.retriever.store.write_document(pdf_id, [{"text": "stale", "page_number": 1}] * 2, [[0.0, 0.0, 1.0]] * 2)
+
+    queue = make_queue(env)
+    assert restart(queue, env, [job_id, queued_id]) == ["completed", "completed"]
+    assert queue.stats()["resumed"] == 2
+
+    db = env.session()
+    job = db.get(IngestionJob, job_id)
+    assert job.chunks_total == expected["chunks_total"]
+    assert db.query(PDFChunk).filter(PDFChunk.pdf_id == pdf_id).count() == expected["chunks_total"]
+    assert db.get(PDF, queued_pdf_id) is not None
+    db.close()
+    assert all(chunk["text"] != "stale" for chunk in pdf_routes.retriever.store.iter_chunks(pdf_id))
+    assert (env.pdfs_dir / "u2" / f"{pdf_id}.pdf").read_bytes() == pdf
+    assert list(env.upload_dir.glob("*.pdf")) == []
+
+
+def test_job_interrupted_after_moving_its_upload_reads_the_moved_file(isolated_app):
+    env = isolated_app
+    pdf = make_text_pdf(2)
+    job_id, pdf_id = add_job(env, stage="saving", pdf=None)
+    pdf_path = pdf_routes.pdf_file_path(env.user, pdf_id)
+    pdf_path.write_bytes(pdf)
+
+    assert restart(make_queue(env), env, [job_id]) == ["completed"]
+    db = env.session()
+    assert db.query(PDFChunk).filter(PDFChunk.pdf_id == pdf_id).count() > 0
+    assert db.get(PDF, pdf_id).file_path == str(pdf_path)
+    db.close()
+    assert pdf_path.read_bytes() == pdf
+
+
+def test_job_whose_document_was_saved_is_only_marked_completed(isolated_app):
+    env = isolated_app
+    job_id, pdf_id = add_job(env, stage="saving", pdf=make_text_pdf(2))
+    db = env.session()
+    db.add(PDF(id=pdf_id, user_id=env.user, title="notes.pdf", filename="notes.pdf", file_path="notes.pdf"))
+    db.commit()
+    db.close()
+
+    assert restart(make_queue(env), env, [job_id]) == ["completed"]
+    assert env.embed_calls == []
+
+
+def test_finished_jobs_are_not_resumed(isolated_app):
+    env = isolated_app
+    done_id, _ = add_job(env, status="completed", stage=None)
+    failed_id, _ = add_job(env, status="failed", stage=None)
+
+    queue = make_queue(env)
+    assert restart(queue, env, [done_id, failed_id]) == ["completed", "failed"]
+    assert queue.stats()["resumed"] == 0
+    assert env.embed_calls == []
+
+
+def test_chunks_are_embedded_in_batches_of_the_configured_size(isolated_app):
+    env = isolated_app
+    job_id, pdf_id = add_job(env, status="queued", stage=None, pdf=make_text_pdf(8))
+
+    assert restart(make_queue(env, batch_size=3), env, [job_id]) == ["completed"]
+    db = env.session()
+    job = db.get(IngestionJob, job_id)
+    assert job.pages_total == job.pages_extracted == 8
+    assert job.chunks_embedded == job.chunks_total == sum(env.embed_calls)
+    db.close()
+    assert len(env.embed_calls) > 1
+    assert all(size == 3 for size in env.embed_calls[:-1])
+    assert [chunk["text"] for chunk in pdf_routes.retriever.store.iter_chunks(pdf_id)][0].startswith("Page 1.")
+
+
+def test_failed_extraction_fails_the_job_and_leaves_nothing_behind(isolated_app):
+    env = isolated_app
+    broken_id, broken_pdf_id = add_job(env, status="queued", stage=None, pdf=b"%PDF-1.4 not really a pdf")
+    # A PDF without any text
+    blank = fitz.open()
+    blank.new_page()
+    empty_id, empty_pdf_id = add_job(env, status="queued", stage=None, pdf=blank.tobytes())
+
+    assert restart(make_queue(env), env, [broken_id, empty_id]) == ["failed", "failed"]
+    db = env.session()
+    assert db.get(IngestionJob, broken_id).error
+    assert db.get(IngestionJob, empty_id).error == "No text could be extracted from the PDF"
+    assert db.query(PDF).count() == 0
+    db.close()
+    for pdf_id in (broken_pdf_id, empty_pdf_id):
+        assert not (env.pdfs_dir / pdf_id).exists()
+        assert not pdf_routes.pdf_file_path(env.user, pdf_id).exists()
+    assert list(env.upload_dir.glob("*.pdf")) == []
+
+
+class FakeUpload:
+    """Stands in for UploadFile, recording how much was read per call"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.reads = []
+
+    async def read(self, size=-1):
+        start = sum(self.reads)
+        piece = self.data[start:] if size < 0 else self.data[start:start + size]
+        self.reads.append(len(piece))
+        return piece
+
+
+def test_uploads_are_staged_in_pieces_and_hashed(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "UPLOAD_CHUNK_BYTES", 1000)
+    queue = IngestionQueue(None, None, None, upload_dir=str(tmp_path))
+    data = os.urandom(4500)
+    upload = FakeUpload(data)
+
+    staged = asyncio.run(queue.stage(upload))
+    assert staged.content_hash == hashlib.sha256(data).hexdigest()
+    assert staged.size == 4500
+    assert upload.reads == [1000, 1000, 1000, 1000, 500, 0]
+    assert staged.path.endswith(".part") and Path(staged.path).read_bytes() == data
+
+    queue.discard(staged)
+    assert os.listdir(tmp_path) == []
+    # Discarding twice is harmless
+    queue.discard(staged)
+
+
+def test_oversized_upload_is_rejected_as_soon_as_it_crosses_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "UPLOAD_CHUNK_BYTES", 256 * 1024)
+    queue = IngestionQueue(None, None, None, upload_dir=str(tmp_path), max_upload_mb=1)
+    upload = FakeUpload(b"x" * (10 * 1024 * 1024))
+
+    with pytest.raises(UploadTooLargeError, match="1 MB"):
+        asyncio.run(queue.stage(upload))
+    assert sum(upload.reads) == 1024 * 1024 + 256 * 1024
+    assert os.listdir(tmp_path) == []
+
+    # Exactly at the limit is accepted
+    staged = asyncio.run(queue.stage(FakeUpload(b"x" * (1024 * 1024))))
+    assert staged.size == 1024 * 1024
+
+
+def test_upload_endpoint_rejects_large_files_and_records_the_hash(isolated_app, monkeypatch):
+    env = isolated_app
+    pdf = make_text_pdf(2)
+    monkeypatch.setattr(pdf_routes.ingestion_queue, "max_upload_bytes", len(pdf) - 1)
+
+    response = env.client.post("/api/upload", files={"file": ("notes.pdf", pdf, "application/pdf")})
+    assert response.status_code == 413
+    assert "limit" in response.json()["detail"]
+    assert list(env.upload_dir.iterdir()) == []
+    db = env.session()
+    assert db.query(IngestionJob).count() == 0
+    db.close()
+
+    monkeypatch.setattr(pdf_routes.ingestion_queue, "max_upload_bytes", len(pdf))
+    status = upload_and_wait(env, pdf)
+    assert status["status"] == "completed"
+    db = env.session()
+    assert db.get(IngestionJob, status["job_id"]).content_hash == hashlib.sha256(pdf).hexdigest()
+    db.close()
+
+
+BOUNDARY = "upload-boundary"
+
+
+def multipart_body(*parts):
+    """A multipart/form-data body from (field name, filename or None, data) parts"""
+    body = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+class Body:
+    """Request body delivered in pieces, counting how many were taken"""
+
+    def __init__(self, data: bytes, piece: int):
+        self.pieces = [data[i:i + piece] for i in range(0, len(data), piece)]
+        self.taken = 0
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            self.taken += 1
+            yield piece
+
+
+def file_stream(body: Body, content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+    return MultipartFileStream({"content-type": content_type}, body)
+
+
+def test_multipart_file_is_staged_as_the_body_arrives(tmp_path):
+    queue = IngestionQueue(None, None, None, upload_dir=str(tmp_path))
+    data = os.urandom(300 * 1024)
+    body = Body(multipart_body(("title", None, b"Notes"), ("file", "notes.pdf", data),
+                               ("comment", None, b"z" * 50000)), 5000)
+    upload = file_stream(body)
+
+    async def open_and_stage():
+        filename = await upload.open()
+        assert body.taken == 1
+        return filename, await queue.stage(upload)
+
+    filename, staged = asyncio.run(open_and_stage())
+    assert filename == "notes.pdf"
+    assert Path(staged.path).read_bytes() == data
+    assert staged.content_hash == hashlib.sha256(data).hexdigest()
+    # The rest of the body after the file is left unread
+    assert body.taken < len(body.pieces) - 5
+
+
+def test_oversized_multipart_file_stops_reading_the_body(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "UPLOAD_CHUNK_BYTES", 256 * 1024)
+    queue = IngestionQueue(None, None, None, upload_dir=str(tmp_path), max_upload_mb=1)
+    # Delivered in one piece, as a server may do, and still parsed a slice at a time
+    body = Body(multipart_body(("file", "big.pdf", b"x" * (10 * 1024 * 1024))), 20 * 1024 * 1024)
+    upload = file_stream(body)
+
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(queue.stage(upload))
+    assert 1024 * 1024 < upload.received <= 1024 * 1024 + 2 * 256 * 1024
+    assert os.listdir(tmp_path) == []
+
+
+def test_malformed_multipart_uploads_are_rejected():
+    with pytest.raises(MalformedUploadError, match="multipart/form-data"):
+        file_stream(Body(b"%PDF", 10), content_type="application/pdf")
+    with pytest.raises(MalformedUploadError, match="No 'file'"):
+        asyncio.run(file_stream(Body(multipart_body(("title", None, b"Notes")), 10)).open())
+
+    truncated = multipart_body(("file", "notes.pdf", b"y" * 1000))[:500]
+    with pytest.raises(MalformedUploadError, match="ended before"):
+        asyncio.run(file_stream(Body(truncated, 100)).read())
+
+
+def test_upload_endpoint_rejects_oversized_bodies_before_staging_them(isolated_app, monkeypatch):
+    env = isolated_app
+    monkeypatch.setattr(pdf_routes.ingestion_queue, "max_upload_bytes", 1024 * 1024)
+    streams = []
+
+    def recording_stream(*args, **kwargs):
+        streams.append(MultipartFileStream(*args, **kwargs))
+        return streams[-1]
+
+    monkeypatch.setattr(pdf_routes, "MultipartFileStream", recording_stream)
+    body = multipart_body(("file", "big.pdf", b"x" * (10 * 1024 * 1024)))
+    headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+    # Turned away from its Content-Length without reading the body
+    response = env.client.post("/api/upload", content=body, headers=headers)
+    assert response.status_code == 413
+    assert "limit" in response.json()["detail"]
+    assert streams == []
+
+    # Without a Content-Length, reading stops once the file passes the limit
+    response = env.client.post("/api/upload", content=iter([body]), headers=headers)
+    assert response.status_code == 413
+    assert len(streams) == 1 and streams[0].received < 3 * 1024 * 1024
+
+    assert not env.upload_dir.exists() or list(env.upload_dir.iterdir()) == []
+    db = env.session()
+    assert db.query(IngestionJob).count() == 0
+    db.close()
+
+
+def test_upload_endpoint_requires_a_pdf_file_field(isolated_app):
+    env = isolated_app
+    headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+    response = env.client.post("/api/upload", content=multipart_body(("title", None, b"Notes")), headers=headers)
+    assert response.status_code == 400
+    assert "No 'file'" in response.json()["detail"]
+
+    response = env.client.post("/api/upload", files={"file": ("notes.txt", b"text", "text/plain")})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "File must be a PDF"
+
+
+def test_partial_uploads_left_by_a_crash_are_removed_on_start(tmp_path):
+    queue = IngestionQueue(None, None, None, upload_dir=str(tmp_path))
+    old = time.time() - ingestion.STALE_PARTIAL_UPLOAD_SECONDS - 60
+    for name in ("stale.part", "recent.part", "job.pdf"):
+        (tmp_path / name).write_bytes(b"data")
+    os.utime(tmp_path / "stale.part", (old, old))
+    os.utime(tmp_path / "job.pdf", (old, old))
+
+    queue._remove_stale_partial_uploads()
+    assert sorted(os.listdir(tmp_path)) == ["job.pdf", "recent.part"]
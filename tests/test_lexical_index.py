@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.lexical_index import LexicalIndex, tokenize
+
+
+def test_tokenize_keeps_compounds_and_their_parts():
+    assert tokenize("Error AB-1234 in v2.3.1, see /usr_local") == [
+        "error", "ab-1234", "ab", "1234", "in", "v2.3.1", "v2", "3", "1", "see", "usr_local", "usr", "local"
+    ]
+
+
+def test_tokenize_ignores_punctuation_around_words():
+    assert tokenize("Hello, world! -- (x)") == ["hello", "world", "x"]
+    assert tokenize("") == []
+
+
+def test_compound_token_matches_whole_and_part_queries():
+    index = LexicalIndex.build([
+        "Replace part AB-1234 when the pump fails",
+        "The pump has 1234 moving parts",
+        "Nothing relevant here",
+    ])
+    assert index.search("AB-1234", top_k=3)[0][0] == 0
+    assert {chunk for chunk, _ in index.search("1234", top_k=3)} == {0, 1}
+    assert index.search("ab", top_k=3) == index.search("AB", top_k=3)
+
+
+def test_bm25_prefers_rare_terms_frequent_matches_and_short_chunks():
+    index = LexicalIndex.build([
+        "photosynthesis light light light",
+        "photosynthesis light " + "filler " * 30,
+        "photosynthesis chlorophyll",
+        "photosynthesis",
+    ])
+
+    # More occurrences rank higher, and a long chunk is penalized
+    ranking = [chunk for chunk, _ in index.search("light", top_k=4)]
+    assert ranking == [0, 1]
+
+    # A term in every chunk carries less weight than a rare one
+    scores = dict(index.search("photosynthesis chlorophyll", top_k=4))
+    assert max(scores, key=scores.get) == 2
+    assert scores[3] < scores[2]
+
+    assert index.search("unknown", top_k=4) == []
+    assert len(index.search("photosynthesis", top_k=2)) == 2
+
+
+def test_serialized_index_ranks_the_same():
+    index = LexicalIndex.build(["alpha beta", "beta gamma gamma", "delta"])
+    restored = LexicalIndex.from_dict(index.to_dict())
+    assert restored.search("gamma beta", top_k=3) == index.search("gamma beta", top_k=3)
+    assert LexicalIndex.build([]).search("alpha", top_k=3) == []
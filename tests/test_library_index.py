@@ -0,0 +1,97 @@
+import sys
+import threading
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services import library_index
+from app.services.library_index import LibraryIndex
+
+
+def vectors(count, offset, dimension=8):
+    """Vectors far from those of other offsets, so every search result is unambiguous"""
+    rng = np.random.default_rng(offset)
+    return (rng.random((count, dimension)) + offset * 10).astype(np.float32)
+
+
+def test_search_maps_vector_ids_back_to_chunks(tmp_path):
+    """Results name the PDF and the chunk's position within it"""
+    library = LibraryIndex(str(tmp_path))
+    docs = {"a": vectors(5, 1), "b": vectors(7, 2), "c": vectors(3, 3)}
+    for pdf_id, embeddings in docs.items():
+        assert library.add_document(pdf_id, embeddings)
+
+    for pdf_id, embeddings in docs.items():
+        for chunk in range(len(embeddings)):
+            best_pdf, best_chunk, distance = library.search(embeddings[chunk], top_k=1)[0]
+            assert (best_pdf, best_chunk) == (pdf_id, chunk)
+            assert distance < 1e-4
+
+
+def test_replace_and_remove_document(tmp_path):
+    """Re-adding a PDF replaces its vectors; removing it drops them, and both survive a reload"""
+    library = LibraryIndex(str(tmp_path))
+    library.add_document("a", vectors(5, 1))
+    library.add_document("b", vectors(4, 2))
+
+    replacement = vectors(2, 4)
+    library.add_document("a", replacement)
+    assert library.index.ntotal == 6
+    assert library.search(replacement[1], top_k=1)[0][:2] == ("a", 1)
+    # The old vectors are gone; only the replacement's two chunks are left
+    assert library.documents["a"]["count"] == 2
+    assert all(chunk < 2 for pdf_id, chunk, _ in library.search(vectors(5, 1)[0], top_k=6) if pdf_id == "a")
+
+    assert library.remove_document("b")
+    assert not library.remove_document("b")
+    assert {pdf_id for pdf_id, _, _ in library.search(vectors(4, 2)[0], top_k=10)} == {"a"}
+
+    reloaded = LibraryIndex(str(tmp_path))
+    assert reloaded.documents == library.documents
+    assert reloaded.search(replacement[0], top_k=1)[0][:2] == ("a", 0)
+
+
+def test_add_with_wrong_dimension_is_skipped(tmp_path):
+    library = LibraryIndex(str(tmp_path))
+    library.add_document("a", vectors(3, 1))
+    assert not library.add_document("b", vectors(3, 2, dimension=4))
+    assert "b" not in library.documents
+
+
+def test_ivf_upgrade_runs_in_background_and_keeps_concurrent_changes(tmp_path, monkeypatch):
+    """Training doesn't hold the lock; adds and removals made meanwhile end up in the IVF index"""
+    monkeypatch.setattr(library_index, "IVF_THRESHOLD", 300)
+    training = threading.Event()
+    release = threading.Event()
+    build_ivf = LibraryIndex._build_ivf
+
+    def slow_build(self, vectors, ids):
+        training.set()
+        assert release.wait(10)
+        return build_ivf(self, vectors, ids)
+
+    monkeypatch.setattr(LibraryIndex, "_build_ivf", slow_build)
+    library = LibraryIndex(str(tmp_path))
+    library.add_document("a", vectors(200, 1))
+    library.add_document("b", vectors(150, 2))
+    assert training.wait(10)
+
+    # The library stays usable while the IVF index trains
+    library.add_document("c", vectors(20, 3))
+    assert library.remove_document("a")
+    assert isinstance(library.index, faiss.IndexIDMap2)
+    assert library.search(vectors(20, 3)[4], top_k=1)[0][:2] == ("c", 4)
+
+    release.set()
+    library.wait_for_upgrade(10)
+
+    assert isinstance(library.index, faiss.IndexIVF)
+    assert library.index.ntotal == 170
+    assert library.search(vectors(20, 3)[4], top_k=1)[0][:2] == ("c", 4)
+    assert library.search(vectors(150, 2)[7], top_k=1)[0][:2] == ("b", 7)
+    assert {pdf_id for pdf_id, _, _ in library.search(vectors(200, 1)[0], top_k=20)} <= {"b", "c"}
+    assert isinstance(LibraryIndex(str(tmp_path)).index, faiss.IndexIVF)
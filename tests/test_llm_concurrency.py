@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from openai import AsyncOpenAI
+from app.services.llm import LLMService
+
+
+# Simulated completion latency of the fake server, in seconds
+RESPONSE_DELAY = 0.5
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions endpoint that answers slowly."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(RESPONSE_DELAY)
+        payload = json.dumps({
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "This is a test answer."},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture(scope="module")
+def fake_openai_url():
+    """Run the fake OpenAI server on a free local port"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+
+
+def run_concurrent_answers(base_url: str, num_requests: int, max_concurrency: int) -> float:
+    """Fire concurrent generate_answer calls and return the wall time"""
+    async def run():
+        llm_service = LLMService(
+            model="gpt-4o-mini",
+            llm_client=AsyncOpenAI(api_key="test-key", base_url=base_url, max_retries=0),
+            max_concurrency=max_concurrency,
+            # Cached answers would skip the server and hide the timing being measured
+            cache=None
+        )
+        chunks = [{"text": "Test content", "page_number": 1}]
+        start = time.perf_counter()
+        answers = await asyncio.gather(*[
+            llm_service.generate_answer(f"Question {i}?", chunks) for i in range(num_requests)
+        ])
+        elapsed = time.perf_counter() - start
+        assert answers == ["This is a test answer."] * num_requests
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def test_concurrent_completions_overlap(fake_openai_url):
+    """Concurrent requests should take about one response time, not the sum of them"""
+    elapsed = run_concurrent_answers(fake_openai_url, num_requests=4, max_concurrency=4)
+    assert elapsed < 2 * RESPONSE_DELAY
+
+
+def test_concurrency_limit_is_enforced(fake_openai_url):
+    """With a limit of one, requests should run back to back"""
+    elapsed = run_concurrent_answers(fake_openai_url, num_requests=3, max_concurrency=1)
+    assert elapsed >= 3 * RESPONSE_DELAY * 0.9
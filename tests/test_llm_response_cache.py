@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app.services import cache as cache_module
+from app.services.cache import DiskCache, LRUCache
+from app.services.llm import LLMService
+from app.services.model_capabilities import ModelCapabilities
+from app.services.response_cache import ResponseCache
+
+
+QUESTION = {
+    "question": "What colour is the sky?",
+    "answers": [
+        {"text": "Blue", "is_correct": True},
+        {"text": "Green", "is_correct": False}
+    ],
+    "explanation": "Rayleigh scattering."
+}
+QUIZ_TEXT = json.dumps({"questions": [QUESTION, {**QUESTION, "question": "What colour is grass?"}]})
+
+
+class FakeStream:
+    """Streamed completion delivering a text in fixed-size pieces."""
+
+    def __init__(self, text: str, piece: int = 20):
+        self.pieces = [text[i:i + piece] for i in range(0, len(text), piece)]
+
+        async def aclose():
+            pass
+
+        self.response = SimpleNamespace(aclose=aclose)
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+class FakeCompletions:
+    """Chat completions endpoint that streams one text and answers unstreamed requests with another."""
+
+    def __init__(self, streamed: str, complete: str):
+        self.streamed = streamed
+        self.complete = complete
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if kwargs.get("stream"):
+            return FakeStream(self.streamed)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.complete))],
+            usage=SimpleNamespace(total_tokens=100)
+        )
+
+
+def make_service(streamed: str, complete: str = QUIZ_TEXT):
+    completions = FakeCompletions(streamed, complete)
+    llm_client = SimpleNamespace(api_key="test-key", base_url="http://fake/v1",
+                                 chat=SimpleNamespace(completions=completions))
+    service = LLMService(
+        model="gpt-4o-mini",
+        llm_client=llm_client,
+        cache=ResponseCache(memory=LRUCache(max_bytes=1024 * 1024)),
+        capabilities=ModelCapabilities(path=None)
+    )
+    return service, completions
+
+
+async def collect(service: LLMService):
+    return [question async for question in service.stream_quiz_questions("system", "user")]
+
+
+def test_truncated_stream_is_not_cached():
+    """A stream cut off mid-quiz should not be replayed to later stream or structured requests"""
+    # Cut off inside the second question, after the first one closed
+    truncated = QUIZ_TEXT[:QUIZ_TEXT.index("grass") + 3]
+    service, completions = make_service(truncated)
+
+    async def run():
+        first = await collect(service)
+        second = await collect(service)
+        structured = await service.generate_structured_response("system", "user")
+        return first, second, structured
+
+    first, second, structured = asyncio.run(run())
+
+    assert len(first) == 1
+    # The second stream asked the model again instead of replaying the truncated text
+    assert len(second) == 1
+    assert completions.calls == 3
+    assert "error" not in structured
+    assert len(structured["questions"]) == 2
+
+
+def test_complete_stream_is_cached():
+    """A complete streamed quiz should be served from the cache the next time"""
+    service, completions = make_service(QUIZ_TEXT)
+
+    async def run():
+        return await collect(service), await collect(service), await service.generate_structured_response("system", "user")
+
+    first, second, structured = asyncio.run(run())
+
+    assert len(first) == 2
+    assert [q["question"] for q in second] == [q["question"] for q in first]
+    assert len(structured["questions"]) == 2
+    assert completions.calls == 1
+
+
+CHUNKS = [{"text": "The sky is blue because of Rayleigh scattering.", "page_number": 1}]
+
+
+class Clock:
+    """Controllable replacement for time.time/time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_answers_are_reused_until_they_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    service, completions = make_service(QUIZ_TEXT, complete="Blue.")
+    service.cache = ResponseCache(memory=LRUCache(max_bytes=1024 * 1024, ttl=60))
+
+    assert asyncio.run(service.generate_answer("What colour is the sky?", CHUNKS)) == "Blue."
+    clock.now += 59
+    asyncio.run(service.generate_answer("What colour is the sky?", CHUNKS))
+    assert completions.calls == 1
+
+    clock.now += 2
+    asyncio.run(service.generate_answer("What colour is the sky?", CHUNKS))
+    assert completions.calls == 2
+    assert service.cache.stats()["memory"]["expirations"] == 1
+
+
+def test_least_recently_used_answers_are_evicted():
+    service, completions = make_service(QUIZ_TEXT, complete="An answer of a fixed length.")
+    # Room for two answers
+    service.cache = ResponseCache(memory=LRUCache(max_bytes=200, sizeof=lambda entry: len(entry["text"]) + 64))
+
+    async def ask(question):
+        return await service.generate_answer(question, CHUNKS)
+
+    for question in ("First?", "Second?", "First?", "Third?"):
+        asyncio.run(ask(question))
+    assert completions.calls == 3
+
+    # "Second?" was least recently used when "Third?" was stored
+    asyncio.run(ask("First?"))
+    assert completions.calls == 3
+    asyncio.run(ask("Second?"))
+    assert completions.calls == 4
+    assert service.cache.stats()["memory"]["evictions"] >= 1
+
+
+def test_use_cache_false_neither_reads_nor_writes():
+    service, completions = make_service(QUIZ_TEXT, complete="Blue.")
+
+    async def run():
+        await service.generate_answer("What colour is the sky?", CHUNKS, use_cache=False)
+        await service.generate_answer("What colour is the sky?", CHUNKS)
+        await service.generate_answer("What colour is the sky?", CHUNKS, use_cache=False)
+        await service.generate_answer("What colour is the sky?", CHUNKS)
+
+    asyncio.run(run())
+    # The first opted-out call stored nothing and the last opted-out call skipped the stored answer
+    assert completions.calls == 3
+    assert service.cache.stats()["hits"] == 1
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    service, completions = make_service(QUIZ_TEXT, complete="Blue.")
+    service.cache = ResponseCache(disk=DiskCache(path, max_bytes=1024 * 1024))
+    asyncio.run(service.generate_answer("What colour is the sky?", CHUNKS))
+
+    # As after a restart: a new memory tier in front of the same file
+    restarted = ResponseCache(memory=LRUCache(max_bytes=1024 * 1024), disk=DiskCache(path, max_bytes=1024 * 1024))
+    service.cache = restarted
+    assert asyncio.run(service.generate_answer("What colour is the sky?", CHUNKS)) == "Blue."
+    assert completions.calls == 1
+    # The hit was promoted to memory
+    assert restarted.memory.stats()["entries"] == 1
+
+
+def test_metrics_report_tokens_saved(isolated_app, monkeypatch):
+    from app.routes import pdf_routes
+
+    service, completions = make_service(QUIZ_TEXT, complete="Blue.")
+    monkeypatch.setattr(pdf_routes, "response_cache", service.cache)
+
+    async def run():
+        for _ in range(3):
+            await service.generate_answer("What colour is the sky?", CHUNKS)
+
+    asyncio.run(run())
+    stats = isolated_app.client.get("/api/metrics").json()["llm_response_cache"]
+    # Each hit saved the 100 tokens the original completion used
+    assert stats["hits"] == 2 and stats["misses"] == 1
+    assert stats["saved_tokens"] == 200
+    assert stats["hit_rate"] == 2 / 3
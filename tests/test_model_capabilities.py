@@ -0,0 +1,77 @@
+import os
+import sys
+from pathlib import Path
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app.services.llm import _reported_max_tokens
+from app.services.model_capabilities import ModelCapabilities
+
+
+def error(message: str) -> Exception:
+    """An error whose text is formatted the way the OpenAI client formats a 400 response"""
+    return Exception(f"Error code: 400 - {{'error': {{'message': \"{message}\", 'type': 'invalid_request_error', "
+                     f"'param': 'max_tokens', 'code': None}}}}")
+
+
+def test_reads_stated_limits():
+    """Limits stated by the providers' own wording are recognized"""
+    cases = {
+        # OpenAI
+        "max_tokens is too large: 10000. This model supports at most 4096 completion tokens, "
+        "whereas you provided 10000.": 4096,
+        # Groq
+        "`max_tokens` must be less than or equal to `8192`, the maximum value for `max_tokens` "
+        "is less than the `context_window` for this model": 8192,
+        # Anthropic
+        "max_tokens: 10000 > 8192, which is the maximum allowed number of output tokens "
+        "for claude-3-5-sonnet-20240620": 8192,
+        # DeepSeek
+        "Invalid max_tokens value, the valid range of max_tokens is [1, 8192]": 8192,
+    }
+    for message, limit in cases.items():
+        assert _reported_max_tokens(error(message), 10000) == limit, message
+
+
+def test_ignores_numbers_that_are_not_a_stated_limit():
+    """Context sizes, prompt token counts, dates and status codes are not taken for the limit"""
+    messages = [
+        # vLLM: the room left depends on this prompt's length, so it is not the model's limit
+        "'max_tokens' or 'max_completion_tokens' is too large: 4000. This model's maximum context length "
+        "is 4096 tokens and your request has 200 input tokens (4000 > 4096 - 200).",
+        # OpenAI context length error
+        "This model's maximum context length is 8192 tokens. However, you requested 9100 tokens "
+        "(1100 in the messages, 8000 in the completion). Please reduce the length of the messages or completion.",
+        # Together
+        "Input validation error: `inputs` tokens + `max_new_tokens` must be <= 8193. "
+        "Given: 100 `inputs` tokens and 10000 `max_new_tokens`",
+        # A model name with a date, mentioning max_tokens without a limit
+        "Unsupported parameter: 'max_tokens' is not supported with this model (o1-2024-12-17). "
+        "Use 'max_completion_tokens' instead.",
+    ]
+    for message in messages:
+        assert _reported_max_tokens(error(message), 10000) is None, message
+
+
+def test_ignores_limits_not_below_the_request():
+    """A stated limit the request was already within is not a reason to retry"""
+    message = "This model supports at most 4096 completion tokens, whereas you provided 4000."
+    assert _reported_max_tokens(error(message), 4000) is None
+
+
+def test_capabilities_persist_across_instances(tmp_path):
+    """Recorded support and limits are reloaded from the file"""
+    path = str(tmp_path / "capabilities.json")
+    key = ModelCapabilities.key("https://api.example.com/v1/", "model-a")
+    capabilities = ModelCapabilities(path)
+    capabilities.record(key, "json_mode", False)
+    capabilities.record_max_tokens(key, 4096)
+    capabilities.count_fallback(key, "json_mode")
+
+    reloaded = ModelCapabilities(path)
+    assert reloaded.supports(key, "json_mode") is False
+    assert reloaded.supports(key, "streaming") is None
+    assert reloaded.max_tokens(key) == 4096
+    assert reloaded.stats()[key]["fallbacks"] == {"json_mode": 1}
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.pdf_extractor import PDFExtractor
+
+
+def make_pdf(num_pages: int) -> bytes:
+    """Generate a PDF whose pages each name their own page number"""
+    doc = fitz.open()
+    for page_num in range(num_pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {page_num + 1}")
+        # Fill the page so extraction does a realistic amount of work
+        page.insert_textbox(fitz.Rect(72, 100, 540, 760), "The quick brown fox jumps over the lazy dog. " * 60)
+    return doc.tobytes()
+
+
+def test_parallel_extraction_keeps_page_order():
+    """Pages extracted by several processes should come back in document order"""
+    pdf = make_pdf(23)
+    extractor = PDFExtractor(workers=2, pages_per_task=4, parallel_min_pages=0)
+    progress = []
+    try:
+        pages = extractor.extract(pdf, lambda done, total: progress.append((done, total)))
+    finally:
+        extractor.shutdown()
+
+    assert len(pages) == 23
+    assert [page.splitlines()[0] for page in pages] == [f"Page {i + 1}" for i in range(23)]
+    assert pages == PDFExtractor(workers=1).extract(pdf)
+    assert progress[-1] == (23, 23)
+
+
+def benchmark(num_pages: int = 1000, worker_counts=(1, 2, 4, 8)) -> None:
+    """Print extraction throughput for a generated document at several pool sizes"""
+    pdf = make_pdf(num_pages)
+    print(f"{num_pages} pages, {os.cpu_count()} CPUs")
+    for workers in worker_counts:
+        extractor = PDFExtractor(workers=workers, parallel_min_pages=0)
+        try:
+            # Start every worker process first so start-up is not counted
+            if workers > 1:
+                extractor.extract(make_pdf(workers * extractor.pages_per_task))
+            start = time.perf_counter()
+            pages = extractor.extract(pdf)
+            elapsed = time.perf_counter() - start
+        finally:
+            extractor.shutdown()
+        assert len(pages) == num_pages
+        print(f"{workers} workers: {elapsed:.2f}s, {num_pages / elapsed:.0f} pages/s")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,209 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app.database import Base, PooledQuestion
+from app.services.question_pool import QuestionPool
+
+
+def question(text, correct=1):
+    return {
+        "question": text,
+        "answers": [{"text": f"Answer {i}", "is_correct": i < correct} for i in range(3)],
+        "explanation": ""
+    }
+
+
+def distinct_words(number):
+    """Words that no other number shares, so generated questions never look like duplicates"""
+    return " ".join(f"topic{number}part{i}" for i in range(4))
+
+
+class FakeLLM:
+    """Answers every request with distinct questions naming the difficulty, unless scripted"""
+
+    def __init__(self, scripts=None, delay=0.0):
+        self.scripts = list(scripts or [])
+        self.delay = delay
+        self.requests = []
+        self.generated = 0
+
+    def pack_context(self, chunks, budget=None):
+        return SimpleNamespace(chunks=chunks)
+
+    async def generate_structured_response(self, system_prompt, user_prompt, use_cache=True):
+        count, difficulty = system_prompt.split()
+        self.requests.append({"count": int(count), "difficulty": difficulty, "prompt": user_prompt,
+                              "use_cache": use_cache})
+        await asyncio.sleep(self.delay)
+        if self.scripts:
+            return {"questions": self.scripts.pop(0)}
+        self.generated += int(count)
+        return {"questions": [question(f"Which {difficulty} fact {distinct_words(self.generated - i)}?")
+                              for i in range(int(count))]}
+
+
+class FakeRetriever:
+    def get_topic_chunks(self, pdf_id):
+        return [{"text": f"Text of {pdf_id}", "chunk_index": 0, "score": 1.0}]
+
+
+def build_prompts(count, difficulty, text):
+    return f"{count} {difficulty}", text
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def make_pool(session_factory, llm, **settings):
+    settings = {"enabled": True, "difficulties": ["easy", "hard"], "target": 6, "low_water": 3, "batch_size": 4,
+                **settings}
+    return QuestionPool(llm, FakeRetriever(), build_prompts, session_factory=session_factory, **settings)
+
+
+def pooled(session_factory, pdf_id="doc", difficulty=None):
+    db = session_factory()
+    try:
+        query = db.query(PooledQuestion).filter(PooledQuestion.pdf_id == pdf_id)
+        if difficulty:
+            query = query.filter(PooledQuestion.difficulty == difficulty)
+        return [row.question["question"] for row in query.all()]
+    finally:
+        db.close()
+
+
+def test_fill_brings_every_difficulty_up_to_the_target(session_factory):
+    llm = FakeLLM()
+    pool = make_pool(session_factory, llm)
+    asyncio.run(pool._fill("doc"))
+
+    assert len(pooled(session_factory, difficulty="easy")) == 6
+    assert len(pooled(session_factory, difficulty="hard")) == 6
+    # Batches of at most batch_size, never answered from the response cache
+    assert [(request["difficulty"], request["count"]) for request in llm.requests] == [
+        ("easy", 4), ("easy", 2), ("hard", 4), ("hard", 2)]
+    assert not any(request["use_cache"] for request in llm.requests)
+    # Top-ups list the questions already pooled so the model avoids them
+    assert "Do not repeat" not in llm.requests[0]["prompt"]
+    assert f"Which easy fact {distinct_words(4)}?" in llm.requests[1]["prompt"]
+    assert pool.stats()["generated"] == 12
+
+
+def test_fill_skips_duplicate_and_unusable_questions(session_factory):
+    llm = FakeLLM(scripts=[
+        [question("What is chlorophyll?"), question("What is  CHLOROPHYLL"), question("No correct answer?", 0),
+         question("Two correct answers?", 2), question("Where does glucose go?")],
+        [question("What is chlorophyll?"), question("Why are leaves green?"), question("How is light absorbed?")],
+    ])
+    pool = make_pool(session_factory, llm, difficulties=["easy"], target=4)
+    asyncio.run(pool._fill("doc"))
+
+    assert sorted(pooled(session_factory)) == sorted([
+        "What is chlorophyll?", "Where does glucose go?", "Why are leaves green?", "How is light absorbed?"])
+
+
+def test_fill_gives_up_after_one_extra_attempt(session_factory):
+    same = [question("What is chlorophyll?")] * 4
+    llm = FakeLLM(scripts=[same, same, same])
+    pool = make_pool(session_factory, llm, difficulties=["easy"], target=4)
+    asyncio.run(pool._fill("doc"))
+
+    assert pooled(session_factory) == ["What is chlorophyll?"]
+    assert len(llm.requests) == 2
+
+
+def test_draw_takes_questions_out_of_the_pool(session_factory):
+    pool = make_pool(session_factory, FakeLLM(), low_water=0)
+    asyncio.run(pool._fill("doc"))
+
+    async def draw():
+        db = session_factory()
+        try:
+            return pool.draw(db, "doc", "EASY", 4)
+        finally:
+            db.close()
+
+    questions = asyncio.run(draw())
+    assert len(questions) == 4
+    remaining = pooled(session_factory, difficulty="easy")
+    assert len(remaining) == 2
+    assert not set(q["question"] for q in questions) & set(remaining)
+    assert len(pooled(session_factory, difficulty="hard")) == 6
+    assert pool.stats()["served"] == 1
+
+
+def test_drawing_below_the_low_water_mark_refills_in_the_background(session_factory):
+    llm = FakeLLM()
+    pool = make_pool(session_factory, llm)
+    asyncio.run(pool._fill("doc"))
+    llm.requests.clear()
+
+    async def draw_and_wait():
+        db = session_factory()
+        try:
+            questions = pool.draw(db, "doc", "easy", 4)
+        finally:
+            db.close()
+        task = pool._tasks["doc"]
+        await task
+        return questions
+
+    assert len(asyncio.run(draw_and_wait())) == 4
+    assert len(pooled(session_factory, difficulty="easy")) == 6
+    assert [(request["difficulty"], request["count"]) for request in llm.requests] == [("easy", 4)]
+    assert pool.stats()["filling"] == 0
+
+
+def test_too_few_pooled_questions_is_a_miss_that_starts_a_fill(session_factory):
+    pool = make_pool(session_factory, FakeLLM(delay=10))
+
+    async def draw():
+        db = session_factory()
+        try:
+            result = pool.draw(db, "doc", "hard", 3)
+        finally:
+            db.close()
+        task = pool._tasks.get("doc")
+        # Asking again while the fill runs doesn't start another one
+        pool.schedule_fill("doc")
+        assert pool._tasks.get("doc") is task
+        pool.cancel("doc")
+        await asyncio.sleep(0)
+        return result, task
+
+    result, task = asyncio.run(draw())
+    assert result is None
+    assert task is not None and task.cancelled()
+    assert pool.stats()["misses"] == 1
+    assert pool.stats()["filling"] == 0
+
+
+def test_disabled_pool_never_serves_or_fills(session_factory):
+    pool = make_pool(session_factory, FakeLLM(), enabled=False)
+
+    async def draw():
+        db = session_factory()
+        try:
+            result = pool.draw(db, "doc", "easy", 1)
+        finally:
+            db.close()
+        pool.schedule_fill("doc")
+        return result
+
+    assert asyncio.run(draw()) is None
+    assert pool._tasks == {}
+    assert pool.stats()["misses"] == 0
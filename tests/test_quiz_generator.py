@@ -0,0 +1,158 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app.services import quiz_generator
+from app.services.context_packer import pack_context
+from app.services.quiz_generator import QuizGenerator, is_duplicate_question, question_words
+
+
+def question(text):
+    return {
+        "question": text,
+        "answers": [{"text": "Yes", "is_correct": True}, {"text": "No", "is_correct": False}],
+        "explanation": ""
+    }
+
+
+class FakeLLM:
+    """
+    Writes questions about each section without a model.
+
+    `scripts` maps a section's first word to the questions it returns; other
+    sections get distinct questions naming the section.
+    """
+
+    model = "gpt-4o"
+    context_budget = 8000
+
+    def __init__(self, scripts=None, fail=()):
+        self.scripts = scripts or {}
+        self.fail = set(fail)
+        self.requests = []
+        self.started = []
+        self.finished = []
+
+    def pack_context(self, chunks, budget=None):
+        return pack_context(chunks, budget or self.context_budget, self.model)
+
+    async def stream_quiz_questions(self, system_prompt, user_prompt, use_cache=True):
+        count = int(system_prompt)
+        section = user_prompt.split()[0]
+        self.requests.append((section, count))
+        self.started.append(section)
+        if section in self.fail:
+            raise ValueError(f"section {section} failed")
+        questions = self.scripts.get(section) or [f"What does {section} explain about topic {i}?" for i in range(count)]
+        for text in questions:
+            await asyncio.sleep(0)
+            yield question(text)
+        self.finished.append(section)
+
+
+def build_prompts(count, text):
+    return str(count), text
+
+
+def chunks_for(sections, per_section=2, words=50):
+    """Chunks whose sections start with the given labels, each section the same size"""
+    return [
+        {"text": f"{label} " + " ".join(f"{label}word{i}" for i in range(words)), "chunk_index": n}
+        for n, label in enumerate(label for label in sections for _ in range(per_section))
+    ]
+
+
+def make_generator(llm, max_sections=4, section_tokens=60):
+    """A generator splitting chunks_for documents into max_sections sections (fewer for short quizzes)"""
+    return QuizGenerator(llm, max_concurrency=4, section_tokens=section_tokens, max_sections=max_sections)
+
+
+def test_sections_are_consecutive_and_evenly_sized():
+    generator = make_generator(FakeLLM(), max_sections=4, section_tokens=1)
+    chunks = chunks_for(["a", "b", "c", "d"])
+
+    sections = generator.split_sections(chunks, num_questions=10)
+    assert [[chunk["chunk_index"] for chunk in section] for section in sections] == [[0, 1], [2, 3], [4, 5], [6, 7]]
+
+    # Never more sections than questions or than max_sections
+    assert len(generator.split_sections(chunks, num_questions=3)) == 3
+    assert len(make_generator(FakeLLM(), max_sections=2, section_tokens=1).split_sections(chunks, 10)) == 2
+    # A short document is one section
+    assert len(make_generator(FakeLLM(), section_tokens=100000).split_sections(chunks, 10)) == 1
+
+
+def test_quotas_add_up_and_spread_the_remainder():
+    assert QuizGenerator._quotas(4, 8) == [2, 2, 2, 2]
+    assert QuizGenerator._quotas(4, 6) == [1, 2, 1, 2]
+    assert QuizGenerator._quotas(3, 10) == [3, 4, 3]
+    for sections in range(1, 9):
+        for questions in range(sections, 30):
+            quotas = QuizGenerator._quotas(sections, questions)
+            assert sum(quotas) == questions
+            assert max(quotas) - min(quotas) <= 1
+
+
+def test_duplicate_detection_uses_word_overlap():
+    seen = [question_words(question("What is the capital of France?"))]
+    assert is_duplicate_question(question_words(question("what is the CAPITAL of france")), seen)
+    assert not is_duplicate_question(question_words(question("What is the capital of Spain?")), seen)
+    assert not is_duplicate_question(question_words(question("")), [])
+
+
+def test_every_section_gets_its_quota_in_document_order():
+    llm = FakeLLM()
+    questions = asyncio.run(make_generator(llm).generate(chunks_for(["a", "b", "c", "d"]), 8, build_prompts))
+
+    assert [q["question"].split()[2] for q in questions] == ["a", "a", "b", "b", "c", "c", "d", "d"]
+    # Each section is asked for its quota plus a spare
+    assert sorted(llm.requests) == [("a", 3), ("b", 3), ("c", 3), ("d", 3)]
+
+
+def test_duplicates_across_sections_are_replaced_by_spares():
+    repeated = "What is photosynthesis?"
+    llm = FakeLLM(scripts={
+        "a": [repeated, "How do leaves absorb light?", "What is chlorophyll?"],
+        "b": ["What is  PHOTOSYNTHESIS", "Where does glucose go?", "Why are plants green?"],
+    })
+    questions = asyncio.run(make_generator(llm, max_sections=2).generate(chunks_for(["a", "b"]), 4, build_prompts))
+    texts = [q["question"] for q in questions]
+
+    assert len(texts) == 4
+    assert sum(1 for text in texts if "photosynthesis" in text.lower()) == 1
+    assert len({frozenset(question_words(q)) for q in questions}) == 4
+
+
+def test_failed_section_is_made_up_from_other_sections_spares():
+    llm = FakeLLM(fail={"b"})
+    questions = asyncio.run(make_generator(llm).generate(chunks_for(["a", "b", "c"]), 3, build_prompts))
+
+    sections = [q["question"].split()[2] for q in questions]
+    assert len(questions) == 3
+    assert "b" not in sections
+    assert sorted(sections) in (["a", "a", "c"], ["a", "c", "c"])
+
+
+def test_streaming_stops_remaining_sections_once_the_quiz_is_full():
+    llm = FakeLLM()
+    generator = make_generator(llm)
+    generator.max_concurrency = 1
+
+    async def take_all():
+        return [q async for q in generator.stream(chunks_for(["a", "b", "c", "d"]), 2, build_prompts)]
+
+    questions = asyncio.run(take_all())
+    assert len(questions) == 2
+    # Two sections were needed; the rest were cancelled before they started
+    assert len(llm.started) == 2
+
+
+def test_spare_count_follows_setting(monkeypatch):
+    monkeypatch.setattr(quiz_generator, "QUIZ_SPARE_QUESTIONS", 0)
+    llm = FakeLLM()
+    asyncio.run(make_generator(llm, max_sections=2).generate(chunks_for(["a", "b"]), 4, build_prompts))
+    assert sorted(llm.requests) == [("a", 2), ("b", 2)]
@@ -0,0 +1,50 @@
+from conftest import make_text_pdf, parse_events, upload_and_wait
+
+from app.database import Quiz
+from app.routes import quiz_routes
+
+
+class FakeStreamingQuizGenerator:
+    """Quiz generator that streams one question per chunk, without a model"""
+
+    async def stream(self, chunks, num_questions, build_prompts, use_cache=True):
+        for i, chunk in enumerate(chunks[:num_questions]):
+            yield {
+                "question": f"What does chunk {i + 1} say?",
+                "answers": [{"text": "Something", "is_correct": True}, {"text": "Nothing", "is_correct": False}],
+                "explanation": chunk["text"][:40]
+            }
+
+
+def test_streamed_quiz_is_stored(isolated_app, monkeypatch):
+    """The quiz ID sent when the stream finishes should refer to a stored quiz"""
+    env = isolated_app
+    monkeypatch.setattr(quiz_routes, "quiz_generator", FakeStreamingQuizGenerator())
+    pdf_id = upload_and_wait(env, make_text_pdf(3))["pdf_id"]
+
+    response = env.client.post("/api/generate/stream", json={"pdf_id": pdf_id, "num_questions": 2})
+    assert response.status_code == 200
+    events = parse_events(response.text)
+    assert [event for event, _ in events] == ["question", "question", "done"]
+
+    done = events[-1][1]
+    db = env.session()
+    quiz = db.get(Quiz, done["quiz_id"])
+    assert quiz is not None
+    assert quiz.user_id == "u1" and quiz.pdf_id == pdf_id
+    assert quiz.questions["questions"] == [data["question"] for event, data in events[:-1]]
+    db.close()
+
+
+def test_stream_requires_owning_the_pdf(isolated_app, monkeypatch):
+    """Another user's PDF should not be streamed from"""
+    env = isolated_app
+    monkeypatch.setattr(quiz_routes, "quiz_generator", FakeStreamingQuizGenerator())
+    pdf_id = upload_and_wait(env, make_text_pdf(2))["pdf_id"]
+
+    env.user = "u2"
+    response = env.client.post("/api/generate/stream", json={"pdf_id": pdf_id, "num_questions": 2})
+    assert response.status_code == 404
+    db = env.session()
+    assert db.query(Quiz).count() == 0
+    db.close()
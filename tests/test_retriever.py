@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from conftest import make_text_pdf, upload_and_wait
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app.services import document_store, retriever as retriever_module
+from app.services.cache import LRUCache
+from app.services.document_store import DocumentStore, LEGACY_CHUNKS_FILENAME
+from app.services.retriever import Retriever
+
+
+def make_retriever(tmp_path):
+    retriever = Retriever(embedding_service=object(), resolve_storage=lambda pdf_id: pdf_id)
+    retriever.pdfs_dir = str(tmp_path)
+    retriever.store = DocumentStore(str(tmp_path))
+    retriever.libraries_dir = str(tmp_path / "libraries")
+    return retriever
+
+
+def write_document(retriever, pdf_id, texts, dimension=8):
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((len(texts), dimension), dtype=np.float32)
+    chunks = [{"text": text, "page": i + 1} for i, text in enumerate(texts)]
+    retriever.store.write_document(pdf_id, chunks, embeddings)
+    return embeddings
+
+
+def test_loaded_document_counts_index_copy_of_vectors_only(tmp_path):
+    """Memory-mapped embeddings are not counted against the cache budget, the FAISS copy is"""
+    retriever = make_retriever(tmp_path)
+    texts = [f"chunk {i}" for i in range(50)]
+    write_document(retriever, "doc", texts, dimension=64)
+
+    document = retriever.load_document("doc")
+    try:
+        assert isinstance(document.embeddings, np.memmap)
+        vector_bytes = 50 * 64 * 4
+        text_bytes = sum(len(text) for text in texts) + 200 * len(texts)
+        assert document.nbytes == text_bytes + vector_bytes + document.lexical.nbytes
+    finally:
+        retriever.delete_document("doc")
+
+
+def count_rebuilds(retriever, monkeypatch):
+    rebuilt = []
+    rebuild_index = retriever.store.rebuild_index
+
+    def counting_rebuild(pdf_id):
+        rebuilt.append(pdf_id)
+        return rebuild_index(pdf_id)
+
+    monkeypatch.setattr(retriever.store, "rebuild_index", counting_rebuild)
+    return rebuilt
+
+
+def vector_search(retriever, pdf_id, query_embedding):
+    results = asyncio.run(retriever.search("query", pdf_id, top_k=5, query_embedding=query_embedding))
+    return [(chunk["chunk_index"], chunk["score"]) for chunk in results]
+
+
+def test_persisted_index_is_reused_and_rebuilt_when_stale(tmp_path, monkeypatch):
+    """The saved index answers searches in a fresh worker; outdated or mismatched ones are rebuilt"""
+    retriever = make_retriever(tmp_path)
+    rebuilt = count_rebuilds(retriever, monkeypatch)
+    embeddings = write_document(retriever, "doc", [f"chunk {i}" for i in range(30)])
+    query = embeddings[7].tolist()
+    try:
+        expected = vector_search(retriever, "doc", query)
+        assert expected[0][0] == 7
+        assert rebuilt == ["doc"]
+
+        retriever.invalidate("doc")
+        assert vector_search(retriever, "doc", query) == expected
+        assert rebuilt == ["doc"]
+
+        monkeypatch.setattr(document_store, "INDEX_FORMAT_VERSION", document_store.INDEX_FORMAT_VERSION + 1)
+        retriever.invalidate("doc")
+        assert vector_search(retriever, "doc", query) == expected
+        assert rebuilt == ["doc", "doc"]
+        assert retriever.store.read_info("doc")["index"]["format_version"] == document_store.INDEX_FORMAT_VERSION
+
+        # Re-written with more chunks, leaving the index of the old ones behind
+        more = write_document(retriever, "doc", [f"chunk {i}" for i in range(40)])
+        retriever.invalidate("doc")
+        document = retriever.load_document("doc")
+        assert document.index.ntotal == 40
+        assert rebuilt == ["doc", "doc", "doc"]
+        assert vector_search(retriever, "doc", more[35].tolist())[0][0] == 35
+    finally:
+        retriever.delete_document("doc")
+
+
+def test_converted_legacy_directory_gets_an_index_on_first_load(tmp_path, monkeypatch):
+    """Documents stored before indexes were persisted have theirs built once, then read from disk"""
+    retriever = make_retriever(tmp_path)
+    rebuilt = count_rebuilds(retriever, monkeypatch)
+    pdf_dir = tmp_path / "doc"
+    pdf_dir.mkdir()
+    rng = np.random.default_rng(0)
+    legacy_chunks = [{"text": f"chunk {i}", "page": i + 1, "embedding": rng.random(8).tolist()} for i in range(12)]
+    (pdf_dir / LEGACY_CHUNKS_FILENAME).write_text(json.dumps(legacy_chunks))
+    try:
+        assert retriever.store.convert_all() == 1
+        assert "index" not in retriever.store.read_info("doc")
+
+        assert vector_search(retriever, "doc", legacy_chunks[4]["embedding"])[0][0] == 4
+        assert rebuilt == ["doc"]
+        assert retriever.store.read_info("doc")["index"]["ntotal"] == 12
+
+        retriever.invalidate("doc")
+        assert vector_search(retriever, "doc", legacy_chunks[4]["embedding"])[0][0] == 4
+        assert rebuilt == ["doc"]
+    finally:
+        retriever.delete_document("doc")
+
+
+def test_library_indexes_are_kept_apart_from_pdf_storage(tmp_path):
+    """A user's library lives under its own root, and one saved beside their PDFs is moved there"""
+    retriever = make_retriever(tmp_path / "pdfs")
+    retriever.libraries_dir = str(tmp_path / "libraries")
+    write_document(retriever, "doc", ["alpha", "beta", "gamma"])
+    try:
+        assert retriever.add_to_library("u1", "doc")
+        assert sorted(os.listdir(tmp_path / "libraries" / "u1")) == ["library.faiss", "library.json"]
+        assert sorted(os.listdir(tmp_path / "pdfs")) == ["doc"]
+
+        # As an earlier version left it
+        legacy_dir = tmp_path / "pdfs" / "u2"
+        legacy_dir.mkdir()
+        for name in ("library.faiss", "library.json"):
+            (legacy_dir / name).write_bytes((tmp_path / "libraries" / "u1" / name).read_bytes())
+        library = retriever._get_library("u2")
+        assert set(library.documents) == {"doc"}
+        assert os.listdir(legacy_dir) == []
+        assert sorted(os.listdir(tmp_path / "libraries" / "u2")) == ["library.faiss", "library.json"]
+    finally:
+        retriever.delete_document("doc")
+
+
+def test_reciprocal_rank_fusion_rewards_agreement(tmp_path):
+    """Chunks ranked by both methods beat chunks ranked high by only one; scores are ignored"""
+    retriever = make_retriever(tmp_path)
+    vector = [(1, 0.9), (2, 0.8), (3, 0.7)]
+    lexical = [(3, 40.0), (4, 30.0), (1, 1.0)]
+
+    fused = retriever._reciprocal_rank_fusion([vector, lexical], top_k=10)
+
+    assert [idx for idx, _ in fused] == [1, 3, 2, 4]
+    assert fused[0][1] == 1 / 61 + 1 / 63
+    assert fused[2][1] == 1 / 62
+    assert retriever._reciprocal_rank_fusion([vector, lexical], top_k=2) == fused[:2]
+    assert retriever._reciprocal_rank_fusion([], top_k=3) == []
+
+
+class FixedEmbedding:
+    def __init__(self, embedding):
+        self.embedding = embedding
+
+    async def create_single_embedding(self, text):
+        return self.embedding
+
+
+def test_hybrid_search_fuses_vector_and_keyword_rankings(tmp_path):
+    """A chunk matching the query both by meaning and by keyword comes first in hybrid mode"""
+    retriever = make_retriever(tmp_path)
+    texts = [
+        "The pump failed with error AB-1234.",
+        "General maintenance schedule for pumps.",
+        "Error AB-1234 appears when the valve is closed.",
+        "Unrelated text about lunch.",
+    ]
+    embeddings = np.array([[1, 0], [0.9, 0.1], [0.8, 0.2], [0, 1]], dtype=np.float32)
+    retriever.store.write_document("doc", [{"text": text} for text in texts], embeddings)
+    retriever.embedding_service = FixedEmbedding([0.95, 0.05])
+
+    try:
+        vector = asyncio.run(retriever.search("AB-1234 valve", "doc", top_k=2, mode="vector"))
+        lexical = asyncio.run(retriever.search("AB-1234 valve", "doc", top_k=2, mode="lexical"))
+        hybrid = asyncio.run(retriever.search("AB-1234 valve", "doc", top_k=2, mode="hybrid"))
+    finally:
+        retriever.delete_document("doc")
+
+    assert [chunk["chunk_index"] for chunk in vector] == [0, 1]
+    assert [chunk["chunk_index"] for chunk in lexical] == [2, 0]
+    assert [chunk["chunk_index"] for chunk in hybrid] == [0, 2]
+    assert hybrid[0]["text"] == texts[0]
+
+
+class RecordingEmbedder:
+    """Embeds each batch after a delay, recording when batches start and how many overlap"""
+
+    def __init__(self, events, delays):
+        self.events = events
+        self.delays = delays
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create_embeddings(self, texts, progress_callback=None):
+        batch = int(texts[0].split()[1])
+        self.events.append(("embedding", batch))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(batch, 0))
+        finally:
+            self.in_flight -= 1
+        return [[float(batch), float(i), 1.0] for i in range(len(texts))]
+
+
+def test_batches_are_embedded_while_later_ones_are_produced(tmp_path, monkeypatch):
+    """Embedding overlaps production, in-flight batches are capped, and chunks are stored in document order"""
+    monkeypatch.setattr(retriever_module, "EMBEDDING_BATCHES_IN_FLIGHT", 2)
+    retriever = make_retriever(tmp_path)
+    events = []
+    # The first batch is the slowest, so later ones finish before it
+    retriever.embedding_service = RecordingEmbedder(events, delays={0: 0.05, 1: 0.02})
+    progress = []
+
+    async def batches():
+        for batch in range(6):
+            events.append(("produced", batch))
+            yield [{"text": f"batch {batch} chunk {i}"} for i in range(3)]
+            await asyncio.sleep(0.005)
+
+    try:
+        asyncio.run(retriever.add_document_batches(batches(), pdf_id="doc",
+                                                   progress_callback=lambda done, total: progress.append(done)))
+
+        assert events.index(("embedding", 0)) < events.index(("produced", 2))
+        assert retriever.embedding_service.max_in_flight == 2
+        assert [chunk["text"] for chunk in retriever.store.iter_chunks("doc")] == [
+            f"batch {batch} chunk {i}" for batch in range(6) for i in range(3)]
+        assert retriever.store.read_embeddings("doc")[:, 0].tolist() == [float(b) for b in range(6) for _ in range(3)]
+        assert progress == sorted(progress) and progress[-1] == 18
+    finally:
+        retriever.delete_document("doc")
+
+
+def test_failed_production_leaves_no_document(tmp_path):
+    retriever = make_retriever(tmp_path)
+    events = []
+    retriever.embedding_service = RecordingEmbedder(events, delays={1: 10})
+
+    async def batches():
+        for batch in range(2):
+            yield [{"text": f"batch {batch} chunk 0"}]
+            await asyncio.sleep(0.01)
+        raise ValueError("page 3 could not be read")
+
+    async def run():
+        with pytest.raises(ValueError, match="page 3"):
+            await asyncio.wait_for(retriever.add_document_batches(batches(), pdf_id="doc"), timeout=2)
+        # The slow batch still in flight was cancelled
+        await asyncio.sleep(0)
+        return retriever.embedding_service.in_flight
+
+    assert asyncio.run(run()) == 0
+    assert list(retriever.store.iter_chunks("doc")) == []
+    assert retriever.load_document("doc") is None
+
+
+class TextEmbedder:
+    """Embeds each text as a small vector derived from its content"""
+
+    async def create_embeddings(self, texts, progress_callback=None):
+        return [[float(len(text)), float(sum(map(ord, text)) % 31), 1.0] for text in texts]
+
+
+def add_document(retriever, pdf_id, texts):
+    async def batches():
+        yield [{"text": text, "page_number": 1} for text in texts]
+
+    return asyncio.run(retriever.add_document_batches(batches(), pdf_id=pdf_id))
+
+
+def test_document_cache_counts_hits_misses_and_evictions_within_budget(tmp_path, monkeypatch):
+    retriever = make_retriever(tmp_path)
+    for pdf_id in "abc":
+        write_document(retriever, pdf_id, [f"{pdf_id} chunk {i}" for i in range(20)])
+    size = retriever.load_document("a").nbytes
+    # Room for two documents of this size
+    cache = LRUCache(max_bytes=size * 2 + size // 2, sizeof=lambda document: document.nbytes)
+    monkeypatch.setattr(retriever_module, "document_cache", cache)
+
+    first = retriever.load_document("a")
+    assert retriever.load_document("a") is first
+    retriever.load_document("b")
+    retriever.load_document("c")
+    assert cache.stats() == {**cache.stats(), "hits": 1, "misses": 3, "evictions": 1, "entries": 2,
+                             "bytes": size * 2}
+    # "a" was least recently used, so "b" is still cached and "a" is loaded again
+    retriever.load_document("b")
+    assert retriever.load_document("a") is not first
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 4
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_re_ingesting_or_deleting_a_document_drops_the_cached_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(retriever_module, "document_cache", LRUCache(max_bytes=1024 * 1024,
+                                                                      sizeof=lambda document: document.nbytes))
+    retriever = make_retriever(tmp_path)
+    retriever.embedding_service = TextEmbedder()
+
+    add_document(retriever, "doc", ["first version"])
+    assert [chunk["text"] for chunk in retriever.load_document("doc").chunks] == ["first version"]
+
+    add_document(retriever, "doc", ["second version", "with two chunks"])
+    assert [chunk["text"] for chunk in retriever.load_document("doc").chunks] == ["second version", "with two chunks"]
+
+    retriever.delete_document("doc")
+    assert retriever.load_document("doc") is None
+    assert retriever_module.document_cache.stats()["entries"] == 0
+
+
+def test_library_cache_tracks_library_sizes(tmp_path, monkeypatch):
+    cache = LRUCache(max_bytes=1024 * 1024, sizeof=lambda library: library.nbytes)
+    monkeypatch.setattr(retriever_module, "library_cache", cache)
+    retriever = make_retriever(tmp_path)
+    write_document(retriever, "a", [f"a{i}" for i in range(10)])
+    write_document(retriever, "b", [f"b{i}" for i in range(30)])
+
+    retriever.add_to_library("u1", "a")
+    retriever.add_to_library("u1", "b")
+    retriever.add_to_library("u2", "b")
+    per_vector = 8 * 4 + 8
+    assert cache.stats()["bytes"] == (40 + 30) * per_vector
+    assert cache.stats()["entries"] == 2
+
+    assert retriever.remove_from_library("u1", "b")
+    assert cache.stats()["bytes"] == (10 + 30) * per_vector
+    assert not retriever.remove_from_library("u1", "b")
+
+
+def test_deleting_a_pdf_clears_it_from_the_caches(isolated_app):
+    env = isolated_app
+    from app.routes import pdf_routes
+
+    retriever = pdf_routes.retriever
+    pdf_id = upload_and_wait(env, make_text_pdf(3))["pdf_id"]
+    assert retriever.load_document(pdf_id) is not None
+    assert set(retriever._get_library("u1").documents) == {pdf_id}
+
+    assert env.client.delete(f"/api/pdf/{pdf_id}").status_code == 200
+    assert retriever_module.document_cache.get(retriever._cache_key(pdf_id)) is None
+    assert retriever.load_document(pdf_id) is None
+    assert retriever._get_library("u1").documents == {}
@@ -0,0 +1,102 @@
+import asyncio
+import uuid
+
+from conftest import make_text_pdf, upload_and_wait
+
+from app.database import Conversation, Message
+from app.routes import pdf_routes
+from app.services.semantic_cache import SemanticAnswerCache
+
+
+def test_lookup_respects_threshold():
+    """Only a question within the similarity threshold gets the earlier answer back"""
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.add("doc", "What is photosynthesis?", [1.0, 0.0, 0.0], "Turning light into energy", [{"text": "chunk"}])
+
+    hit = cache.lookup("doc", [0.99, 0.1, 0.0])
+    assert hit is not None
+    cached, similarity = hit
+    assert cached.answer == "Turning light into energy"
+    assert cached.sources == [{"text": "chunk"}]
+    assert similarity >= 0.9
+
+    assert cache.lookup("doc", [0.5, 0.85, 0.0]) is None
+    # Answers are kept per document
+    assert cache.lookup("other", [1.0, 0.0, 0.0]) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_seed_loads_history_without_replacing_answers():
+    """Seeded answers are looked up like added ones, but don't replace answers given since"""
+    cache = SemanticAnswerCache(threshold=0.9, max_entries=2)
+    assert not cache.is_seeded("doc")
+    cache.add("doc", "What is a leaf?", [0.0, 1.0, 0.0], "Fresh answer", [{"text": "chunk"}])
+
+    cache.seed("doc", [
+        ("Oldest question", [0.0, 0.0, 1.0], "Dropped"),
+        ("what is a  LEAF?", [0.0, 1.0, 0.0], "Stale answer"),
+        ("What is a root?", [1.0, 0.0, 0.0], "Underground"),
+    ])
+
+    assert cache.is_seeded("doc")
+    assert cache.lookup("doc", [0.0, 1.0, 0.0])[0].answer == "Fresh answer"
+    seeded, _ = cache.lookup("doc", [1.0, 0.0, 0.0])
+    assert seeded.answer == "Underground"
+    assert seeded.sources is None
+    # Only the most recent max_entries items are loaded
+    assert cache.lookup("doc", [0.0, 0.0, 1.0]) is None
+
+
+def add_conversations(env, pdf_id, count):
+    db = env.session()
+    for i in range(count):
+        conversation = Conversation(id=str(uuid.uuid4()), pdf_id=pdf_id, user_id=env.user)
+        db.add(conversation)
+        db.flush()
+        db.add(Message(conversation_id=conversation.id, is_user=True, content=f"Question {i}?"))
+        db.add(Message(conversation_id=conversation.id, is_user=False, content=f"Answer {i}"))
+        db.commit()
+    db.close()
+
+
+def test_seeding_runs_in_background_and_is_capped(isolated_app, monkeypatch):
+    """Seeding embeds only the most recent questions, once, outside the request"""
+    env = isolated_app
+    monkeypatch.setattr(pdf_routes, "SessionLocal", env.session)
+    monkeypatch.setattr(pdf_routes, "SEMANTIC_CACHE_SEED_LIMIT", 3)
+    monkeypatch.setattr(pdf_routes, "semantic_cache", SemanticAnswerCache(threshold=0.99))
+    pdf_id = upload_and_wait(env, make_text_pdf(2))["pdf_id"]
+    add_conversations(env, pdf_id, 5)
+    env.embed_calls.clear()
+
+    async def schedule_twice():
+        pdf_routes.schedule_semantic_cache_seed(pdf_id)
+        pdf_routes.schedule_semantic_cache_seed(pdf_id)
+        assert not pdf_routes.semantic_cache.is_seeded(pdf_id)
+        await asyncio.gather(*pdf_routes.semantic_cache_seed_tasks.values())
+
+    asyncio.run(schedule_twice())
+
+    assert pdf_routes.semantic_cache.is_seeded(pdf_id)
+    assert env.embed_calls == [3]
+    assert pdf_routes.semantic_cache.stats()["entries"] == 3
+    assert pdf_routes.semantic_cache_seed_tasks == {}
+
+
+def test_deleting_pdf_invalidates_answers(isolated_app, monkeypatch):
+    """A deleted PDF's cached answers are dropped, and other documents' answers are kept"""
+    env = isolated_app
+    cache = SemanticAnswerCache(threshold=0.9)
+    monkeypatch.setattr(pdf_routes, "semantic_cache", cache)
+    deleted = upload_and_wait(env, make_text_pdf(2))["pdf_id"]
+    kept = upload_and_wait(env, make_text_pdf(3), filename="other.pdf")["pdf_id"]
+    for pdf_id in (deleted, kept):
+        cache.seed(pdf_id, [])
+        cache.add(pdf_id, "What is photosynthesis?", [1.0, 0.0, 0.0], "Answer", [])
+
+    assert env.client.delete(f"/api/pdf/{deleted}").status_code == 200
+
+    assert not cache.is_seeded(deleted)
+    assert cache.lookup(deleted, [1.0, 0.0, 0.0]) is None
+    assert cache.lookup(kept, [1.0, 0.0, 0.0]) is not None
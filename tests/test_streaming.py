@@ -0,0 +1,79 @@
+import json
+import sys
+from pathlib import Path
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.streaming import QuestionStreamParser, sse_event
+
+
+def question(text, explanation=""):
+    return {
+        "question": text,
+        "answers": [{"text": "Yes", "is_correct": True}, {"text": "No", "is_correct": False}],
+        "explanation": explanation
+    }
+
+
+def feed_in_pieces(text, size):
+    """Feed text in fixed-size fragments, returning every question and the fragment that completed it"""
+    parser = QuestionStreamParser()
+    found = []
+    for start in range(0, len(text), size):
+        for item in parser.feed(text[start:start + size]):
+            found.append((item, start))
+    return found
+
+
+QUESTIONS = [
+    question("What does {x} mean?", explanation='Braces } and "quotes" and a backslash \\ inside strings'),
+    question("Which bracket ] closes a list?"),
+    question("Is [this] {nested}?"),
+]
+
+
+def test_questions_are_returned_at_any_fragment_boundary():
+    text = json.dumps({"questions": QUESTIONS})
+    for size in (1, 2, 3, 7, 64, len(text)):
+        assert [item for item, _ in feed_in_pieces(text, size)] == QUESTIONS
+
+
+def test_each_question_is_returned_as_soon_as_it_closes():
+    text = json.dumps({"questions": QUESTIONS})
+    found = feed_in_pieces(text, 1)
+    ends = [text.index(json.dumps(q)) + len(json.dumps(q)) - 1 for q in QUESTIONS]
+    assert [offset for _, offset in found] == ends
+
+
+def test_bare_array_and_wrapped_array_give_the_same_questions():
+    assert [item for item, _ in feed_in_pieces(json.dumps(QUESTIONS), 5)] == QUESTIONS
+    assert [item for item, _ in feed_in_pieces(json.dumps({"questions": QUESTIONS}), 5)] == QUESTIONS
+
+
+def test_nested_objects_are_not_questions():
+    text = json.dumps({"questions": [{"question": "Q", "meta": {"source": {"page": 1}}, "answers": []}]})
+    assert [item for item, _ in feed_in_pieces(text, 4)] == [json.loads(text)["questions"][0]]
+
+
+def test_prose_and_fences_around_the_json_are_skipped():
+    body = json.dumps({"questions": QUESTIONS}, indent=2)
+    text = f"Here's your quiz about \"photosynthesis:\n```json\n{body}\n```\nLet me know if you'd like \"more."
+    for size in (1, 9, len(text)):
+        assert [item for item, _ in feed_in_pieces(text, size)] == QUESTIONS
+
+
+def test_unbalanced_quote_in_leading_prose_does_not_hide_questions():
+    text = 'She said "here you go: ' + json.dumps(QUESTIONS)
+    assert [item for item, _ in feed_in_pieces(text, 3)] == QUESTIONS
+
+
+def test_unparseable_question_is_returned_raw_and_single_quotes_are_repaired():
+    parser = QuestionStreamParser()
+    found = parser.feed("[{'question': 'Q1', 'answers': []}, {\"question\": \"Q2\",, }]")
+    assert found[0] == {"question": "Q1", "answers": []}
+    assert found[1] == '{"question": "Q2",, }'
+
+
+def test_sse_event_format():
+    assert sse_event("token", {"text": "a\nb"}) == 'event: token\ndata: {"text": "a\\nb"}\n\n'
@@ -0,0 +1,127 @@
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path so we can import app
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from app.services import retriever as retriever_module
+from app.services.document_store import EMBEDDINGS_FILENAME, DocumentStore
+from app.services.retriever import Retriever
+from app.services.topic_clusters import TopicClusters, cluster_topics
+
+
+def clustered_vectors(sizes, dimension=16, seed=0):
+    """Points scattered tightly around one axis per cluster, in document order, with their cluster labels"""
+    rng = np.random.default_rng(seed)
+    vectors, labels = [], []
+    for cluster, size in enumerate(sizes):
+        centre = np.zeros(dimension, dtype=np.float32)
+        centre[cluster] = 1.0
+        vectors.append(centre + rng.normal(0, 0.02, (size, dimension)).astype(np.float32))
+        labels.extend([cluster] * size)
+    return np.vstack(vectors), labels
+
+
+def test_topics_are_found_largest_first_with_a_member_as_representative():
+    vectors, labels = clustered_vectors([20, 40])
+    topics = cluster_topics(vectors, num_topics=2)
+
+    assert topics.sizes == [40, 20]
+    assert [labels[index] for index in topics.representatives] == [1, 0]
+    assert topics.centroids.shape == (2, 16)
+
+
+def test_topics_cover_every_chunk_once_and_are_deterministic():
+    vectors, _ = clustered_vectors([10, 30, 20, 5, 15])
+    topics = cluster_topics(vectors, num_topics=5)
+
+    assert sum(topics.sizes) == 80
+    assert topics.sizes == sorted(topics.sizes, reverse=True)
+    assert len(set(topics.representatives)) == len(topics.representatives)
+    assert len(topics.centroids) == len(topics.sizes)
+
+    again = cluster_topics(vectors, num_topics=5)
+    assert again.representatives == topics.representatives
+    assert again.sizes == topics.sizes
+
+
+def test_few_chunks_are_each_their_own_topic():
+    vectors, _ = clustered_vectors([2, 1])
+    topics = cluster_topics(vectors, num_topics=5)
+    assert topics.representatives == [0, 1, 2]
+    assert topics.sizes == [1, 1, 1]
+    assert topics.num_topics == 5
+
+
+def test_topic_chunks_are_scored_by_document_share():
+    topics = TopicClusters(3, np.zeros((3, 2), dtype=np.float32), [4, 0, 9], [6, 3, 1])
+    chunks = [{"text": f"chunk {i}"} for i in range(10)]
+
+    picked = topics.chunks(chunks)
+    assert [(chunk["chunk_index"], chunk["score"]) for chunk in picked] == [(4, 0.6), (0, 0.3), (9, 0.1)]
+    assert picked[0]["text"] == "chunk 4"
+    # Representatives past the end of a shorter chunk list are skipped
+    assert [chunk["chunk_index"] for chunk in topics.chunks(chunks[:5])] == [4, 0]
+
+
+def test_retriever_stores_topics_and_reclusters_when_vectors_change(tmp_path, monkeypatch):
+    retriever = Retriever(embedding_service=object(), resolve_storage=lambda pdf_id: pdf_id)
+    retriever.pdfs_dir = str(tmp_path)
+    retriever.store = DocumentStore(str(tmp_path))
+    vectors, labels = clustered_vectors([12, 8, 4])
+    retriever.store.write_document("doc", [{"text": f"chunk {i}"} for i in range(len(vectors))], vectors)
+
+    calls = []
+
+    def counting_cluster(embeddings, num_topics):
+        calls.append(len(embeddings))
+        return cluster_topics(embeddings, num_topics)
+
+    monkeypatch.setattr(retriever_module, "cluster_topics", counting_cluster)
+    try:
+        picked = retriever.get_topic_chunks("doc", num_topics=3)
+        assert [labels[chunk["chunk_index"]] for chunk in picked] == [0, 1, 2]
+        assert calls == [24]
+
+        # Read back from disk in a fresh worker instead of clustering again
+        retriever.invalidate("doc")
+        assert retriever.get_topic_chunks("doc", num_topics=3) == picked
+        assert calls == [24]
+
+        # A different number of topics, or different vectors, is clustered again
+        assert len(retriever.get_topic_chunks("doc", num_topics=2)) == 2
+        assert calls == [24, 24]
+
+        # Re-ingested with the same number of chunks but different vectors
+        changed, _ = clustered_vectors([12, 8, 4], seed=2)
+        retriever.store.write_document("doc", [{"text": f"chunk {i}"} for i in range(len(changed))], changed)
+        retriever.invalidate("doc")
+        retriever.get_topic_chunks("doc", num_topics=3)
+        assert calls == [24, 24, 24]
+
+        more, _ = clustered_vectors([12, 8, 4, 6], seed=1)
+        retriever.store.write_document("doc", [{"text": f"chunk {i}"} for i in range(len(more))], more)
+        retriever.invalidate("doc")
+        assert len(retriever.get_topic_chunks("doc", num_topics=4)) == 4
+        assert calls == [24, 24, 24, 30]
+    finally:
+        retriever.delete_document("doc")
+
+
+def test_documents_without_matching_vectors_get_evenly_spaced_chunks(tmp_path):
+    retriever = Retriever(embedding_service=object(), resolve_storage=lambda pdf_id: pdf_id)
+    retriever.pdfs_dir = str(tmp_path)
+    retriever.store = DocumentStore(str(tmp_path))
+    vectors, _ = clustered_vectors([12])
+    retriever.store.write_document("doc", [{"text": f"chunk {i}"} for i in range(12)], vectors)
+    os.remove(tmp_path / "doc" / EMBEDDINGS_FILENAME)
+
+    try:
+        picked = retriever.get_topic_chunks("doc", num_topics=4)
+        assert [(chunk["chunk_index"], chunk["score"]) for chunk in picked] == [(0, 1.0), (3, 1.0), (6, 1.0), (9, 1.0)]
+    finally:
+        retriever.delete_document("doc")